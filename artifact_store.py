@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Typed, lossless storage of everything a game's pipeline produced. Unlike the str() blobs in the
+# picks spreadsheet (which Excel truncates at 32,767 characters and which need ast.literal_eval to
+# read back), nested outputs are stored as zlib-compressed JSON, long-form text as TEXT, and the
+# expert responses and official picks get tables of their own. Backtests can then pull just the
+# columns they need.
+
+nested_columns = ["adv_stats", "game_data", "lineups", "perplexity_analysis", "consensus_pick", "stage_timings"]
+text_columns = ["adv_stats_analysis", "game_analysis", "lineup_analysis", "odds", "discord_message"]
+
+schema = f"""
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    league TEXT NOT NULL,
+    week INTEGER NOT NULL,
+    away TEXT NOT NULL,
+    home TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    {", ".join(f"{column} BLOB" for column in nested_columns)},
+    {", ".join(f"{column} TEXT" for column in text_columns)}
+);
+CREATE TABLE IF NOT EXISTS experts (
+    game_id TEXT NOT NULL REFERENCES games(game_id),
+    expert TEXT NOT NULL,
+    response TEXT,
+    PRIMARY KEY (game_id, expert)
+);
+CREATE TABLE IF NOT EXISTS picks (
+    game_id TEXT NOT NULL REFERENCES games(game_id),
+    market TEXT NOT NULL,
+    pick TEXT,
+    units REAL,
+    reasoning TEXT,
+    PRIMARY KEY (game_id, market)
+);
+CREATE INDEX IF NOT EXISTS games_by_week ON games (league, week);
+"""
+
+
+def compress(value):
+    if value is None:
+        return None
+    return zlib.compress(json.dumps(value).encode("utf-8"))
+
+
+def decompress(blob):
+    if blob is None:
+        return None
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def parse_units(units):
+    # experts and the consensus step don't always return a bare number (e.g. "2.5 units")
+    try:
+        return float(str(units).split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+class ArtifactStore:
+    def __init__(self, path="picks/artifacts.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(schema)
+            # a database made before a column was added gets it now
+            existing = {column[1] for column in conn.execute("PRAGMA table_info(games)")}
+            for column in nested_columns + text_columns:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE games ADD COLUMN {column} {'BLOB' if column in nested_columns else 'TEXT'}")
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save_game(self, league, week, away, home, artifacts, expert_dict, consensus_pick):
+        # artifacts maps games-table columns to the stage outputs; anything a league doesn't produce
+        # (e.g. lineups for CFB) is left NULL
+        game_id = f"{league}-{week}-{away}-{home}"
+        row = {"game_id": game_id, "league": league, "week": int(week), "away": away, "home": home, "saved_at": time.time()}
+        for column in nested_columns:
+            row[column] = compress(artifacts.get(column))
+        for column in text_columns:
+            value = artifacts.get(column)
+            row[column] = None if value is None else str(value)
+
+        official_picks = (consensus_pick or {}).get("official_picks", {})
+        picks = [
+            (game_id, market, str(official_picks[market].get("Pick")), parse_units(official_picks[market].get("Units")), official_picks[market].get("Reasoning"))
+            for market in ["Moneyline", "Spread", "Total"]
+            if market in official_picks
+        ]
+
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO games ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                list(row.values()),
+            )
+            conn.execute("DELETE FROM experts WHERE game_id = ?", (game_id,))
+            conn.executemany(
+                "INSERT INTO experts (game_id, expert, response) VALUES (?, ?, ?)",
+                # structured expert picks are stored as JSON, older text responses as they are
+                [(game_id, expert, response if isinstance(response, str) else json.dumps(response)) for expert, response in expert_dict.items()],
+            )
+            conn.execute("DELETE FROM picks WHERE game_id = ?", (game_id,))
+            conn.executemany("INSERT INTO picks (game_id, market, pick, units, reasoning) VALUES (?, ?, ?, ?, ?)", picks)
+        return game_id
+
+    def load_games(self, columns=None, league=None, week=None):
+        # only the requested columns are read (and decompressed)
+        columns = columns or nested_columns + text_columns
+        select = ["game_id", "league", "week", "away", "home"] + [c for c in columns if c in nested_columns + text_columns]
+        query = f"SELECT {', '.join(select)} FROM games"
+        where, params = [], []
+        if league is not None:
+            where.append("league = ?")
+            params.append(league)
+        if week is not None:
+            where.append("week = ?")
+            params.append(int(week))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        with self.connect() as conn:
+            games = pd.read_sql_query(query, conn, params=params)
+        for column in select:
+            if column in nested_columns:
+                games[column] = games[column].apply(decompress)
+        return games
+
+    def load_experts(self, game_id=None):
+        with self.connect() as conn:
+            if game_id is None:
+                return pd.read_sql_query("SELECT * FROM experts", conn)
+            return pd.read_sql_query("SELECT * FROM experts WHERE game_id = ?", conn, params=[game_id])
+
+    def load_picks(self, league=None, week=None):
+        query = "SELECT g.league, g.week, g.away, g.home, p.* FROM picks p JOIN games g USING (game_id)"
+        where, params = [], []
+        if league is not None:
+            where.append("g.league = ?")
+            params.append(league)
+        if week is not None:
+            where.append("g.week = ?")
+            params.append(int(week))
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        with self.connect() as conn:
+            return pd.read_sql_query(query, conn, params=params)
@@ -0,0 +1,304 @@
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from game_data_parser import convert_floats
+from pff_parser import parse_pff_data
+from sumer_parser import parse_adv_analytics
+
+# Checks the fast parsers against the versions they replaced and times both on saved pages. The
+# reference implementations live here rather than next to the parsers so main_nfl and main_cfb never
+# import them. Run it with the parser to check and, optionally, the saved inputs to use:
+#   python bench_parsers.py pff [game directories]
+#   python bench_parsers.py sumer [.html pages]
+#   python bench_parsers.py game_data [gameData JSON files]
+
+
+def parse_pff_data_bs4(greenline_data, lineups1_data, lineups2_data):
+    def parse_table(soup, table_name):
+        if table_name == "Team Metrics":
+            table = soup.find('table', class_="m-matchup-table g-table g-table--compressed")
+        elif table_name == "QB Comparison":
+            table = soup.find_all('table', class_="m-matchup-table g-table g-table--compressed")[-1]
+        else:
+            table = soup.find('h3', string=table_name).find_parent('table')
+        rows = table.find_all('tr')[1:]  # Skip header row
+        data = {}
+        for row in rows:
+            cells = row.find_all(['th', 'td'])
+            key = cells[0].text.strip().replace(' ', '_')
+            away_value = cells[1].text.strip()
+            home_value = cells[2].text.strip()
+            data[key] = {away: away_value, home: home_value}
+
+        if table_name == "Total":
+            for key in data:
+                data[key] = {"under": data[key][away], "over": data[key][home]}
+
+        return data
+
+    def parse_injuries(soup):
+        try:
+            injuries = {away: [], home: []}
+            injury_tables = soup.find_all('table', class_='m-matchup-table g-table g-table--compressed')
+            for i, table in enumerate(injury_tables[2:4]):  # Last two tables are injury tables
+                team = away if i == 0 else home
+                rows = table.find_all('tr')[1:]  # Skip header row
+                for row in rows:
+                    cells = row.find_all('td')
+                    injury_data = {
+                        "name": cells[0].text.strip(),
+                        "position": cells[1].text.strip(),
+                        "injury": cells[2].text.strip(),
+                        "status": cells[3].text.strip(),
+                        "grade": float(cells[4].find('div', class_='kyber-grade-badge__info-text').text.strip()),
+                        "pos_war_rank": cells[5].text.strip()
+                    }
+                    injuries[team].append(injury_data)
+        except Exception as e:
+            injuries = None
+        return injuries
+
+    def parse_lineups(lineups, home, away, home_offense = True):
+
+        def parse_depth_chart(html_content):
+            soup = BeautifulSoup(html_content, 'html.parser')
+            offense = {}
+            defense = {}
+
+            positions = soup.find_all('div', class_='depth-chart__position')
+            for position in positions:
+                position_key = position['data-position-key']
+                position_title = position['title']
+                players = position.find_all('div', class_='depth-chart__player')
+
+                player_data = {
+                    'title': position_title,
+                    'players': [parse_player(player) for player in players]
+                }
+
+                if is_offensive_position(position_key):
+                    offense[position_key] = player_data
+                else:
+                    defense[position_key] = player_data
+
+            return {'offense': offense, 'defense': defense}
+
+        def is_offensive_position(position):
+            offensive_positions = ['QB', 'RB', 'FB', 'WR', 'TE', 'OL', 'C', 'G', 'T', 'LT', 'LG', 'RT', 'RG', 'HB']
+            defensive_positions = ['DE', 'DT', 'LB', 'CB', 'S', 'DL', 'DB']
+
+            if any(pos in position for pos in defensive_positions):
+                return False
+            elif any(pos in position for pos in offensive_positions):
+                return True
+            else:
+                # If position is not clearly offensive or defensive, assume it's defensive
+                return False
+
+        def parse_player(player_div):
+            jersey_number = player_div.find('span', class_='player-team-colors__number').text.strip().strip('#')
+            name = player_div.find('span', class_='player-jersey__name').contents[0].strip()
+
+            grade_div = player_div.find('div', class_='kyber-grade-badge__info-text')
+            grade = grade_div.text.strip() if grade_div else None
+
+            rank_p = player_div.find('p', class_='m-micro-copy')
+            if rank_p:
+                rank_text = rank_p.text.strip()
+                rank_match = re.search(r'(\d+)(?:st|nd|rd|th)\s*/\s*(\d+)\s*(\w+)', rank_text)
+                if rank_match:
+                    rank, total, position = rank_match.groups()
+                else:
+                    rank, total, position = None, None, None
+            else:
+                rank, total, position = None, None, None
+
+            return {
+                'name': name,
+                'grade': grade,
+                'position_rank': rank,
+                'overall_rank': total,
+            }
+
+        depth_chart = parse_depth_chart(lineups)
+        # rename offense key
+        if home_offense:
+            depth_chart[home + '-offense'] = depth_chart.pop('offense')
+            # rename defense key
+            depth_chart[away + '-defense'] = depth_chart.pop('defense')
+        else:
+            depth_chart[away + '-offense'] = depth_chart.pop('offense')
+            depth_chart[home + '-defense'] = depth_chart.pop('defense')
+
+        return depth_chart
+
+    soup = BeautifulSoup(greenline_data, 'html.parser')
+    away = str(soup.find_all("span", class_="sr-only")[0].text)
+    home = str(soup.find_all("span", class_="sr-only")[1].text)
+    game_data = {
+        "teams": {
+            "away": away,
+            "home": home
+        },
+        "spread": parse_table(soup, "Spread"),
+        "moneyline": parse_table(soup, "Moneyline"),
+        "total": parse_table(soup, "Total"),
+        "impact_player_injuries": parse_injuries(soup),
+        "game_metrics": parse_table(soup, "Team Metrics"),
+        'qb_comparison': parse_table(soup, "QB Comparison")
+    }
+    # parse lineups
+    lineups1_json = parse_lineups(lineups1_data, home, away, home_offense = True)
+    lineups2_json = parse_lineups(lineups2_data, home, away, home_offense = False)
+    # combine the two lineups
+    lineups = {**lineups1_json, **lineups2_json}
+    return game_data, lineups
+
+
+def parse_adv_analytics_reparse(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    stat_tables = soup.find_all('div', class_='stat-table')
+    off_v_def = soup.find('div', class_='game-comparison-off-vs-def')
+    def_v_off = soup.find('div', class_='game-comparison-def-vs-off')
+
+    away_team = (soup.find_all('h2')[2].text).replace(' Statistics', '')
+    home_team = (soup.find_all('h2')[-1].text).replace(' Statistics', '')
+
+    away_stats = stat_tables[0:7]
+    home_stats = stat_tables[7:]
+
+    def parse_stat_tables(stats, team):
+        result = {"Team Stats": "Team Stats", team: []}
+        for table_html in stats:
+            table_soup = BeautifulSoup(str(table_html), 'html.parser')
+            table_dict = {}
+            for div in table_soup.find_all('div', class_=['stat-total', 'stat-offense', 'stat-defense']):
+                label = div.find('div', class_='label').text
+                value = div.find('div', class_='value').text
+                rank = div.find('div', class_='rank').text
+                rank = int(rank.strip('th').strip('st').strip('nd').strip('rd'))
+                table_dict[label] = {'value': value, 'rank': rank}
+            result[team].append(table_dict)
+        return result
+
+    def parse_game_comparison(html_content, home_team, away_team, table_type):
+        title = html_content.find('h2').text
+        if table_type == 'off_v_def':
+            title = title.replace('Offense', away_team + ' Offense').replace('Defense', home_team + ' Defense')
+        elif table_type == 'def_v_off':
+            title = title.replace('Offense', home_team + ' Offense').replace('Defense', away_team + ' Defense')
+
+        result = {"title": title, "comparisons": []}
+        comparison_soup = BeautifulSoup(str(html_content), 'html.parser')
+        rows = comparison_soup.find_all('div', class_='game-table-row')
+
+        for row in rows:
+            cells = row.find_all('div', class_='game-table-cell')
+            comparison = {
+                'stat': cells[2].text,
+                away_team + (" Offense" if table_type == 'off_v_def' else ' Defense'): {
+                    'rank': cells[0].text.strip('th').strip('st').strip('nd').strip('rd'),
+                    'value': cells[1].text
+                },
+                home_team + (" Defense" if table_type == 'off_v_def' else ' Offense'): {
+                    'rank': cells[4].text.strip('th').strip('st').strip('nd').strip('rd'),
+                    'value': cells[3].text
+                }
+            }
+            result['comparisons'].append(comparison)
+
+        return result
+
+    home_stats_json = parse_stat_tables(home_stats, home_team)
+    away_stats_json = parse_stat_tables(away_stats, away_team)
+    team_stats = {'title': "Advanced Analytics", home_team: home_stats_json[home_team], away_team: away_stats_json[away_team]}
+
+    off_v_def_comparison = parse_game_comparison(off_v_def, home_team, away_team, 'off_v_def')
+    def_v_off_comparison = parse_game_comparison(def_v_off, home_team, away_team, 'def_v_off')
+
+    combined_stats = {
+        "team_stats": team_stats,
+        "comparisons": {
+            "offense_vs_defense": off_v_def_comparison,
+            "defense_vs_offense": def_v_off_comparison
+        }
+    }
+
+    return combined_stats
+
+
+def convert_floats_recursive(obj):
+    if isinstance(obj, dict):
+        return {k: convert_floats_recursive(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_floats_recursive(v) for v in obj]
+    elif isinstance(obj, str):
+        try:
+            float_value = float(obj)
+            formatted = f"{float_value:.4f}"
+            if formatted.endswith('.0000'):
+                return int(float_value)
+            return formatted
+        except ValueError:
+            return obj
+    else:
+        return obj
+
+
+def benchmark(paths, read, reference, fast, repeat=5):
+    # times both parsers on each input (best of `repeat`) and checks they agree; `read` is called
+    # before every run, outside the timing, since convert_floats changes its input in place
+    for path in paths:
+        timings = {}
+        outputs = {}
+        for name, parser in [("reference", reference), ("fast", fast)]:
+            best = None
+            for _ in range(repeat):
+                args = read(path)
+                start = time.perf_counter()
+                outputs[name] = parser(*args)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+
+        same = outputs["reference"] == outputs["fast"]
+        print(f"{path}: {reference.__name__} {timings['reference'] * 1000:.1f}ms, {fast.__name__} {timings['fast'] * 1000:.1f}ms "
+              f"({timings['reference'] / timings['fast']:.1f}x){'' if same else ' OUTPUT DIFFERS'}")
+
+
+def read_text(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def read_pff_pages(directory):
+    return [read_text(os.path.join(directory, f'NFL Scores ({i}).html')) for i in (1, 2, 3)]
+
+
+def read_game_data(path):
+    return [json.loads(read_text(path))]
+
+
+benches = {
+    "pff": (parse_pff_data_bs4, parse_pff_data, read_pff_pages,
+            lambda: sorted(os.path.dirname(path) for path in glob.glob('nfl/week*/*/NFL Scores (1).html'))),
+    "sumer": (parse_adv_analytics_reparse, parse_adv_analytics, lambda path: [read_text(path)],
+              lambda: sorted(glob.glob('nfl/week*/sumer/*.html'))),
+    # checkpointed game_data files are already normalized, but still exercise the same string paths
+    "game_data": (convert_floats_recursive, convert_floats, read_game_data,
+                  lambda: sorted(glob.glob('cfb/week*/*/checkpoints/game_data.json'))),
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benches:
+        print(f"usage: python bench_parsers.py {{{'|'.join(benches)}}} [paths...]")
+        sys.exit(1)
+    reference, fast, read, default_paths = benches[sys.argv[1]]
+    benchmark(sys.argv[2:] or default_paths(), read, reference, fast)
@@ -0,0 +1,86 @@
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+
+# A bounded pool of warm headless browser sessions shared by every game in the process. Starting
+# Chrome costs seconds and hundreds of MB, so sessions are handed back after each page instead of
+# quit. A session is health-checked before it's reused, recycled after max_pages pages, and thrown
+# away if anything goes wrong while it's checked out, so a bad page can't leak or poison it.
+
+
+class BrowserPool:
+    def __init__(self, make_driver, size=3, max_pages=25):
+        self.make_driver = make_driver
+        self.size = size
+        self.max_pages = max_pages
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+        self.pages = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    @contextmanager
+    def session(self):
+        self.slots.acquire()
+        driver = None
+        try:
+            driver = self.checkout()
+            yield driver
+        except BaseException:
+            self.discard(driver)
+            driver = None
+            raise
+        finally:
+            if driver is not None:
+                self.checkin(driver)
+            self.slots.release()
+
+    def checkout(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                driver = self.make_driver()
+                with self.lock:
+                    self.pages[id(driver)] = 0
+                return driver
+            if self.healthy(driver):
+                return driver
+            print("Browser session failed health check, replacing it")
+            self.discard(driver)
+
+    def checkin(self, driver):
+        with self.lock:
+            self.pages[id(driver)] += 1
+            worn_out = self.pages[id(driver)] >= self.max_pages
+        if worn_out:
+            self.discard(driver)
+        else:
+            self.idle.put(driver)
+
+    @staticmethod
+    def healthy(driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def discard(self, driver):
+        if driver is None:
+            return
+        with self.lock:
+            self.pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
@@ -0,0 +1,303 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+import anthropic
+import httpx
+
+from rate_limit import limiters, retry_after_seconds
+from usage import labelled, labels, usage_log
+
+# Each Claude-calling stage is written as a generator: it yields the keyword arguments for every
+# messages.create call it needs and gets the response back from the yield, then returns its final
+# output. That way the prompts live in one place and the same stage can be driven by the blocking
+# client (run_claude), by the MessageBatcher in --batch runs, or awaited on a ClaudeLoop's event loop
+# (run_claude_async).
+
+
+class MessageBatcher:
+    # Stands in for the Anthropic client in --batch runs. Every messages.create request from every
+    # game's threads is queued; once no new request has come in for `window` seconds the queue goes out
+    # as one Message Batch, and each caller gets its Message back when that batch has ended. With the
+    # whole slate running at once, each layer of the pipeline (analyses, experts, consensus, Discord)
+    # ends up in a batch of its own. Batches are billed at half price but can take up to a day.
+    def __init__(self, client, window=30, poll_interval=60):
+        self.client = client
+        self.window = window
+        self.poll_interval = poll_interval
+        self.lock = threading.Condition()
+        self.queue = []
+        self.last_request = 0
+        self.ids = itertools.count()
+        self.flusher = None
+
+    def create(self, request):
+        future = Future()
+        with self.lock:
+            self.queue.append((f"request-{next(self.ids)}", request, future, labels.get()))
+            self.last_request = time.monotonic()
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.flush_when_quiet, daemon=True)
+                self.flusher.start()
+            self.lock.notify()
+        return future.result()
+
+    def flush_when_quiet(self):
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.lock.wait()
+                while time.monotonic() - self.last_request < self.window:
+                    self.lock.wait(self.window - (time.monotonic() - self.last_request))
+                pending, self.queue = self.queue, []
+            # batches are polled on their own threads, so a layer that's ready doesn't wait on another
+            threading.Thread(target=self.run_batch, args=(pending,), daemon=True).start()
+
+    def run_batch(self, pending):
+        waiting = {custom_id: (future, tags) for custom_id, _, future, tags in pending}
+        try:
+            start = time.perf_counter()
+            batch = self.client.messages.batches.create(
+                requests=[{"custom_id": custom_id, "params": request} for custom_id, request, _, _ in pending]
+            )
+            print(f"Submitted message batch {batch.id} with {len(pending)} requests")
+            while batch.processing_status != "ended":
+                time.sleep(self.poll_interval)
+                batch = self.client.messages.batches.retrieve(batch.id)
+            print(f"Message batch {batch.id} ended after {time.perf_counter() - start:.0f}s: {batch.request_counts}")
+            for entry in self.client.messages.batches.results(batch.id):
+                future, tags = waiting.pop(entry.custom_id, (None, None))
+                if future is None:
+                    continue
+                if entry.result.type == "succeeded":
+                    with labelled(**tags):
+                        usage_log.record_claude(entry.result.message, time.perf_counter() - start, batch=True)
+                    future.set_result(entry.result.message)
+                else:
+                    detail = getattr(entry.result, "error", None)
+                    future.set_exception(RuntimeError(f"Batch request {entry.custom_id} {entry.result.type}: {detail}"))
+            for future, _ in waiting.values():
+                future.set_exception(RuntimeError(f"Request missing from the results of batch {batch.id}"))
+        except Exception as e:
+            for future, _ in waiting.values():
+                if not future.done():
+                    future.set_exception(e)
+
+
+class ClaudeLoop:
+    # Stands in for the Anthropic client in --event-loop runs. One event loop runs on a thread of its
+    # own, with one AsyncAnthropic and its pool of keep-alive connections. An async client's pool
+    # belongs to the loop it was first used on, so the client is made on this loop and only ever used
+    # there. Game threads hand their requests over with create(), and the expert panel runs as tasks on
+    # the loop (gather_experts_async), so dozens of requests from across the slate share a few
+    # connections without a thread waiting on each call.
+    def __init__(self, api_key, max_connections=50, max_keepalive_connections=20, keepalive_expiry=60, **client_options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        async def new_client():
+            return anthropic.AsyncAnthropic(
+                api_key = api_key,
+                http_client = anthropic.DefaultAsyncHttpxClient(
+                    limits = httpx.Limits(
+                        max_connections = max_connections,
+                        max_keepalive_connections = max_keepalive_connections,
+                        keepalive_expiry = keepalive_expiry,
+                    )
+                ),
+                **client_options,
+            )
+        self.client = self.run(new_client())
+
+    def run(self, coroutine):
+        # call from any thread but the loop's own. The task starts from a copy of the calling thread's
+        # context, so its usage labels (game, stage) come along
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def create(self, request, stream=False, stop_when=None):
+        return self.run(create_message_async(self.client, request, stream, stop_when))
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+max_rate_limit_retries = 5
+
+
+def stream_message(client, request, stop_when=None):
+    # returns the message, the seconds until its first token and, if stop_when cut it off, the text
+    # streamed so far. stop_when(text) is checked as the text comes in; once it's true the stream is
+    # closed, which stops the generation, and the message so far is returned (its stop_reason is None)
+    start = time.perf_counter()
+    first_token = None
+    with client.messages.stream(**request) as stream:
+        text = ""
+        for chunk in stream.text_stream:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            text += chunk
+            if stop_when is not None and stop_when(text):
+                print(f"Stopped the response early after {len(text)} characters")
+                return stream.current_message_snapshot, first_token, text
+        return stream.get_final_message(), first_token, None
+
+
+async def stream_message_async(client, request, stop_when=None):
+    start = time.perf_counter()
+    first_token = None
+    async with client.messages.stream(**request) as stream:
+        text = ""
+        async for chunk in stream.text_stream:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            text += chunk
+            if stop_when is not None and stop_when(text):
+                print(f"Stopped the response early after {len(text)} characters")
+                return stream.current_message_snapshot, first_token, text
+        return await stream.get_final_message(), first_token, None
+
+
+def message_text(message):
+    # the text of a response, without the SDK's TextBlock repr around it
+    return "".join(block.text for block in message.content if block.type == "text")
+
+
+def estimate_tokens(text):
+    # roughly four characters per token for English prose
+    return len(text) // 4 + 1
+
+
+def longer_than(limit):
+    # stop_when for output with a hard length cap, e.g. a Discord message; once past the cap the
+    # response gets thrown away anyway
+    return lambda text: len(text) > limit
+
+
+def record_usage(message, seconds, first_token, stopped_text):
+    if stopped_text is None:
+        usage_log.record_claude(message, seconds, first_token_seconds=first_token)
+    else:
+        # a stopped stream never gets its final output count, so estimate it from the text
+        usage_log.record_claude(message, seconds, first_token_seconds=first_token,
+                                output_tokens=estimate_tokens(stopped_text), truncated=True)
+
+
+def create_message(client, request, stream=False, stop_when=None):
+    # the SDK already retries a 429 a couple of times; if it still gives up, pause every Claude call
+    # in the process for the Retry-After and go again
+    if isinstance(client, ClaudeLoop):
+        return client.create(request, stream, stop_when)
+    if isinstance(client, MessageBatcher):
+        # batches can't stream; the stage gets the whole response a little later instead
+        return client.create(request)
+    limiter = limiters["anthropic"]
+    for attempt in range(max_rate_limit_retries + 1):
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            if stream or stop_when is not None:
+                message, first_token, stopped_text = stream_message(client, request, stop_when)
+            else:
+                message, first_token, stopped_text = client.messages.create(**request), None, None
+            record_usage(message, time.perf_counter() - start, first_token, stopped_text)
+            return message
+        except anthropic.RateLimitError as e:
+            if attempt == max_rate_limit_retries:
+                raise
+            wait = retry_after_seconds(e.response.headers)
+            print(f"Claude rate limited, waiting {wait:.0f}s")
+            limiter.backoff(wait)
+
+
+async def create_message_async(client, request, stream=False, stop_when=None):
+    # create_message for an AsyncAnthropic, on the loop it belongs to
+    limiter = limiters["anthropic"]
+    for attempt in range(max_rate_limit_retries + 1):
+        await limiter.acquire_async()
+        start = time.perf_counter()
+        try:
+            if stream or stop_when is not None:
+                message, first_token, stopped_text = await stream_message_async(client, request, stop_when)
+            else:
+                message, first_token, stopped_text = await client.messages.create(**request), None, None
+            record_usage(message, time.perf_counter() - start, first_token, stopped_text)
+            return message
+        except anthropic.RateLimitError as e:
+            if attempt == max_rate_limit_retries:
+                raise
+            wait = retry_after_seconds(e.response.headers)
+            print(f"Claude rate limited, waiting {wait:.0f}s")
+            limiter.backoff(wait)
+
+
+def prime_cache(stage, client):
+    # send just the stage's first request, cut off after one output token, so its cache_control
+    # prefix is written before a panel of identical requests goes out together; requests that are in
+    # flight at the same time can't read each other's cache entries
+    request = next(stage)
+    stage.close()
+    return create_message(client, {**request, "max_tokens": 1})
+
+
+async def prime_cache_async(stage, client):
+    request = next(stage)
+    stage.close()
+    return await create_message_async(client, {**request, "max_tokens": 1})
+
+
+def cached_create(client, request, cache, stream=False, stop_when=None):
+    # messages are stored as plain JSON and turned back into a Message, so the stage parses a cached
+    # response exactly like a fresh one
+    if cache is None:
+        return create_message(client, request, stream, stop_when)
+    key = cache.key(request.get("model"), request.get("temperature"), request.get("system"), request["messages"], request.get("tools"), request.get("tool_choice"))
+    cached = cache.get(key)
+    if cached is not None:
+        return anthropic.types.Message.model_validate(cached)
+    message = create_message(client, request, stream, stop_when)
+    if message.stop_reason is not None:
+        # a response that was stopped early isn't the model's answer to this request
+        cache.set(key, message.model_dump(mode="json"))
+    return message
+
+
+async def cached_create_async(client, request, cache, stream=False, stop_when=None):
+    if cache is None:
+        return await create_message_async(client, request, stream, stop_when)
+    key = cache.key(request.get("model"), request.get("temperature"), request.get("system"), request["messages"], request.get("tools"), request.get("tool_choice"))
+    cached = cache.get(key)
+    if cached is not None:
+        return anthropic.types.Message.model_validate(cached)
+    message = await create_message_async(client, request, stream, stop_when)
+    if message.stop_reason is not None:
+        cache.set(key, message.model_dump(mode="json"))
+    return message
+
+
+def run_claude(stage, client, cache=None, stream=False, stop_when=None):
+    # pass a ResponseCache only for deterministic stages; the expert panel relies on getting a
+    # different answer from every call. stream=True streams each response and records the time to
+    # its first token; stop_when(text) also streams, and cuts a response off as soon as it returns
+    # true
+    try:
+        request = next(stage)
+        while True:
+            request = stage.send(cached_create(client, request, cache, stream, stop_when))
+    except StopIteration as done:
+        return done.value
+
+
+async def run_claude_async(stage, client, cache=None, stream=False, stop_when=None):
+    # run_claude with an AsyncAnthropic, for code already running on its loop (e.g. a ClaudeLoop's
+    # expert panel)
+    try:
+        request = next(stage)
+        while True:
+            request = stage.send(await cached_create_async(client, request, cache, stream, stop_when))
+    except StopIteration as done:
+        return done.value
@@ -0,0 +1,301 @@
+import ast
+import glob
+import math
+import re
+import sys
+from collections import Counter
+
+# The expert panel's consensus, worked out in code. The consensus prompt only ever asked Claude to tally
+# the experts' picks and average their units, which cost a 5000-token generation per game and came back
+# as JSON that didn't always load. Here each expert's response is read into pick records, and each market
+# goes to the option with the most votes (No Bet counts as an option, and a tie means No Bet), as long
+# as a majority of the whole panel backs it, at the backers' mean units rounded to the nearest 0.5.
+# A moneyline isn't bet when the game's price for that team is outside -200/+200, or when there's no
+# price to check, and only one of Moneyline and Spread is. The result has the same shape the consensus
+# prompt asked for, so the Discord stage and the picks files read it as before. Run this file on saved
+# picks spreadsheets to compare against the picks the consensus prompt made.
+
+markets = ["Moneyline", "Spread", "Total"]
+exclusive_markets = ["Moneyline", "Spread"]
+max_units = 5
+moneyline_band = 200
+no_bet = "No Bet"
+no_bet_words = {"no bet", "none", "pass", "n/a", "no pick", "no play"}
+# short names the schedules use for teams the experts write out in full
+team_aliases = {"bucs": "buccaneers", "jags": "jaguars", "niners": "49ers"}
+
+market_pattern = re.compile(r'"(Moneyline|Spread|Total)"\s*:')
+# a field's value as the experts write it: ["..."], [...] without quotes, "..." or a bare number
+value_pattern = r'\s*:\s*(\[(?:[^\[\]]|\[[^\]]*\])*\]|"(?:[^"\\]|\\.)*"|[^,}\n]+)'
+field_patterns = {field: re.compile(f'"{field}"{value_pattern}') for field in ["Pick", "Units", "Summary"]}
+number_pattern = re.compile(r'\d+(?:\.\d+)?')
+price_pattern = re.compile(r'(?<![\d.])([+-]\d{3,4})(?![\d.])')
+word_pattern = re.compile(r'[a-z0-9&]+')
+moneyline_section_pattern = re.compile(r'moneyline:?[ \t]*\n(.*?)(?:\n[ \t]*\n|spread|$)', re.IGNORECASE | re.DOTALL)
+
+
+def unwrap(response):
+    # expert responses are kept as the repr of the SDK's content list with the TextBlock wrapper
+    # stripped off, so they still carry the repr's quotes and escapes
+    text = str(response).strip()
+    if len(text) > 1 and text[0] == text[-1] and text[0] in "'\"":
+        try:
+            return ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            text = text[1:-1]
+    return text.replace("\\n", "\n").replace("\\'", "'").replace('\\"', '"')
+
+
+def field_value(raw):
+    raw = raw.strip()
+    if raw[:1] in "[\"" and raw[-1:] in "]\"":
+        raw = raw[1:-1]
+    return raw.strip().strip('"').strip()
+
+
+def parse_units(value):
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = number_pattern.search(str(value))
+    return float(match.group()) if match else 0.0
+
+
+def find_field(value, field):
+    # depth-first, since the expert format puts Pick and Units inside "Analysis" as often as next to it
+    if isinstance(value, dict):
+        if field in value:
+            return value[field]
+        for item in value.values():
+            found = find_field(item, field)
+            if found is not None:
+                return found
+    return None
+
+
+def parse_expert_picks(response):
+    # {market: {"pick", "units", "summary"}} for one expert. Most responses aren't valid JSON (values in
+    # unquoted brackets, the Analysis braces left open), so the fields are read from each market's span
+    # of the text; a response that has already been parsed into a dict is read directly.
+    picks = {}
+    if isinstance(response, dict):
+        for market in markets:
+            section = response.get(market) or {}
+            picks[market] = {
+                "pick": str(find_field(section, "Pick") or no_bet).strip(),
+                "units": parse_units(find_field(section, "Units")),
+                "summary": str(find_field(section, "Summary") or "").strip(),
+            }
+        return picks
+
+    text = unwrap(response)
+    starts = [(match.group(1), match.start()) for match in market_pattern.finditer(text)]
+    for i, (market, start) in enumerate(starts):
+        if market in picks:
+            continue
+        end = starts[i + 1][1] if i + 1 < len(starts) else len(text)
+        section = text[start:end]
+        fields = {}
+        for field, pattern in field_patterns.items():
+            match = pattern.search(section)
+            fields[field] = field_value(match.group(1)) if match else None
+        picks[market] = {"pick": fields["Pick"] or no_bet, "units": parse_units(fields["Units"]), "summary": fields["Summary"] or ""}
+    for market in markets:
+        picks.setdefault(market, {"pick": no_bet, "units": 0.0, "summary": ""})
+    return picks
+
+
+def is_no_bet(pick):
+    text = pick.lower().strip(" .")
+    return not text or text in no_bet_words or text.startswith("no bet")
+
+
+def words(text):
+    found = set(word_pattern.findall(text.lower()))
+    return found | {team_aliases[word] for word in found if word in team_aliases}
+
+
+def side(market, pick, home, away):
+    # which way a pick goes: "Over"/"Under" for totals, the team for the other markets, None if it
+    # can't be told (and then it doesn't count as a vote)
+    if is_no_bet(pick):
+        return no_bet
+    if market == "Total":
+        pick_words = words(pick)
+        if ("over" in pick_words) == ("under" in pick_words):
+            return None
+        return "Over" if "over" in pick_words else "Under"
+    # the team the pick shares the most name words with, e.g. "Tampa Bay Buccaneers +114" -> Buccaneers
+    pick_words = words(pick)
+    home_score = len(words(home) & pick_words)
+    away_score = len(words(away) & pick_words)
+    if home_score == away_score:
+        return None
+    return home if home_score > away_score else away
+
+
+def round_units(units):
+    # nearest 0.5, halves rounding up
+    return min(math.floor(units * 2 + 0.5) / 2, max_units)
+
+
+def moneyline_price(pick):
+    match = price_pattern.search(pick)
+    return int(match.group(1)) if match else None
+
+
+def moneyline_prices(prices):
+    # {team: price} from a table row of prices as text, e.g. PFF's market moneyline {"Buccaneers": "114"}
+    parsed = {}
+    for team, price in (prices or {}).items():
+        match = re.fullmatch(r'\s*([+-]?\d{3,5})\s*', str(price))
+        if match:
+            parsed[team] = int(match.group(1))
+    return parsed
+
+
+def moneyline_from_odds(odds, home, away):
+    # {team: price} from the "Moneyline:" section of the odds lookup, e.g. "Oregon Ducks: -3000", with
+    # the teams matched to home and away; a team priced "N/A" is left out
+    if not isinstance(odds, str):
+        return {}
+    match = moneyline_section_pattern.search(odds)
+    if match is None:
+        return {}
+    prices = {}
+    for line in match.group(1).splitlines():
+        name, _, value = line.rpartition(":")
+        team = side("Moneyline", name, home, away)
+        price = moneyline_price(value)
+        if team not in (None, no_bet) and price is not None:
+            prices[team] = price
+    return prices
+
+
+def first_paragraph(text):
+    return text.strip().split("\n\n")[0].strip()
+
+
+def market_consensus(market, expert_picks, home, away, moneyline=None):
+    votes = {}
+    other_market = 0
+    for expert, picks in expert_picks.items():
+        pick = picks[market]
+        choice = side(market, pick["pick"], home, away)
+        if choice == no_bet and market in exclusive_markets:
+            # experts may only bet one of Moneyline and Spread, so passing on one because the other
+            # was bet isn't a vote against it
+            other = exclusive_markets[1 - exclusive_markets.index(market)]
+            if side(other, picks[other]["pick"], home, away) not in (no_bet, None):
+                other_market += 1
+                continue
+        if choice is not None:
+            votes.setdefault(choice, []).append((expert, pick))
+    tally = sorted(((len(backers), choice) for choice, backers in votes.items()), key=lambda vote: -vote[0])
+    counts = [f"{count} {choice}" for count, choice in tally]
+    if other_market:
+        counts.append(f"{other_market} bet the {other} instead")
+    result = {"pick": no_bet, "units": 0, "votes": 0, "backers": [], "choice": None, "votes_by_choice": votes,
+              "tally": ", ".join(counts) or "no readable picks"}
+
+    if not tally or (len(tally) > 1 and tally[0][0] == tally[1][0]):
+        return {**result, "reasoning": f"No Bet: there was no clear consensus ({result['tally']})."}
+    winner = tally[0][1]
+    if winner == no_bet:
+        return {**result, "reasoning": f"No Bet: most experts passed ({result['tally']})."}
+
+    backers = votes[winner]
+    if len(backers) * 2 <= len(expert_picks):
+        # the most-backed pick still has to carry a majority of the whole panel, not just of the
+        # experts who bet this market
+        return {**result, "reasoning": f"No Bet: only {len(backers)} of {len(expert_picks)} experts backed {winner} ({result['tally']})."}
+    # the backers' most common wording, e.g. "Over 43.5"
+    pick = Counter(" ".join(p["pick"].split()) for _, p in backers).most_common(1)[0][0]
+    mean_units = sum(p["units"] for _, p in backers) / len(backers)
+    units = round_units(mean_units)
+    reasoning = f"{len(backers)} of {len(expert_picks)} experts backed {pick} ({result['tally']}), averaging {mean_units:.2f} units."
+    if units < 0.5:
+        return {**result, "reasoning": f"No Bet: {reasoning} That rounds below half a unit."}
+    if market == "Moneyline":
+        # the game's own price for the team, else one written into the pick, e.g. "Bills +114"
+        price = (moneyline or {}).get(winner, moneyline_price(pick))
+        if price is None:
+            return {**result, "reasoning": f"No Bet: {reasoning} There's no price to check against -{moneyline_band}/+{moneyline_band}."}
+        if abs(price) > moneyline_band:
+            return {**result, "reasoning": f"No Bet: {reasoning} At {price:+d} the line is outside -{moneyline_band}/+{moneyline_band}."}
+    return {**result, "pick": pick, "units": units, "votes": len(backers), "backers": backers, "choice": winner, "reasoning": reasoning}
+
+
+def aggregate_picks(expert_dict, home, away, moneyline=None):
+    # expert_dict maps expert names to their responses and moneyline maps home and away to the game's
+    # moneyline prices; returns the consensus in the shape the consensus prompt used:
+    # {"analysis": {market: {...}}, "official_picks": {market: {...}, "moneyline_vs_spread": {...}}}
+    expert_picks = {expert: parse_expert_picks(response) for expert, response in expert_dict.items()}
+    results = {market: market_consensus(market, expert_picks, home, away, moneyline) for market in markets}
+
+    # only one of Moneyline and Spread: the one more experts backed, then the bigger bet
+    moneyline, spread = results["Moneyline"], results["Spread"]
+    if moneyline["pick"] != no_bet and spread["pick"] != no_bet:
+        preferred = "Moneyline" if (moneyline["votes"], moneyline["units"]) >= (spread["votes"], spread["units"]) else "Spread"
+        other = "Spread" if preferred == "Moneyline" else "Moneyline"
+        justification = (f"{results[preferred]['votes']} experts backed the {preferred} pick against {results[other]['votes']} "
+                         f"for the {other}; only one of the two is bet.")
+        results[other] = {**results[other], "pick": no_bet, "units": 0, "backers": [],
+                          "reasoning": f"No Bet: the panel preferred the {preferred}. {results[other]['reasoning']}"}
+    elif moneyline["pick"] != no_bet or spread["pick"] != no_bet:
+        preferred = "Moneyline" if moneyline["pick"] != no_bet else "Spread"
+        justification = f"The panel only reached a consensus on the {preferred}."
+    else:
+        preferred = no_bet
+        justification = "The panel reached no consensus on either the Moneyline or the Spread."
+
+    analysis = {}
+    official_picks = {}
+    for market, result in results.items():
+        # the experts who went the other way on a bet the panel made
+        against = [pick for choice, backers in result["votes_by_choice"].items() if result["backers"] and choice not in (no_bet, result["choice"]) for _, pick in backers]
+        analysis[market] = {
+            "Summary": f"Expert picks: {result['tally']}.",
+            "Key_Insights": [first_paragraph(pick["summary"]) for _, pick in result["backers"] if pick["summary"]],
+            "Risk_Factors": [first_paragraph(pick["summary"]) for pick in against if pick["summary"]],
+        }
+        official_picks[market] = {"Pick": result["pick"], "Reasoning": result["reasoning"], "Units": result["units"]}
+    official_picks["moneyline_vs_spread"] = {"Preferred Bet": preferred, "Justification": justification}
+    return {"analysis": analysis, "official_picks": official_picks}
+
+
+if __name__ == "__main__":
+    # e.g. python consensus.py picks/nfl/week_5_picks.xlsx
+    import pandas as pd
+
+    paths = sys.argv[1:] or sorted(p for p in glob.glob('picks/*/week_*_picks.xlsx') if not p.split('/')[-1].startswith('~$'))
+    agree = total = 0
+    for path in paths:
+        df = pd.read_excel(path)
+        home_column, away_column = ("Home", "Away") if "Home" in df else ("home_team", "away_team")
+        for _, row in df.iterrows():
+            if not isinstance(row.get("expert_dict"), str) or not isinstance(row.get("consensus_pick"), str):
+                continue
+            try:
+                expert_dict = ast.literal_eval(row["expert_dict"])
+                llm_picks = ast.literal_eval(row["consensus_pick"])["official_picks"]
+            except (ValueError, SyntaxError, KeyError):
+                continue
+            moneyline = moneyline_from_odds(row.get("odds"), row[home_column], row[away_column])
+            if not moneyline and isinstance(row.get("game_data"), str):
+                try:
+                    moneyline = moneyline_prices(ast.literal_eval(row["game_data"])["moneyline"]["Market"])
+                except (ValueError, SyntaxError, KeyError, TypeError):
+                    pass
+            official_picks = aggregate_picks(expert_dict, row[home_column], row[away_column], moneyline)["official_picks"]
+            for market in markets:
+                ours = f"{official_picks[market]['Pick']} ({official_picks[market]['Units']})"
+                theirs = f"{llm_picks[market]['Pick']} ({llm_picks[market]['Units']})"
+                same = is_no_bet(official_picks[market]['Pick']) == is_no_bet(str(llm_picks[market]['Pick']))
+                agree += same
+                total += 1
+                if not same:
+                    print(f"{path} {row[away_column]} at {row[home_column]} {market}: {ours} vs consensus prompt {theirs}")
+    if total:
+        print(f"Bet/no-bet agreement with the consensus prompt: {agree}/{total} ({agree / total:.0%})")
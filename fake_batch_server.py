@@ -0,0 +1,219 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the Messages and Message Batches endpoints, for trying --batch and --event-loop
+# runs without spending anything: point an Anthropic client's base_url at serve() and it answers
+# messages (streamed or not) straight away, accepts batches, reports them as ended after `delay` seconds
+# and serves a canned reply for every request (a tool call when the request forces one). Running this
+# file drives a few two-turn stages and expert picks through MessageBatcher and ClaudeLoop against it.
+
+
+def echo_reply(params):
+    last = params["messages"][-1]["content"]
+    text = last if isinstance(last, str) else " ".join(block.get("text", "") for block in last)
+    return f"Fake reply to: {text[:60]}"
+
+
+def fake_tool_input(schema):
+    # an input that fits the tool's schema: every string is "No Bet" and every number its minimum, i.e.
+    # an expert passing on every market, which also satisfies the expert picks' own checks
+    if schema.get("type") == "object":
+        return {key: fake_tool_input(value) for key, value in schema.get("properties", {}).items()}
+    if schema.get("type") == "array":
+        return [fake_tool_input(schema.get("items", {}))]
+    if schema.get("type") in ("number", "integer"):
+        return schema.get("minimum", 0)
+    if schema.get("type") == "boolean":
+        return False
+    return "No Bet"
+
+
+def fake_content(params, reply, custom_id):
+    # a request that forces a tool call gets a tool_use block, like the real API; anything else gets text
+    tool_choice = params.get("tool_choice") or {}
+    if tool_choice.get("type") == "tool":
+        tool = next(tool for tool in params["tools"] if tool["name"] == tool_choice["name"])
+        return [{"type": "tool_use", "id": f"toolu_{custom_id}", "name": tool["name"], "input": fake_tool_input(tool["input_schema"])}], "tool_use"
+    return [{"type": "text", "text": reply(params)}], "end_turn"
+
+
+class FakeBatchServer(ThreadingHTTPServer):
+    def __init__(self, port=0, delay=1, reply=echo_reply):
+        super().__init__(("127.0.0.1", port), FakeBatchHandler)
+        self.delay = delay
+        self.reply = reply
+        self.lock = threading.Lock()
+        self.batches = {}
+        self.messages = 0
+        self.connections = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def batch_object(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = time.time() - batch["created"] >= self.delay
+        count = len(batch["requests"])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else count, "succeeded": count if ended else 0, "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"])),
+            "ended_at": time.strftime("%Y-%m-%dT%H:%M:%SZ") if ended else None,
+            "expires_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(batch["created"] + 24 * 60 * 60)),
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{self.base_url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def message(self, params, custom_id):
+        content, stop_reason = fake_content(params, self.reply, custom_id)
+        return {
+            "id": f"msg_{custom_id}",
+            "type": "message",
+            "role": "assistant",
+            "model": params["model"],
+            "content": content,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {"input_tokens": len(json.dumps(params["messages"])) // 4, "output_tokens": len(json.dumps(content)) // 4},
+        }
+
+    def results(self, batch_id):
+        lines = []
+        for request in self.batches[batch_id]["requests"]:
+            lines.append(json.dumps({
+                "custom_id": request["custom_id"],
+                "result": {"type": "succeeded", "message": self.message(request["params"], request["custom_id"])},
+            }))
+        return "\n".join(lines) + "\n"
+
+
+def stream_events(message):
+    # the server-sent events of a streamed message, with each text block sent a few words at a time
+    events = [("message_start", {"type": "message_start", "message": {**message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 1}}})]
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            events.append(("content_block_start", {"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}}))
+            words = block["text"].split(" ")
+            for i in range(0, len(words), 4):
+                chunk = " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")
+                events.append(("content_block_delta", {"type": "content_block_delta", "index": index, "delta": {"type": "text_delta", "text": chunk}}))
+        else:
+            events.append(("content_block_start", {"type": "content_block_start", "index": index, "content_block": {**block, "input": {}}}))
+            events.append(("content_block_delta", {"type": "content_block_delta", "index": index, "delta": {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}}))
+        events.append(("content_block_stop", {"type": "content_block_stop", "index": index}))
+    events.append(("message_delta", {"type": "message_delta", "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None}, "usage": {"output_tokens": message["usage"]["output_tokens"]}}))
+    events.append(("message_stop", {"type": "message_stop"}))
+    return "".join(f"event: {name}\ndata: {json.dumps(data)}\n\n" for name, data in events)
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    # keep-alive, so a pooled client's connection reuse shows up in server.connections
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.split("?")[0].rstrip("/") == "/v1/messages":
+            with self.server.lock:
+                self.server.messages += 1
+                message = self.server.message(body, f"{self.server.messages:04d}")
+            if body.get("stream"):
+                return self.send(200, stream_events(message), content_type="text/event-stream")
+            return self.send(200, json.dumps(message))
+        if self.path.rstrip("/") != "/v1/messages/batches":
+            return self.send(404, json.dumps({"type": "error", "error": {"type": "not_found_error", "message": self.path}}))
+        with self.server.lock:
+            batch_id = f"msgbatch_{len(self.server.batches) + 1:04d}"
+            self.server.batches[batch_id] = {"created": time.time(), "requests": body["requests"]}
+            self.send(200, json.dumps(self.server.batch_object(batch_id)))
+
+    def do_GET(self):
+        match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?/?", self.path.split("?")[0])
+        if match is None or match.group(1) not in self.server.batches:
+            return self.send(404, json.dumps({"type": "error", "error": {"type": "not_found_error", "message": self.path}}))
+        with self.server.lock:
+            if match.group(2):
+                return self.send(200, self.server.results(match.group(1)), content_type="application/binary")
+            return self.send(200, json.dumps(self.server.batch_object(match.group(1))))
+
+
+def serve(port=0, delay=1, reply=echo_reply):
+    server = FakeBatchServer(port, delay, reply)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    import anthropic
+
+    from claude_client import ClaudeLoop, MessageBatcher, run_claude
+    from structured_output import ExpertPicks, expert_picks_tool, structured_call
+    from usage import labelled, usage_log
+
+    server = serve(delay=2)
+    client = MessageBatcher(anthropic.Anthropic(api_key="fake", base_url=server.base_url), window=1, poll_interval=1)
+
+    def two_turn_stage(game):
+        first = yield dict(model="claude-3-5-sonnet-20240620", max_tokens=100, messages=[{"role": "user", "content": f"Preview {game}"}])
+        first_text = first.content[0].text
+        second = yield dict(model="claude-3-5-sonnet-20240620", max_tokens=100, messages=[
+            {"role": "user", "content": f"Preview {game}"},
+            {"role": "assistant", "content": first_text},
+            {"role": "user", "content": "Now go deeper"},
+        ])
+        return first_text + " | " + second.content[0].text
+
+    def run_game(game):
+        with labelled(game=game, stage="analysis"):
+            return run_claude(two_turn_stage(game), client)
+
+    def expert_stage(game):
+        request = dict(model="claude-3-5-sonnet-20240620", max_tokens=100, messages=[{"role": "user", "content": f"Pick {game}"}])
+        return (yield from structured_call(request, ExpertPicks, expert_picks_tool))
+
+    def run_expert(game):
+        with labelled(game=game, stage="experts"):
+            return run_claude(expert_stage(game), client)
+
+    games = ["Bills at Texans", "Lions at Cowboys", "Bengals at Giants"]
+    with ThreadPoolExecutor(max_workers=2 * len(games)) as pool:
+        analyses = pool.map(run_game, games)
+        picks = pool.map(run_expert, games)
+        for game, output, expert_picks in zip(games, analyses, picks):
+            print(f"{game}: {output}")
+            print(f"{game} picks: {expert_picks['Moneyline']['Pick']} / {expert_picks['Spread']['Pick']} / {expert_picks['Total']['Pick']}")
+    print(f"{len(server.batches)} batches submitted for {len(games)} two-turn stages and {len(games)} expert picks")
+
+    # the same stages again, with every call going out on one event loop
+    client = ClaudeLoop("fake", base_url=server.base_url)
+    connections = server.connections
+    with ThreadPoolExecutor(max_workers=2 * len(games)) as pool:
+        for game, output, expert_picks in zip(games, pool.map(run_game, games), pool.map(run_expert, games)):
+            print(f"{game}: {output}")
+    client.close()
+    print(f"{server.messages} messages over {server.connections - connections} connections on the event loop")
+    usage_log.report()
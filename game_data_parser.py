@@ -0,0 +1,77 @@
+# Helpers for the gameData payload embedded in Game on Paper pages: pulling it out of the page as it
+# streams in, and normalizing its numeric strings. The original recursive normalization is
+# in bench_parsers.py, which checks convert_floats against it and times the two.
+
+game_data_start = b'var gameData = '
+game_data_end = b';\n'
+
+
+def read_game_data(chunks):
+    # scan the page as it arrives, keeping only the bytes after "var gameData = " up to the ";\n" that
+    # ends the statement, without ever building the document
+    buffer = bytearray()
+    found = False
+    searched = 0
+    for chunk in chunks:
+        buffer += chunk
+        if not found:
+            start = buffer.find(game_data_start)
+            if start < 0:
+                # keep enough of the tail to catch the marker split across two chunks
+                del buffer[:max(0, len(buffer) - len(game_data_start) + 1)]
+                continue
+            del buffer[:start + len(game_data_start)]
+            found = True
+        end = buffer.find(game_data_end, searched)
+        if end >= 0:
+            return bytes(buffer[:end])
+        searched = max(0, len(buffer) - len(game_data_end) + 1)
+    return None
+
+
+# float() only accepts a string that starts with a digit, sign, '.', whitespace or the start of
+# nan/inf, and ends with a digit, '.', whitespace or the end of nan/inf/infinity; checking the two ends
+# rules out names and labels without paying for a raised ValueError
+number_starts = frozenset('0123456789+-.nNiI')
+number_ends = frozenset('0123456789.nNfFyY')
+
+
+def could_be_number(value):
+    first, last = value[:1], value[-1:]
+    return ((first in number_starts or first.isdecimal() or first.isspace())
+            and (last in number_ends or last.isdecimal() or last.isspace()))
+
+
+def convert_string(value):
+    if not could_be_number(value):
+        return value
+    try:
+        float_value = float(value)
+    except ValueError:
+        return value
+    formatted = f"{float_value:.4f}"
+    if formatted.endswith('.0000'):
+        return int(float_value)
+    return formatted
+
+
+def convert_floats(obj):
+    # same output as the original convert_floats_recursive, but walks the freshly loaded JSON with an
+    # explicit stack and replaces the strings in place instead of rebuilding every dict and list; team
+    # names, labels and repeated values are converted once per payload
+    if isinstance(obj, str):
+        return convert_string(obj)
+    if not isinstance(obj, (dict, list)):
+        return obj
+    converted = {}
+    stack = [obj]
+    while stack:
+        container = stack.pop()
+        for key, value in (container.items() if isinstance(container, dict) else enumerate(container)):
+            if isinstance(value, str):
+                if value not in converted:
+                    converted[value] = convert_string(value)
+                container[key] = converted[value]
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+    return obj
@@ -1,16 +1,27 @@
+import argparse
 import discord
 import asyncio
 import requests
 import json
-import time
 import random
 import anthropic
-from bs4 import BeautifulSoup
 import pandas as pd
 from datetime import datetime, timedelta
-import os
 import numpy as np
 
+import perplexity_client
+from artifact_store import ArtifactStore
+from claude_client import ClaudeLoop, MessageBatcher, longer_than, message_text, prime_cache, prime_cache_async, run_claude, run_claude_async
+from consensus import aggregate_picks, moneyline_from_odds
+from game_data_parser import convert_floats, read_game_data
+from picks_store import PicksStore
+from pipeline import CheckpointStore, RetryPolicy, gather_experts, gather_experts_async, run_slate, run_stage_graph
+from prompt_tables import to_tables
+from rate_limit import limiters
+from response_cache import ResponseCache
+from structured_output import ExpertPicks, expert_picks_tool, structured_call
+from usage import labelled, usage_log
+
 with open("misc/anthropic_token.txt", "r") as f:
     anthropic_key = f.read().strip()
 
@@ -24,6 +35,14 @@ client = anthropic.Anthropic(
     # defaults to os.environ.get("ANTHROPIC_API_KEY")
     api_key = anthropic_key,
 )
+# the analysis stages and Perplexity lookups check this before calling out, so a re-run only pays
+# for what changed
+response_cache = ResponseCache("cache/responses")
+
+# bounded retries for the Claude and Perplexity calls; once they're used up the error propagates and
+# the game is left for the next run instead of looping forever
+claude_retry = RetryPolicy(max_attempts=5, base_delay=2, max_delay=60)
+perplexity_retry = RetryPolicy(max_attempts=5, base_delay=5, max_delay=60)
 
 def comprehensive_perplexity_analysis(home, away, test=False):
     url = "https://api.perplexity.ai/chat/completions"
@@ -31,8 +50,13 @@ def comprehensive_perplexity_analysis(home, away, test=False):
 
     def perplexity_query(messages):
         model_choices = ['large', 'huge']
-        mod = random.choice(model_choices)
-        model_choice = "llama-3.1-8b-instruct" if test else f"llama-3.1-sonar-{mod}-128k-online"
+        models = ["llama-3.1-8b-instruct"] if test else [f"llama-3.1-sonar-{mod}-128k-online" for mod in model_choices]
+        # the model is picked at random, so reuse a cached answer from whichever one gave it
+        for model in models:
+            cached = response_cache.get(response_cache.key(model, None, None, messages))
+            if cached is not None:
+                return cached
+        model_choice = random.choice(models)
         payload = {
             "model": model_choice,
             "messages": messages
@@ -41,10 +65,12 @@ def comprehensive_perplexity_analysis(home, away, test=False):
             "Authorization": f"Bearer {perplexity_key}",
             "Content-Type": "application/json"
         }
-        response = requests.post(url, json=payload, headers=headers)
+        response = perplexity_client.post(url, json=payload, headers=headers)
         print(response)
         if response.status_code == 200:
-            return response.json()['choices'][0]['message']['content']
+            content = response.json()['choices'][0]['message']['content']
+            response_cache.set(response_cache.key(model_choice, None, None, messages), content)
+            return content
         else:
             print(f"Error: {response}")
             return ""
@@ -110,9 +136,7 @@ def comprehensive_perplexity_analysis(home, away, test=False):
         {"role": "user", "content": main_query}
     ]
 
-    full_analysis = ""
-    while full_analysis == "":
-        full_analysis = perplexity_query(messages)
+    full_analysis = perplexity_retry.run(lambda: perplexity_query(messages), "Perplexity analysis", retry_if=lambda resp: resp == "")
 
     follow_up_query = f"""
     Based on your previous analysis of the {away} at {home} game, provide three specific, insightful follow-up questions that would offer deeper understanding of crucial aspects of this matchup. Then, answer these questions in detail.
@@ -131,9 +155,7 @@ def comprehensive_perplexity_analysis(home, away, test=False):
     messages.append({"role": "assistant", "content": full_analysis})
     messages.append({"role": "user", "content": follow_up_query})
 
-    additional_insights = ""
-    while additional_insights == "":
-        additional_insights = perplexity_query(messages)
+    additional_insights = perplexity_retry.run(lambda: perplexity_query(messages), "Perplexity follow-up", retry_if=lambda resp: resp == "")
 
     return {
         "Main Analysis": full_analysis,
@@ -141,51 +163,27 @@ def comprehensive_perplexity_analysis(home, away, test=False):
     }
 
 def scrape_game_stats(url):
-    def convert_floats(obj):
-        if isinstance(obj, dict):
-            return {k: convert_floats(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_floats(v) for v in obj]
-        elif isinstance(obj, str):
-            try:
-                float_value = float(obj)
-                formatted = f"{float_value:.4f}"
-                if formatted.endswith('.0000'):
-                    return int(float_value)
-                return formatted
-            except ValueError:
-                return obj
-        else:
-            return obj
-
-    response = requests.get(url)
-    html_content = response.text
-    soup = BeautifulSoup(html_content, 'html.parser')
-    # get var gameData json
-    scripts = soup.find_all('script')
-    game_data_script = None
-    for script in scripts:
-        if 'var gameData' in str(script):
-            game_data_script = script
-            break
-    if game_data_script is None:
+    # get var gameData json; the page is streamed and the download stops once the payload is complete
+    with requests.get(url, stream=True) as response:
+        game_data = read_game_data(response.iter_content(chunk_size=64 * 1024))
+        encoding = response.encoding or 'utf-8'
+    if game_data is None:
         return None
-    game_data = str(game_data_script).split('var gameData = ')[1].split(';\n')[0]
-    game_data = json.loads(game_data)
+    game_data = json.loads(game_data.decode(encoding))
     home = game_data['gameInfo']['competitors'][0]['team']['displayName']
     away = game_data['gameInfo']['competitors'][1]['team']['displayName']
     game_data['matchup']['team'][0]['team'] = away
     game_data['matchup']['team'][1]['team'] = home
 
-    game_data = convert_floats(game_data)
-    return game_data['matchup']
+    # only the matchup is returned, so only the matchup needs normalizing
+    return convert_floats(game_data['matchup'])
 
-def claude_game_analysis(game_data, home, away):
+def claude_game_analysis_stage(game_data, home, away):
     initial_prompt = f"""YYou are a sports analyst tasked with creating a detailed preview for an upcoming college football game between {away} and {home}. Your goal is to analyze the provided data and generate an insightful preview of the game.
 
 Here is the game data:
 <game_data>
-{game_data}
+{to_tables(game_data)}
 </game_data>
 
 Follow these steps to create your preview:
@@ -208,11 +206,11 @@ Follow these steps to create your preview:
 6. Provide your preview in the following format:
    <preview>
    <'{home.replace(' ', '_')}_Analysis'>
-   [Your analysis of {home} listed in the JSON data]
+   [Your analysis of {home} listed in the data]
    <'/{home.replace(' ', '_')}_Analysis'>
 
    <'{away.replace(' ', '_')}_Analysis'>
-   [Your analysis of {home} listed in the JSON data]
+   [Your analysis of {home} listed in the data]
    <'/{away.replace(' ', '_')}_Analysis'>
 
    <matchup_overview>
@@ -233,7 +231,7 @@ Begin your analysis now, following the format specified above."""
     print("Getting game analysis")
     # Replace placeholders like {{GAME_STATS}} with real values,
     # because the SDK does not support variables.
-    message = client.messages.create(
+    message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0,
@@ -249,7 +247,7 @@ Begin your analysis now, following the format specified above."""
         ]
     )
 
-    initial_resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    initial_resp = message_text(message)
 
     follow_up_prompt = f"""Based on your previous analysis of the {away} at {home} game, provide three specific, insightful follow-up questions that would offer deeper understanding of crucial aspects of this matchup. These questions should focus on deeper analysis of the game data, potential strategic implications, or exploring nuanced aspects of team matchups. Then, answer these questions in detail.
 
@@ -267,7 +265,7 @@ In your answers, focus on information that can be derived from or is closely rel
 
 Write your follow-up questions and answers inside <follow_up> tags."""
     print("following up")
-    follow_up_message = client.messages.create(
+    follow_up_message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0.0,
@@ -295,10 +293,13 @@ Write your follow-up questions and answers inside <follow_up> tags."""
         ]
     )
 
-    follow_up_resp = str(follow_up_message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    follow_up_resp = message_text(follow_up_message)
 
     return initial_resp + "\n\n" + follow_up_resp
 
+def claude_game_analysis(game_data, home, away):
+    return run_claude(claude_game_analysis_stage(game_data, home, away), client, cache=response_cache)
+
 def get_perplexity_odds(home, away):
     url = "https://api.perplexity.ai/chat/completions"
 
@@ -348,18 +349,25 @@ def get_perplexity_odds(home, away):
         "Content-Type": "application/json"
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    # odds move, so a cached answer is only reused for half an hour
+    cache_key = response_cache.key(payload["model"], None, None, payload["messages"])
+    odds_string = response_cache.get(cache_key, ttl=30 * 60)
+    if odds_string is not None:
+        return odds_string
+
+    response = perplexity_client.post(url, json=payload, headers=headers)
 
     if response.status_code == 200:
         result = response.json()
         odds_string = result['choices'][0]['message']['content']
+        response_cache.set(cache_key, odds_string)
         return odds_string
     else:
         print(f"Error: {response.status_code}")
         print(response.text)
         return None
 
-def claude_expert_picks(insight_dict, home, away):
+def claude_expert_picks_stage(insight_dict, home, away):
     quant_analysis = insight_dict["Quantitative Analysis"]
     main_qual_analysis = insight_dict["Qualitative Analysis"]
     game_odds = insight_dict["Game Odds"]
@@ -424,21 +432,7 @@ When making your picks, keep the following principles in mind:
 5. Only bet on the Moneyline if the line is between -200 and +200. If the line is outside this range, consider betting on the spread instead.
 6. Choose either to bet the Spread or the Moneyline, not both, based on which offers the better value proposition according to your analysis. If you choose to bet on moneyline, list "no bet" for the spread and vice versa.
 
-Present your analysis and picks in the following JSON format:
-
-{{"Summary" : [Provide a very brief summary of the key points across all sections, emphasizing the most significant quantitative and qualitative findings, and your overall assessment of the game. Highlight any significant factors that stand out from the comprehensive analysis.],
-"Moneyline" : {{"Analysis" : {{"Summary" : [Provide your reasoning for the Moneyline analysis here. This should be a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis. Reference specific sections of the analysis where relevant.], 
-"Market Efficiency" : [Explain why you believe your identified edge isn't already priced into the odds. Discuss how your insight differs from or goes beyond the obvious factors that all bettors would consider. Justify why you think this particular inefficiency exists in an otherwise highly efficient market.],
-"Pick" : [State your Moneyline pick here],
-"Units" : [Provide a suggested bet size from 0 to 5 units, with justification]}},
-"Spread" : {{"Analysis" : {{"Summary" : [Provide your reasoning for the Moneyline analysis here. This should be a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis. Reference specific sections of the analysis where relevant.], 
-"Market Efficiency" : [Explain why you believe your identified edge isn't already priced into the odds. Discuss how your insight differs from or goes beyond the obvious factors that all bettors would consider. Justify why you think this particular inefficiency exists in an otherwise highly efficient market.],
-"Pick" : [State your Spread pick here],
-"Units" : [Provide a suggested bet size from 0 to 5 units, with justification]}},
-"Total" : {{"Analysis" : {{"Summary" : [Provide your reasoning for the Moneyline analysis here. This should be a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis. Reference specific sections of the analysis where relevant.], 
-"Market Efficiency" : [Explain why you believe your identified edge isn't already priced into the odds. Discuss how your insight differs from or goes beyond the obvious factors that all bettors would consider. Justify why you think this particular inefficiency exists in an otherwise highly efficient market.],
-"Pick" : [State your Total pick here],
-"Units" : [Provide a suggested bet size from 0 to 5 units, with justification]}}}}
+Submit your analysis and picks with the submit_expert_picks tool.
 
 Ensure that your reasoning is clear, logical, and well-supported by the provided game data. Your picks should reflect a careful consideration of all available information, with a focus on identifying and exploiting market inefficiencies. Be prepared to recommend "No Bet" if you don't find any significant edge in any market. Thoroughly justify any betting suggestion with clear reasoning on why the edge is significant enough to warrant a bet, and explain how you arrived at your unit rating.
 
@@ -447,7 +441,7 @@ If you find any areas where the analysis might be incomplete or where you have d
 Remember, the goal is to make the most accurate and profitable picks based on the data provided, while being extremely mindful of market efficiency. It's entirely acceptable to recommend no bets if you can't identify any clear, significant edges that you're confident the market has missed or undervalued. Quality of analysis is far more important than quantity of bets suggested.
 """
 
-    message = client.messages.create(
+    request = dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0.1,
@@ -457,187 +451,18 @@ Remember, the goal is to make the most accurate and profitable picks based on th
                 "content": [
                     {
                         "type": "text",
-                        "text": prompt}
+                        "text": prompt,
+                        # identical for every expert on the panel, so experts after the first read it from the cache
+                        "cache_control": {"type": "ephemeral"}}
                 ]
             }
         ]
     )
 
-    resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
-    return resp
-
-def get_consensus_pick(expert_data, home, away):
-    print("Getting consensus pick")
-    consensus_prompt = f"""You are an elite college football betting analyst and synthesizer, tasked with critically evaluating multiple expert opinions to determine the most accurate and valuable betting recommendations for the game between the {home} and the {away}. Your goal is to leverage the collective wisdom of the experts while applying advanced analytical techniques to improve pick accuracy.
-    
-    You have been provided with analyses from several expert agents. Each expert has given their insights on the Moneyline, Spread, and Total markets for this game. Your task is to synthesize these opinions and provide a final recommendation for each market.
-    
-    Here is the expert data you need to analyze:
-    <expert_data>
-    {expert_data}
-    </expert_data>
-    
-    For each betting market (Moneyline, Spread, and Total), please:
-    
-    1. Tally the experts' picks and determine the most common recommendation.
-    2. If there's no clear consensus, choose "No Bet" as the recommendation.
-    3. Summarize the most frequently mentioned factors that experts used to support their picks.
-    4. Calculate the average unit rating based on the experts' recommendations, rounding to the nearest 0.5 unit. If the average is below 0.5, use 0 (No Bet).
-
-    Important: Do not recommend bets on both the Moneyline and Spread. Choose the one that offers better value according to the expert opinions. If you choose to bet on the Moneyline, list "No Bet" for the Spread and vice versa.
-
-    Present your analysis and official picks in the following JSON format:
-
-    {{"analysis": {{"Moneyline" : {{"Summary": [Comprehensive summary of expert opinions, original data, and your critical analysis],
-    "Key_Insights": [Most compelling arguments and data points from experts and original data],
-    "Risk_Factors": [Discussion of potential risks or uncertainties],
-}},
-    "Spread" : {{"Summary": [Comprehensive summary of expert opinions, original data, and your critical analysis],
-    "Key_Insights": [Most compelling arguments and data points from experts and original data],
-    "Risk_Factors": [Discussion of potential risks or uncertainties],
-}},
-    "Total" : {{"Summary": [Comprehensive summary of expert opinions, original data, and your critical analysis],
-    "Key_Insights": [Most compelling arguments and data points from experts and original data],
-    "Risk_Factors": [Discussion of potential risks or uncertainties],
-}},    
-    "official_picks": {{"Moneyline": {{"Pick": [Your official Moneyline pick],
-    "Reasoning": [Paragraph explanation of your reasoning],
-    "Units": [0-5]}},
-    "Spread": {{"Pick": [Your official Spread pick],
-    "Reasoning": [Paragraph explanation of your reasoning],
-    "Units": [0-5]}},
-    "Total": {{"Pick": [Your official Total pick],
-    "Reasoning": [Paragraph explanation of your reasoning],
-    "Units": [0-5]}},
-    "moneyline_vs_spread": {{"Preferred Bet": [Choose either Moneyline or Spread],
-    "Justification": "[Explain why you believe this bet offers better value]"}}}}
-    
-Important considerations:
-- Do not add any of your own analysis or insight. Your role is solely to aggregate and summarize the experts' opinions.
-- If expert opinions are evenly split or too divergent, recommend "No Bet" for that market.
-- In the "Reasoning" section, list only the factors mentioned by multiple experts. Do not include unique insights mentioned by only one expert.
-- Ensure that the "Units" rating accurately reflects the average of the experts' recommendations.
-- Remember to choose either Moneyline or Spread based on which offers better value according to expert opinions. Do not recommend both.
-
-Your role is to represent the opinions of the expert panel, and to provide the most informed and well-reasoned betting recommendations possible, synthesizing the expertise of multiple college football experts.
-
-Return only the JSON-formatted analysis without any additional text or context. Ensure it can be loaded into a JSON object without errors. 
-"""
-
-    # Replace {expert_data} in the prompt with the actual expert data
-    consensus_prompt = consensus_prompt.replace("{expert_data}", expert_data)
-
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=5000,
-        temperature=0,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": consensus_prompt
-                    }
-                ]
-            }
-        ]
-    )
-    content = str(message.content)
-    content = content.replace("[TextBlock(text='", "")
-    content = content.replace("', type='text')]", "")
-    content = content.strip()
-
-    # Remove escaped newlines and replace with actual newlines
-    content = content.replace('\\n', '\n')
-    # Remove escaped quotes
-    content = content.replace("\\'", "'")
-    content = content.replace("  ", "")
-    content = content.replace("\n", " ")
-    return content
-
-def get_consensus_pick_alt(expert_data, home, away):
-    consensus_prompt = f"""You are a sports betting synthesizer tasked with aggregating multiple expert opinions to determine the most consensus betting recommendations for a given game. Your goal is to summarize the collective wisdom of the experts without adding your own analysis.
-
-Here are the analyses from multiple expert agents:
- <expert_data>
-{expert_data}
-</expert_data>
-
- Each expert has given their insights and picks on the Moneyline, Spread, and Total markets for this game. Your task is to synthesize these opinions and provide a consensus recommendation for each market.
-For each betting market (Moneyline, Spread, and Total), please:
-
-1. Tally the experts' picks and determine the most common recommendation.
-2. If there's no clear consensus, choose "No Bet" as the recommendation.
-3. Summarize the most frequently mentioned factors that experts used to support their picks.
-4. Calculate the average unit rating based on the experts' recommendations, rounding to the nearest 0.5 unit. If the average is below 0.5, use 0 (No Bet).
-
-Important: Do not recommend bets on both the Moneyline and Spread. Choose the one that offers better value according to the expert opinions. If you choose to bet on the Moneyline, list "No Bet" for the Spread and vice versa.
-
-Present your analysis and official picks in the following JSON format:
-
-{{"Expert_Analysis": {{"Moneyline" : {{"Summary": [Comprehensive summary of expert opinions],
-"Key_Insights": [Most compelling arguments and data points from experts],
-"Risk_Factors": [Discussion of potential risks or uncertainties from the experts],
-}},
-"Spread" : {{"Summary": [Comprehensive summary of expert opinions],
-"Key_Insights": [Most compelling arguments and data points from experts],
-"Risk_Factors": [Discussion of potential risks or uncertainties],
-}},
-"Total" : {{"Summary": [Comprehensive summary of expert opinions],
-"Key_Insights": [Most compelling arguments and data points from experts],
-"Risk_Factors": [Discussion of potential risks or uncertainties],
-}},    
-"official_picks": {{"Moneyline": {{"Pick": [The most common Moneyline pick among experts, or 'No Bet' if no consensus],
-"Reasoning": [Paragraph including the most frequently mentioned factors supporting this pick],
-"Units": [Average of expert unit ratings, rounded to nearest 0.5 (0-5 range), or 0 if 'No Bet']}},
-"Spread": {{"Pick": [The most common Spread pick among experts, or 'No Bet' if no consensus],
-"Reasoning": [Paragraph including the most frequently mentioned factors supporting this pick],
-"Units": [Average of expert unit ratings, rounded to nearest 0.5 (0-5 range), or 0 if 'No Bet']}},
-"Total": {{"Pick": [The most common Total (over/under) pick among experts, or 'No Bet' if no consensus],
-"Reasoning": [Paragraph including the most frequently mentioned factors supporting this pick],
-"Units": [Average of expert unit ratings, rounded to nearest 0.5 (0-5 range), or 0 if 'No Bet']}}}}
-    
-Important considerations:
-- Do not add any of your own analysis or insight. Your role is solely to aggregate and summarize the experts' opinions.
-- If expert opinions are evenly split or too divergent, recommend "No Bet" for that market.
-- In the "Reasoning" section, list only the factors mentioned by multiple experts. Do not include unique insights mentioned by only one expert.
-- Ensure that the "Units" rating accurately reflects the average of the experts' recommendations.
-- Remember to choose either Moneyline or Spread based on which offers better value according to expert opinions. Do not recommend both. 
-- Only recommend betting on the Moneyline if that team's odds are between -200 and +200. Otherwise, recommend the Spread.
+    return (yield from structured_call(request, ExpertPicks, expert_picks_tool))
 
-Return only the JSON-formatted consensus picks without any additional text or context. Ensure it can be loaded into a JSON object without errors.
-
-"""
-
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=5000,
-        temperature=0,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": consensus_prompt
-                    }
-                ]
-            }
-        ]
-    )
-    content = str(message.content)
-    content = content.replace("[TextBlock(text='", "")
-    content = content.replace("', type='text')]", "")
-    content = content.strip()
-
-    # Remove escaped newlines and replace with actual newlines
-    content = content.replace('\\n', '\n')
-    # Remove escaped quotes
-    content = content.replace("\\'", "'")
-    content = content.replace("  ", "")
-    content = content.replace("\n", " ")
-    return content
+def claude_expert_picks(insight_dict, home, away):
+    return run_claude(claude_expert_picks_stage(insight_dict, home, away), client)
 
 def get_weekly_games(week):
     url = f'https://gameonpaper.com/cfb/year/2024/type/2/week/{week}?group=80'
@@ -730,7 +555,7 @@ def get_weekly_games(week):
     # convert datetime from utc to eastern
     return df
 
-def format_for_discord(consensus_pick, home, away, gametime):
+def format_for_discord_stage(consensus_pick, home, away, gametime):
     prompt = f"""
     You are tasked with converting sports prediction data into a concise, engaging, and authoritative message for a Discord channel. The data contains analysis and official picks for various betting options in an upcoming college football game. This information comes from an ensemble of highly sophisticated, cutting-edge AI agents who were given data on advanced stats and qualitative factors influencing the game.
     Here is the prediction data to process:
@@ -770,7 +595,7 @@ Key Considerations:
 
 """
 
-    message = client.messages.create(
+    message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=5000,
         temperature=0.2,
@@ -786,14 +611,26 @@ Key Considerations:
         ]
     )
 
-    resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    if message.stop_reason != "end_turn":
+        # cut off, either by longer_than or by max_tokens: never post a half-finished message
+        return None
+    resp = message_text(message)
     resp = resp.replace('"', "")
     return resp
 
+def format_for_discord(consensus_pick, home, away, gametime):
+    # an over-long draft gets regenerated, so stop paying for it as soon as it passes the limit
+    return run_claude(format_for_discord_stage(consensus_pick, home, away, gametime), client, stop_when=longer_than(2000))
+
+# a draft over Discord's 2000-character limit is regenerated, up to this many times in all
+max_discord_attempts = 4
+
 def send_to_discord(message):
     message = message.replace("\\n", "\n")
+    limiters["discord"].acquire()
 
-    loop = asyncio.get_event_loop()
+    # games run on worker threads, which don't have an event loop of their own
+    loop = asyncio.new_event_loop()
     client = discord.Client(intents=discord.Intents.default())
     guild_name = 'Algorhythm Bets'
     channel_name = 'cfb-official-picks'
@@ -805,74 +642,93 @@ def send_to_discord(message):
         await channel.send(f"""{message}""")
         await client.close()
     loop.run_until_complete(client.start(discord_token))
+    loop.close()
+
+# how long the checkpoints of stages that go stale stay usable on a resumed game (in seconds); the
+# odds as long as the response cache keeps them
+checkpoint_max_age = {"odds": 30 * 60, "qual_insight": 2 * 60 * 60}
+
+def primary_pick_engine(url, gametime, n_agents=3, testing=False, checkpoint_dir=None):
+    # every finished stage is saved under checkpoint_dir, so a re-run picks up where it left off
+    checkpoint = CheckpointStore(checkpoint_dir, max_age=checkpoint_max_age) if checkpoint_dir else None
 
-def primary_pick_engine(url, gametime, n_agents=3, testing=False):
     ### 2. Scrape game stats
-    game_data = scrape_game_stats(url)
+    if checkpoint is not None:
+        game_data = checkpoint.load_or_run("game_data", lambda: scrape_game_stats(url))
+    else:
+        game_data = scrape_game_stats(url)
+    if game_data is None:
+        # saved as degraded, so the next run scrapes the page again
+        raise ValueError(f"No gameData found on {url}")
     away = game_data['team'][0]['team']
     home = game_data['team'][1]['team']
 
     ### 3. Get analysis from Claude
-    claude_game_analysis_response = ""
-    while claude_game_analysis_response == "":
-        try:
-            claude_game_analysis_response = claude_game_analysis(game_data, home, away)
-        except Exception as e:
-            print(f"Error: {e}")
-
-    ### 5. Get analysis from perplexity API
-    qual_insight = comprehensive_perplexity_analysis(home, away, test=testing)
-
-    # get odds from perplexity
-    odds = get_perplexity_odds(home, away)
-    insight_dict = {"Quantitative Analysis": claude_game_analysis_response,
-                    "Qualitative Analysis": qual_insight,
-                    "Game Odds": odds}
-
-    # poll claude experts
-    num_experts = n_agents if testing == False else 2
-    expert_dict = {}
-    i = 0
-    while len(expert_dict) < num_experts:
-        try:
-            response = claude_expert_picks(insight_dict, home, away)
-            print(f"{response}")
-            expert_dict[f"Expert {i+1}"] = response
-            i += 1
-        except Exception as e:
-            print(f"Error: {e}")
-
-    ### 8. Get final analysis from Claude
-
-    consensus_pick = ""
-    while consensus_pick == "":
-        try:
-            consensus_pick = get_consensus_pick(str(expert_dict), home, away)
-        except Exception as e:
-            print(f"Error: {e}")
-    consensus_pick = json.loads(consensus_pick)
+    def get_game_analysis():
+        return claude_retry.run(lambda: claude_game_analysis(game_data, home, away), "Claude game analysis", retry_if=lambda resp: resp == "")
+
+    def poll_experts(claude_game_analysis_response, qual_insight, odds):
+        insight_dict = {"Quantitative Analysis": claude_game_analysis_response,
+                        "Qualitative Analysis": qual_insight,
+                        "Game Odds": odds}
+
+        # poll claude experts
+        num_experts = n_agents if testing == False else 2
+        if isinstance(client, ClaudeLoop):
+            # the whole panel goes out as tasks on the loop, without a thread per expert
+            return client.run(gather_experts_async(lambda i: run_claude_async(claude_expert_picks_stage(insight_dict, home, away), client.client), num_experts, policy=claude_retry,
+                                                   prime=lambda: prime_cache_async(claude_expert_picks_stage(insight_dict, home, away), client.client)))
+        return gather_experts(lambda i: claude_expert_picks(insight_dict, home, away), num_experts, policy=claude_retry,
+                              # a batch already prices the whole panel at half, and a primer would cost a batch round of its own
+                              prime=None if isinstance(client, MessageBatcher) else lambda: prime_cache(claude_expert_picks_stage(insight_dict, home, away), client))
+
+    ### 8. Tally the experts' picks
+    def get_consensus(expert_dict, odds):
+        return aggregate_picks(expert_dict, home, away, moneyline_from_odds(odds, home, away))
 
     ### 9. Clean for discord
-    print("Formatting for discord")
-    disc = ""
-    while disc == "":
-        try:
-            disc = format_for_discord(consensus_pick, home, away, gametime)
-        except Exception as e:
-            print(f"Error: {e}")
-
-    print(disc)
-    while len(disc) > 2000:
-       print("Message too long, retrying")
-       disc = format_for_discord(consensus_pick, home, away, gametime)
-       print(disc)
+    def get_discord_message(consensus_pick):
+        print("Formatting for discord")
+        for attempt in range(max_discord_attempts):
+            disc = claude_retry.run(lambda: format_for_discord(consensus_pick, home, away, gametime), "Discord formatting", retry_if=lambda resp: resp == "")
+            print(disc)
+            if disc is not None and len(disc) <= 2000:
+                return disc
+            print("Message too long, retrying")
+        raise ValueError(f"No Discord message under 2000 characters after {max_discord_attempts} attempts")
+
+    ### 10. Post it
+    def post_to_discord(disc):
+        send_to_discord(disc)
+        # something to checkpoint, so a resumed game knows it has already been posted
+        return datetime.now().isoformat()
+
+    # claude, perplexity and the odds lookup are independent, so they run at the same time
+    stages = {
+        "game_analysis": ((), get_game_analysis),
+        ### 5. Get analysis from perplexity API
+        "qual_insight": ((), lambda: comprehensive_perplexity_analysis(home, away, test=testing)),
+        # get odds from perplexity
+        "odds": ((), lambda: get_perplexity_odds(home, away)),
+        "experts": (("game_analysis", "qual_insight", "odds"), poll_experts),
+        "consensus": (("experts", "odds"), get_consensus),
+        "discord": (("consensus",), get_discord_message),
+        "send": (("discord",), post_to_discord),
+    }
+    results, timings = run_stage_graph(stages, checkpoint=checkpoint, side_effects=("send",))
 
-    send_to_discord(disc)
+    claude_game_analysis_response = results["game_analysis"]
+    qual_insight = results["qual_insight"]
+    odds = results["odds"]
+    expert_dict = results["experts"]
+    consensus_pick = results["consensus"]
+    disc = results["discord"]
 
-    return game_data, claude_game_analysis_response, qual_insight, odds, expert_dict, consensus_pick, disc
+    # seconds per stage that ran this time; stages resumed from a checkpoint aren't in it
+    return game_data, claude_game_analysis_response, qual_insight, odds, expert_dict, consensus_pick, disc, timings
 
 
-def main(week = 6, today_only = True):
+def main(week = 6, today_only = True, max_concurrency = 4, batch = False, event_loop = False):
     ### 1. Get URL of game
     df = get_weekly_games(week)
 
@@ -884,25 +740,31 @@ def main(week = 6, today_only = True):
     print(f"{df.shape[0]} games today")
 
     # check if picks folder exists. if so, check if game exists in csv. if so, drop game from dataframe. if csv does not exist, create it
-    if os.path.exists(f'picks/cfb/week_{week}_picks.xlsx'):
-        existing_games = pd.read_excel(f'picks/cfb/week_{week}_picks.xlsx')
+    picks = PicksStore(f'picks/cfb/week_{week}_picks.jsonl', f'picks/cfb/week_{week}_picks.xlsx')
+    existing_games = picks.load()
+    # full, untruncated stage outputs for backtesting; the spreadsheet keeps its str() columns
+    artifacts = ArtifactStore()
+    if not existing_games.empty:
         df = df[~df['home_team'].isin(existing_games['home_team'])]
     else:
         print('exists = False')
-        existing_games = pd.DataFrame()
     print("Today's games:")
     print(df)
 
-    for index, row in df.iterrows():
+    def run_game(row):
         gametime = pd.to_datetime(row['game_datetime']).strftime('%I:%M %p EST')
         # format as 12 hour time with PM, AM, etc
 
         print(f"{row['away_team']} at {row['home_team']} ({gametime})")
 
-
-        game_df = pd.DataFrame([row], index=[index])
         url = row['href']
-        game_data, clade_game_analysis_response, qual_insight, odds, expert_dict, consensus_pick, disc = primary_pick_engine(url, gametime,  n_agents=5, testing=False)
+        checkpoint_dir = f"cfb/week{week}/{row['away_team']}_at_{row['home_team']}"
+        with labelled(game=f"{row['away_team']} at {row['home_team']}"):
+            return primary_pick_engine(url, gametime,  n_agents=5, testing=False, checkpoint_dir=checkpoint_dir)
+
+    def save_game(index, result):
+        game_df = pd.DataFrame([df.loc[index]], index=[index])
+        game_data, clade_game_analysis_response, qual_insight, odds, expert_dict, consensus_pick, disc, timings = result
         ## add to dataframe
         game_df.loc[index, 'game_data'] = str(game_data)
         game_df.loc[index, 'claude_game_analysis'] = str(clade_game_analysis_response)
@@ -911,11 +773,48 @@ def main(week = 6, today_only = True):
         game_df.loc[index, 'expert_dict'] = str(expert_dict)
         game_df.loc[index, 'consensus_pick'] = str(consensus_pick)
         game_df.loc[index, 'discord_message'] = str(disc)
+        game_df.loc[index, 'stage_timings'] = str({name: round(seconds, 2) for name, seconds in timings.items()})
         game_df.loc[index, 'ML_pick'] = str(consensus_pick['official_picks']['Moneyline']['Pick']) + " (" + str(consensus_pick['official_picks']['Moneyline']['Units']) + " units)"
         game_df.loc[index, 'Spread_pick'] = str(consensus_pick['official_picks']['Spread']['Pick']) + " (" + str(consensus_pick['official_picks']['Spread']['Units']) + " units)"
         game_df.loc[index, 'Total_pick'] = str(consensus_pick['official_picks']['Total']['Pick']) + " (" + str(consensus_pick['official_picks']['Total']['Units']) + " units)"
-        existing_games = pd.concat([existing_games, game_df])
-        existing_games.to_excel(f'picks/cfb/week_{week}_picks.xlsx', index = False)
+        picks.append(game_df.loc[index].to_dict())
+        artifacts.save_game('cfb', week, game_data['team'][0]['team'], game_data['team'][1]['team'], {
+            'game_data': game_data,
+            'perplexity_analysis': qual_insight,
+            'consensus_pick': consensus_pick,
+            'game_analysis': clade_game_analysis_response,
+            'odds': odds,
+            'discord_message': disc,
+            'stage_timings': timings,
+        }, expert_dict, consensus_pick)
+
+    games = [(index, row) for index, row in df.iterrows()]
+    global client
+    if batch:
+        # every game runs at once, so each layer's Claude calls from the whole slate share a batch
+        client = MessageBatcher(client)
+        max_concurrency = max(len(games), 1)
+    elif event_loop:
+        # every game runs at once too: their Claude calls all go out on one event loop and its
+        # connection pool, and a game's thread is only busy with its own scraping and posting
+        client = ClaudeLoop(anthropic_key)
+        max_concurrency = max(len(games), 1)
+    try:
+        run_slate(games, run_game, save_game, max_concurrency=max_concurrency)
+    finally:
+        # the spreadsheet is only rebuilt once per run; the jsonl file already has every finished game
+        picks.export()
+        if isinstance(client, ClaudeLoop):
+            client.close()
+    print(f"Perplexity connections: {perplexity_client.connection_stats()}")
+    print(f"Response cache: {response_cache.summary()}")
+    usage_log.report()
+    usage_log.save(f'picks/cfb/week_{week}_usage.jsonl')
 
 if __name__ == '__main__':
-    main(week=6)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--week', type=int, default=6)
+    parser.add_argument('--batch', action='store_true', help='send the Claude calls as Message Batches: half price, but picks can take hours')
+    parser.add_argument('--event-loop', action='store_true', help='run the Claude calls for the whole slate on one event loop with a shared async client')
+    args = parser.parse_args()
+    main(week=args.week, batch=args.batch, event_loop=args.event_loop)
\ No newline at end of file
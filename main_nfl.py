@@ -1,20 +1,34 @@
-import re
-from bs4 import BeautifulSoup
+import argparse
 
 import json
-from bs4 import BeautifulSoup
 import pandas as pd
 pd.set_option('display.max_colwidth', None)
 import random
-import requests
-import time
 import anthropic
 import os
 import discord
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 
+import perplexity_client
+import sumer_client
+from artifact_store import ArtifactStore
+from browser_pool import BrowserPool
+from claude_client import ClaudeLoop, MessageBatcher, longer_than, message_text, prime_cache, prime_cache_async, run_claude, run_claude_async
+from consensus import aggregate_picks, moneyline_from_odds, moneyline_prices
+from pff_parser import parse_pff_data
+from picks_store import PicksStore
+from pipeline import CheckpointStore, CircuitBreaker, RetryPolicy, gather_experts, gather_experts_async, run_slate, run_stage_graph
+from prompt_tables import to_tables
+from rate_limit import limiters
+from response_cache import ResponseCache
+from structured_output import ExpertPicks, expert_picks_tool, structured_call
+from sumer_parser import parse_adv_analytics
+from usage import labelled, usage_log
+
 with open("misc/anthropic_token.txt", "r") as f:
     anthropic_key = f.read().strip()
 
@@ -28,6 +42,9 @@ client = anthropic.Anthropic(
     # defaults to os.environ.get("ANTHROPIC_API_KEY")
     api_key = anthropic_key,
 )
+# the analysis stages and Perplexity lookups check this before calling out, so a re-run only pays
+# for what changed
+response_cache = ResponseCache("cache/responses")
 
 def get_perplexity_odds(home, away):
     url = "https://api.perplexity.ai/chat/completions"
@@ -77,165 +94,31 @@ def get_perplexity_odds(home, away):
         "Content-Type": "application/json"
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    # odds move, so a cached answer is only reused for half an hour
+    cache_key = response_cache.key(payload["model"], None, None, payload["messages"])
+    odds_string = response_cache.get(cache_key, ttl=30 * 60)
+    if odds_string is not None:
+        return odds_string
+
+    response = perplexity_client.post(url, json=payload, headers=headers)
 
     if response.status_code == 200:
         result = response.json()
         odds_string = result['choices'][0]['message']['content']
+        response_cache.set(cache_key, odds_string)
         return odds_string
     else:
         print(f"Error: {response.status_code}")
         print(response.text)
         return None
 
-def parse_pff_data(greenline_data, lineups1_data, lineups2_data):
-    def parse_table(soup, table_name):
-        if table_name == "Team Metrics":
-            table = soup.find('table', class_="m-matchup-table g-table g-table--compressed")
-        elif table_name == "QB Comparison":
-            table = soup.find_all('table', class_="m-matchup-table g-table g-table--compressed")[-1]
-        else:
-            table = soup.find('h3', string=table_name).find_parent('table')
-        rows = table.find_all('tr')[1:]  # Skip header row
-        data = {}
-        for row in rows:
-            cells = row.find_all(['th', 'td'])
-            key = cells[0].text.strip().replace(' ', '_')
-            away_value = cells[1].text.strip()
-            home_value = cells[2].text.strip()
-            data[key] = {away: away_value, home: home_value}
-
-        if table_name == "Total":
-            for key in data:
-                data[key] = {"under": data[key][away], "over": data[key][home]}
-
-        return data
-
-    def parse_injuries(soup):
-        try:
-            injuries = {away: [], home: []}
-            injury_tables = soup.find_all('table', class_='m-matchup-table g-table g-table--compressed')
-            for i, table in enumerate(injury_tables[2:4]):  # Last two tables are injury tables
-                team = away if i == 0 else home
-                rows = table.find_all('tr')[1:]  # Skip header row
-                for row in rows:
-                    cells = row.find_all('td')
-                    injury_data = {
-                        "name": cells[0].text.strip(),
-                        "position": cells[1].text.strip(),
-                        "injury": cells[2].text.strip(),
-                        "status": cells[3].text.strip(),
-                        "grade": float(cells[4].find('div', class_='kyber-grade-badge__info-text').text.strip()),
-                        "pos_war_rank": cells[5].text.strip()
-                    }
-                    injuries[team].append(injury_data)
-        except Exception as e:
-            injuries = None
-        return injuries
-
-    def parse_lineups(lineups, home, away, home_offense = True):
-
-        def parse_depth_chart(html_content):
-            soup = BeautifulSoup(html_content, 'html.parser')
-            offense = {}
-            defense = {}
-
-            positions = soup.find_all('div', class_='depth-chart__position')
-            for position in positions:
-                position_key = position['data-position-key']
-                position_title = position['title']
-                players = position.find_all('div', class_='depth-chart__player')
-
-                player_data = {
-                    'title': position_title,
-                    'players': [parse_player(player) for player in players]
-                }
-
-                if is_offensive_position(position_key):
-                    offense[position_key] = player_data
-                else:
-                    defense[position_key] = player_data
-
-            return {'offense': offense, 'defense': defense}
-
-        def is_offensive_position(position):
-            offensive_positions = ['QB', 'RB', 'FB', 'WR', 'TE', 'OL', 'C', 'G', 'T', 'LT', 'LG', 'RT', 'RG', 'HB']
-            defensive_positions = ['DE', 'DT', 'LB', 'CB', 'S', 'DL', 'DB']
-
-            if any(pos in position for pos in defensive_positions):
-                return False
-            elif any(pos in position for pos in offensive_positions):
-                return True
-            else:
-                # If position is not clearly offensive or defensive, assume it's defensive
-                return False
-
-        def parse_player(player_div):
-            jersey_number = player_div.find('span', class_='player-team-colors__number').text.strip().strip('#')
-            name = player_div.find('span', class_='player-jersey__name').contents[0].strip()
-
-            grade_div = player_div.find('div', class_='kyber-grade-badge__info-text')
-            grade = grade_div.text.strip() if grade_div else None
-
-            rank_p = player_div.find('p', class_='m-micro-copy')
-            if rank_p:
-                rank_text = rank_p.text.strip()
-                rank_match = re.search(r'(\d+)(?:st|nd|rd|th)\s*/\s*(\d+)\s*(\w+)', rank_text)
-                if rank_match:
-                    rank, total, position = rank_match.groups()
-                else:
-                    rank, total, position = None, None, None
-            else:
-                rank, total, position = None, None, None
-
-            return {
-                'name': name,
-                'grade': grade,
-                'position_rank': rank,
-                'overall_rank': total,
-            }
-
-        depth_chart = parse_depth_chart(lineups)
-        # rename offense key
-        if home_offense:
-            depth_chart[home + '-offense'] = depth_chart.pop('offense')
-            # rename defense key
-            depth_chart[away + '-defense'] = depth_chart.pop('defense')
-        else:
-            depth_chart[away + '-offense'] = depth_chart.pop('offense')
-            depth_chart[home + '-defense'] = depth_chart.pop('defense')
-
-        return depth_chart
-
-    soup = BeautifulSoup(greenline_data, 'html.parser')
-    away = str(soup.find_all("span", class_="sr-only")[0].text)
-    home = str(soup.find_all("span", class_="sr-only")[1].text)
-    game_data = {
-        "teams": {
-            "away": away,
-            "home": home
-        },
-        "spread": parse_table(soup, "Spread"),
-        "moneyline": parse_table(soup, "Moneyline"),
-        "total": parse_table(soup, "Total"),
-        "impact_player_injuries": parse_injuries(soup),
-        "game_metrics": parse_table(soup, "Team Metrics"),
-        'qb_comparison': parse_table(soup, "QB Comparison")
-    }
-    # parse lineups
-    lineups1_json = parse_lineups(lineups1_data, home, away, home_offense = True)
-    lineups2_json = parse_lineups(lineups2_data, home, away, home_offense = False)
-    # combine the two lineups
-    lineups = {**lineups1_json, **lineups2_json}
-    return game_data, lineups
-
-def claude_adv_stats_analysis(adv_stats, home, away):
+def claude_adv_stats_analysis_stage(adv_stats, home, away):
     print("Getting adv. stats analysis")
     initial_prompt = f"""YYou are a sports analyst tasked with creating a detailed preview for an upcoming college football game between {away} and {home}. Your goal is to analyze the provided data and generate an insightful preview of the game.
 
 Here are the advanced stats:
 <adv_stats>
-{adv_stats}
+{to_tables(adv_stats)}
 </adv_stats>
 
 Follow these steps to create your preview:
@@ -258,11 +141,11 @@ Follow these steps to create your preview:
 6. Provide your preview in the following format:
    <preview>
    <'{home.replace(' ', '_')}_Analysis'>
-   [Your analysis of {home} listed in the JSON data]
+   [Your analysis of {home} listed in the data]
    <'/{home.replace(' ', '_')}_Analysis'>
 
    <'{away.replace(' ', '_')}_Analysis'>
-   [Your analysis of {home} listed in the JSON data]
+   [Your analysis of {home} listed in the data]
    <'/{away.replace(' ', '_')}_Analysis'>
 
    <matchup_overview>
@@ -280,7 +163,7 @@ Begin your analysis now, following the format specified above."""
 
     # Replace placeholders like {{GAME_STATS}} with real values,
     # because the SDK does not support variables.
-    message = client.messages.create(
+    message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0,
@@ -296,7 +179,7 @@ Begin your analysis now, following the format specified above."""
         ]
     )
 
-    initial_resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    initial_resp = message_text(message)
 
     follow_up_prompt = f"""Based on your previous analysis of the {away} at {home} game, provide three specific, insightful follow-up questions that would offer deeper understanding of crucial aspects of this matchup. These questions should focus on deeper analysis of the game data, potential strategic implications, or exploring nuanced aspects of team matchups. Then, answer these questions in detail.
 
@@ -314,7 +197,7 @@ In your answers, focus on information that can be derived from or is closely rel
 
 Write your follow-up questions and answers inside <follow_up> tags."""
     print("following up")
-    follow_up_message = client.messages.create(
+    follow_up_message = yield dict(
             model="claude-3-5-sonnet-20240620",
             max_tokens=3000,
             temperature=0.0,
@@ -342,16 +225,19 @@ Write your follow-up questions and answers inside <follow_up> tags."""
             ]
         )
 
-    follow_up_resp = str(follow_up_message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    follow_up_resp = message_text(follow_up_message)
 
     return initial_resp + "\n\n" + follow_up_resp
 
-def claude_game_analysis(game_data, home, away):
-    initial_prompt = f"""You are a professional sports analyst tasked with creating an in-depth preview for an upcoming NFL game between the {away} and the {home}. You have been provided with comprehensive JSON data containing detailed statistics, betting information, and player grades for both teams. Your goal is to analyze this data and generate an insightful preview of the game.
+def claude_adv_stats_analysis(adv_stats, home, away):
+    return run_claude(claude_adv_stats_analysis_stage(adv_stats, home, away), client, cache=response_cache)
+
+def claude_game_analysis_stage(game_data, home, away):
+    initial_prompt = f"""You are a professional sports analyst tasked with creating an in-depth preview for an upcoming NFL game between the {away} and the {home}. You have been provided with comprehensive data tables containing detailed statistics, betting information, and player grades for both teams. Your goal is to analyze this data and generate an insightful preview of the game.
 
 Here are the game stats:
 <game_stats>
-{game_data}
+{to_tables(game_data)}
 </game_stats>
 
 Follow these steps to create your preview:
@@ -400,7 +286,7 @@ Remember to base your analysis solely on the provided statistical data. Do not r
     print("Getting game analysis")
     # Replace placeholders like {{GAME_STATS}} with real values,
     # because the SDK does not support variables.
-    message = client.messages.create(
+    message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=5000,
         temperature=0,
@@ -416,7 +302,7 @@ Remember to base your analysis solely on the provided statistical data. Do not r
         ]
     )
 
-    initial_resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    initial_resp = message_text(message)
 
     follow_up_prompt = f"""Based on your previous analysis of the {away} at {home} game, provide three specific, insightful follow-up questions that would offer deeper understanding of crucial aspects of this matchup. These questions should focus on deeper analysis of the game data, potential strategic implications, or exploring nuanced aspects of team matchups. Then, answer these questions in detail.
 
@@ -434,7 +320,7 @@ In your answers, focus on information that can be derived from or is closely rel
 
 Write your follow-up questions and answers inside <follow_up> tags."""
     print("following up")
-    follow_up_message = client.messages.create(
+    follow_up_message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0.2,
@@ -462,16 +348,19 @@ Write your follow-up questions and answers inside <follow_up> tags."""
         ]
     )
 
-    follow_up_resp = str(follow_up_message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    follow_up_resp = message_text(follow_up_message)
 
     return initial_resp + "\n\n" + follow_up_resp
 
-def claude_lineup_analysis(lineup_data):
+def claude_game_analysis(game_data, home, away):
+    return run_claude(claude_game_analysis_stage(game_data, home, away), client, cache=response_cache)
+
+def claude_lineup_analysis_stage(lineup_data):
     print("Getting lineup analysis")
     initial_prompt = f"""You are tasked with analyzing NFL starting lineup data to provide insights for game strategy and preparation. The data you will be working with is structured as follows:
 
 <lineups_data>
-{lineup_data}
+{to_tables(lineup_data)}
 </lineups_data>
 
 This data contains information about the offensive and defensive lineups for two teams. Each player is listed with their position, grade, position rank, and overall rank.
@@ -508,7 +397,7 @@ Present your analysis in a clear, structured format. Use headings to separate di
 Focus only on the grades and ranks provided in the data.
 Begin your analysis with an overview of the teams and the data provided, then proceed through each step of the analysis. Conclude with a summary of the key insights and strategic recommendations for both teams, based solely on the given data.
 Write your complete analysis inside <analysis> tags."""
-    initial_message = client.messages.create(
+    initial_message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=5000,
         temperature=0.0,
@@ -524,7 +413,7 @@ Write your complete analysis inside <analysis> tags."""
         ]
     )
 
-    initial_resp = str(initial_message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    initial_resp = message_text(initial_message)
 
     print("following up")
     follow_up_prompt = f"""Based on your previous analysis of the lineup data, provide three specific, insightful follow-up questions that would offer deeper understanding of crucial aspects of this matchup. These questions should focus on deeper analysis of the lineup data, potential strategic adjustments, or exploring nuanced aspects of player matchups. Then, answer these questions in detail.
@@ -543,7 +432,7 @@ In your answers, focus on information that can be derived from or is closely rel
 
 Write your follow-up questions and answers inside <follow_up> tags."""
 
-    follow_up_message = client.messages.create(
+    follow_up_message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0.2,
@@ -571,19 +460,26 @@ Write your follow-up questions and answers inside <follow_up> tags."""
         ]
     )
 
-    follow_up_resp = str(follow_up_message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    follow_up_resp = message_text(follow_up_message)
 
     return initial_resp + "\n\n" + follow_up_resp
 
+def claude_lineup_analysis(lineup_data):
+    return run_claude(claude_lineup_analysis_stage(lineup_data), client, cache=response_cache)
+
 def realtime_perplexity_analysis(home, away, test=False):
     url = "https://api.perplexity.ai/chat/completions"
     print("Getting real-time perplexity insight")
 
     def perplexity_query(messages):
         model_choices = ['small', 'large', 'huge']
-        mod = random.choice(model_choices)
-        model_choice = "llama-3.1-8b-instruct" if test else f"llama-3.1-sonar-{mod}-128k-online"
-        time.sleep(10)
+        models = ["llama-3.1-8b-instruct"] if test else [f"llama-3.1-sonar-{mod}-128k-online" for mod in model_choices]
+        # the model is picked at random, so reuse a cached answer from whichever one gave it
+        for model in models:
+            cached = response_cache.get(response_cache.key(model, None, None, messages))
+            if cached is not None:
+                return cached
+        model_choice = random.choice(models)
 
         payload = {
             "model": model_choice,
@@ -593,9 +489,11 @@ def realtime_perplexity_analysis(home, away, test=False):
             "Authorization": f"Bearer {perplexity_key}",
             "Content-Type": "application/json"
         }
-        response = requests.post(url, json=payload, headers=headers)
+        response = perplexity_client.post(url, json=payload, headers=headers)
         if response.status_code == 200:
-            return response.json()['choices'][0]['message']['content']
+            content = response.json()['choices'][0]['message']['content']
+            response_cache.set(response_cache.key(model_choice, None, None, messages), content)
+            return content
         else:
             print(f"Error: {response}")
             return ""
@@ -689,69 +587,29 @@ In your answers, prioritize information that is not likely to be captured in tra
     }
 
 
-def scrape_adv_analytics(week, home, away):
-    nfl_team_mapping = {
-        "Cowboys": "DAL",
-        "Saints": "NO",
-        "Bengals": "CIN",
-        "Rams": "LA",
-        "Vikings": "MIN",
-        "Jaguars": "JAX",
-        "Steelers": "PIT",
-        "Broncos": "DEN",
-        "Eagles": "PHI",
-        "Commanders": "WAS",
-        "Patriots": "NE",
-        "Chiefs": "KC",
-        "Browns": "CLE",
-        "Bills": "BUF",
-        "Titans": "TEN",
-        "Seahawks": "SEA",
-        "Giants": "NYG",
-        "Falcons": "ATL",
-        "Panthers": "CAR",
-        "Bears": "CHI",
-        "Packers": "GB",
-        "Texans": "HOU",
-        "Colts": "IND",
-        "Jets": "NYJ",
-        "Buccaneers": "TB",
-        "Cardinals": "ARI",
-        "49ers": "SF",
-        "Chargers": "LAC",
-        "Raiders": "LV",
-        "Ravens": "BAL",
-        "Dolphins": "MIA",
-        "Lions": "DET"
-    }
+def get_random_user_agent():
+    user_agents = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/91.0.864.59 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 10.0; WOW64; Trident/7.0; rv:11.0) like Gecko",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:89.0) Gecko/20100101 Firefox/89.0",
+        "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0",
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36",
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Mobile/15E148 Safari/604.1",
+        "Mozilla/5.0 (iPad; CPU OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/91.0.4472.80 Mobile/15E148 Safari/604.1",
+        "Mozilla/5.0 (Linux; Android 11; SM-G991U) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 Mobile Safari/537.36",
+        "Mozilla/5.0 (Android 11; Mobile; rv:68.0) Gecko/68.0 Firefox/88.0",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.63 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Safari/605.1.15",
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:92.0) Gecko/20100101 Firefox/92.0",
+    ]
+    return random.choice(user_agents)
 
-    home = nfl_team_mapping[home]
-    away = nfl_team_mapping[away]
-    print(home)
-    print(away)
-    week = week.zfill(2)
-    url= f'https://sumersports.com/games/2024-{week}-{away}-{home}/'
-    def get_random_user_agent():
-        user_agents = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/91.0.864.59 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 10.0; WOW64; Trident/7.0; rv:11.0) like Gecko",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:89.0) Gecko/20100101 Firefox/89.0",
-            "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:89.0) Gecko/20100101 Firefox/89.0",
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36",
-            "Mozilla/5.0 (iPhone; CPU iPhone OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Mobile/15E148 Safari/604.1",
-            "Mozilla/5.0 (iPad; CPU OS 14_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/91.0.4472.80 Mobile/15E148 Safari/604.1",
-            "Mozilla/5.0 (Linux; Android 11; SM-G991U) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.120 Mobile Safari/537.36",
-            "Mozilla/5.0 (Android 11; Mobile; rv:68.0) Gecko/68.0 Firefox/88.0",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.63 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.0 Safari/605.1.15",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:92.0) Gecko/20100101 Firefox/92.0",
-        ]
-        return random.choice(user_agents)
 
+def new_chrome_driver():
     chrome_options = Options()
     chrome_options.add_argument(f"user-agent={get_random_user_agent()}")
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
@@ -762,82 +620,136 @@ def scrape_adv_analytics(week, home, away):
     driver = webdriver.Chrome(options=chrome_options)
     driver.execute_cdp_cmd('Network.setUserAgentOverride', {"userAgent": get_random_user_agent()})
     driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    return driver
+
+# warm Chrome sessions shared by every game's Sumer Sports scrape
+browser_pool = BrowserPool(new_chrome_driver, size=3, max_pages=25)
+
+nfl_team_mapping = {
+    "Cowboys": "DAL",
+    "Saints": "NO",
+    "Bengals": "CIN",
+    "Rams": "LA",
+    "Vikings": "MIN",
+    "Jaguars": "JAX",
+    "Steelers": "PIT",
+    "Broncos": "DEN",
+    "Eagles": "PHI",
+    "Commanders": "WAS",
+    "Patriots": "NE",
+    "Chiefs": "KC",
+    "Browns": "CLE",
+    "Bills": "BUF",
+    "Titans": "TEN",
+    "Seahawks": "SEA",
+    "Giants": "NYG",
+    "Falcons": "ATL",
+    "Panthers": "CAR",
+    "Bears": "CHI",
+    "Packers": "GB",
+    "Texans": "HOU",
+    "Colts": "IND",
+    "Jets": "NYJ",
+    "Buccaneers": "TB",
+    "Cardinals": "ARI",
+    "49ers": "SF",
+    "Chargers": "LAC",
+    "Raiders": "LV",
+    "Ravens": "BAL",
+    "Dolphins": "MIA",
+    "Lions": "DET",
+    # short names used in nfl_schedule.xlsx
+    "Bucs": "TB",
+    "Jags": "JAX",
+    "Niners": "SF"
+}
+
+def sumer_url(week, home, away):
+    week = str(week).zfill(2)
+    return f'https://sumersports.com/games/2024-{week}-{nfl_team_mapping[away]}-{nfl_team_mapping[home]}/'
+
+def sumer_page_path(week, home, away):
+    return f'nfl/week{week}/sumer/{nfl_team_mapping[away]}-{nfl_team_mapping[home]}'
+
+def fetch_sumer_page_selenium(url):
+    # the pool hands back a warm browser; it's returned after the page loads and recycled after
+    # max_pages pages
+    with browser_pool.session() as driver:
+        driver.get(url)
+        return driver.page_source
+
+def fetch_adv_analytics(week, home, away):
+    url = sumer_url(week, home, away)
+    print(url)
+    content, adv_stats, source = sumer_client.fetch_page(url, fetch_sumer_page_selenium, get_random_user_agent(), parse_adv_analytics)
+    if adv_stats is None:
+        # parsed before anything is written, so a page that isn't published yet leaves nothing behind
+        adv_stats = parse_adv_analytics(content)
+
+    # keep every page that parsed, timestamped, next to the parsed stats
+    path = sumer_page_path(week, home, away)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fetched_at = datetime.now()
+    html_path = f"{path}_{fetched_at.strftime('%Y%m%d-%H%M%S')}.html"
+    with open(html_path, 'w') as f:
+        f.write(content)
+    with open(path + '.json', 'w') as f:
+        json.dump({"url": url, "fetched_at": fetched_at.isoformat(), "source": source, "html": html_path, "adv_stats": adv_stats}, f)
+    return adv_stats
+
+def load_prefetched_adv_analytics(week, home, away, max_age=timedelta(hours=12)):
+    path = sumer_page_path(week, home, away) + '.json'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        prefetched = json.load(f)
+    if datetime.now() - datetime.fromisoformat(prefetched['fetched_at']) > max_age:
+        return None
+    return prefetched['adv_stats']
 
-    driver.get(url)
-    content = driver.page_source
-    driver.quit()
-
-    soup = BeautifulSoup(content, 'html.parser')
-    stat_tables = soup.find_all('div', class_='stat-table')
-    off_v_def = soup.find('div', class_='game-comparison-off-vs-def')
-    def_v_off = soup.find('div', class_='game-comparison-def-vs-off')
-
-    away_team = (soup.find_all('h2')[2].text).replace(' Statistics', '')
-    home_team = (soup.find_all('h2')[-1].text).replace(' Statistics', '')
-
-    away_stats = stat_tables[0:7]
-    home_stats = stat_tables[7:]
-
-    def parse_stat_tables(stats, team):
-        result = {"Team Stats": "Team Stats", team: []}
-        for table_html in stats:
-            table_soup = BeautifulSoup(str(table_html), 'html.parser')
-            table_dict = {}
-            for div in table_soup.find_all('div', class_=['stat-total', 'stat-offense', 'stat-defense']):
-                label = div.find('div', class_='label').text
-                value = div.find('div', class_='value').text
-                rank = div.find('div', class_='rank').text
-                rank = int(rank.strip('th').strip('st').strip('nd').strip('rd'))
-                table_dict[label] = {'value': value, 'rank': rank}
-            result[team].append(table_dict)
-        return result
-
-    def parse_game_comparison(html_content, home_team, away_team, table_type):
-        title = html_content.find('h2').text
-        if table_type == 'off_v_def':
-            title = title.replace('Offense', away_team + ' Offense').replace('Defense', home_team + ' Defense')
-        elif table_type == 'def_v_off':
-            title = title.replace('Offense', home_team + ' Offense').replace('Defense', away_team + ' Defense')
-
-        result = {"title": title, "comparisons": []}
-        comparison_soup = BeautifulSoup(str(html_content), 'html.parser')
-        rows = comparison_soup.find_all('div', class_='game-table-row')
-
-        for row in rows:
-            cells = row.find_all('div', class_='game-table-cell')
-            comparison = {
-                'stat': cells[2].text,
-                away_team + (" Offense" if table_type == 'off_v_def' else ' Defense'): {
-                    'rank': cells[0].text.strip('th').strip('st').strip('nd').strip('rd'),
-                    'value': cells[1].text
-                },
-                home_team + (" Defense" if table_type == 'off_v_def' else ' Offense'): {
-                    'rank': cells[4].text.strip('th').strip('st').strip('nd').strip('rd'),
-                    'value': cells[3].text
-                }
-            }
-            result['comparisons'].append(comparison)
-
-        return result
-
-    home_stats_json = parse_stat_tables(home_stats, home_team)
-    away_stats_json = parse_stat_tables(away_stats, away_team)
-    team_stats = {'title': "Advanced Analytics", home_team: home_stats_json[home_team], away_team: away_stats_json[away_team]}
-
-    off_v_def_comparison = parse_game_comparison(off_v_def, home_team, away_team, 'off_v_def')
-    def_v_off_comparison = parse_game_comparison(def_v_off, home_team, away_team, 'def_v_off')
-
-    combined_stats = {
-        "team_stats": team_stats,
-        "comparisons": {
-            "offense_vs_defense": off_v_def_comparison,
-            "defense_vs_offense": def_v_off_comparison
-        }
-    }
+def scrape_adv_analytics(week, home, away):
+    pending = prefetching.get((str(week), home, away))
+    if pending is not None:
+        # the prefetch has this page in hand; wait for it rather than loading it a second time
+        pending.result()
+    adv_stats = load_prefetched_adv_analytics(week, home, away)
+    if adv_stats is not None:
+        print(f"Using prefetched advanced stats for {away} at {home}")
+        return adv_stats
+    return fetch_adv_analytics(week, home, away)
+
+# prefetch_week's futures by (week, home, away), so a game's scrape can wait on its own page
+prefetching = {}
+
+def prefetch_week(week, games=None, schedule='nfl_schedule.xlsx'):
+    # start loading the week's Sumer Sports pages through the browser pool, so the pick pipeline
+    # starts from local data instead of waiting on Selenium. Returns straight away: the slate runs
+    # while the pages load, and each game only waits for its own. games is a list of (home, away)
+    # pairs, every game in the schedule by default
+    week = str(week)
+    if games is None:
+        df = pd.read_excel(schedule, sheet_name = f"Week {week}")
+        df = df[df['Ignore'] != 1]
+        games = [(row['Home'], row['Away']) for _, row in df.iterrows()]
+
+    def prefetch_game(home, away):
+        if load_prefetched_adv_analytics(week, home, away) is not None:
+            return True
+        try:
+            adv_stats_retry.run(lambda: fetch_adv_analytics(week, home, away), f"Advanced stats prefetch for {away} at {home}")
+            return True
+        except Exception as e:
+            print(f"Couldn't prefetch advanced stats for {away} at {home}: {e}")
+            return False
 
-    return combined_stats
+    pool = ThreadPoolExecutor(max_workers=browser_pool.size)
+    futures = {(week, home, away): pool.submit(prefetch_game, home, away) for home, away in games}
+    pool.shutdown(wait=False)
+    prefetching.update(futures)
+    print(f"Prefetching advanced stats for {len(games)} games")
+    return futures
 
-def claude_expert_picks(insight_dict, home, away):
+def claude_expert_picks_stage(insight_dict, home, away):
     adv_stats_analysis = insight_dict["Adv. Stats Analysis"]
     game_analysis = insight_dict["Game Analysis"]
     lineup_analysis = insight_dict["Starting Lineup Analysis"]
@@ -900,21 +812,7 @@ When making your picks, keep the following principles in mind:
 5. Only bet on the Moneyline if the line is between -200 and +200. If the line is outside this range, consider betting on the spread instead.
 6. Choose either to bet the Spread or the Moneyline, not both, based on which offers the better value proposition according to your analysis. If you choose to bet on moneyline, list "no bet" for the spread and vice versa.
 
-Present your analysis and picks in the following JSON format:
-
-{{"Summary" : [Provide a very brief summary of the key points across all sections, emphasizing the most significant quantitative and qualitative findings, and your overall assessment of the game. Highlight any significant factors that stand out from the comprehensive analysis.],
-"Moneyline" : {{"Analysis" : {{"Summary" : [Provide your reasoning for the Moneyline analysis here. This should be a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis. Reference specific sections of the analysis where relevant.], 
-"Market Efficiency" : [Explain why you believe your identified edge isn't already priced into the odds. Discuss how your insight differs from or goes beyond the obvious factors that all bettors would consider. Justify why you think this particular inefficiency exists in an otherwise highly efficient market.],
-"Pick" : [State your Moneyline pick here],
-"Units" : [Provide a suggested bet size from 0 to 5 units, with justification]}},
-"Spread" : {{"Analysis" : {{"Summary" : [Provide your reasoning for the Moneyline analysis here. This should be a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis. Reference specific sections of the analysis where relevant.], 
-"Market Efficiency" : [Explain why you believe your identified edge isn't already priced into the odds. Discuss how your insight differs from or goes beyond the obvious factors that all bettors would consider. Justify why you think this particular inefficiency exists in an otherwise highly efficient market.],
-"Pick" : [State your Spread pick here],
-"Units" : [Provide a suggested bet size from 0 to 5 units, with justification]}},
-"Total" : {{"Analysis" : {{"Summary" : [Provide your reasoning for the Moneyline analysis here. This should be a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis. Reference specific sections of the analysis where relevant.], 
-"Market Efficiency" : [Explain why you believe your identified edge isn't already priced into the odds. Discuss how your insight differs from or goes beyond the obvious factors that all bettors would consider. Justify why you think this particular inefficiency exists in an otherwise highly efficient market.],
-"Pick" : [State your Total pick here],
-"Units" : [Provide a suggested bet size from 0 to 5 units, with justification]}}}}
+Submit your analysis and picks with the submit_expert_picks tool.
 
 Ensure that your reasoning is clear, logical, and well-supported by the provided game data. Your picks should reflect a careful consideration of all available information, with a focus on identifying and exploiting market inefficiencies. Be prepared to recommend "No Bet" if you don't find any significant edge in any market. Thoroughly justify any betting suggestion with clear reasoning on why the edge is significant enough to warrant a bet, and explain how you arrived at your unit rating.
 
@@ -923,7 +821,7 @@ If you find any areas where the analysis might be incomplete or where you have d
 Remember, the goal is to make the most accurate and profitable picks based on the data provided, while being extremely mindful of market efficiency. It's entirely acceptable to recommend no bets if you can't identify any clear, significant edges that you're confident the market has missed or undervalued. Quality of analysis is far more important than quantity of bets suggested.
 """
 
-    message = client.messages.create(
+    request = dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=3000,
         temperature=0.1,
@@ -933,106 +831,20 @@ Remember, the goal is to make the most accurate and profitable picks based on th
                 "content": [
                     {
                         "type": "text",
-                        "text": prompt}
+                        "text": prompt,
+                        # identical for every expert on the panel, so experts after the first read it from the cache
+                        "cache_control": {"type": "ephemeral"}}
                 ]
             }
         ]
     )
 
-    resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
-    return resp
+    return (yield from structured_call(request, ExpertPicks, expert_picks_tool))
 
-def claude_consensus_pick(expert_data, home, away):
-    print("Getting consensus pick")
-    consensus_prompt = f"""You are an elite NFL analyst and synthesizer, tasked with aggregating multiple expert opinions to determine the most consensus betting recommendations for the game between {home} and {away}. Your goal is to summarize the collective wisdom of the experts without adding your own analysis.
-
-    Here is the expert data you need to analyze:
-    <expert_data>
-    {expert_data}
-    </expert_data>
-
-    You have been provided with analyses from multiple expert agents. Each expert has given their insights and picks on the Moneyline, Spread, and Total markets for this game. Your task is to synthesize these opinions and provide a consensus recommendation for each market.
-
-    For each betting market (Moneyline, Spread, and Total), please:
-
-    1. Tally the experts' picks and determine the most common recommendation.
-    2. If there's no clear consensus, choose "No Bet" as the recommendation.
-    3. Summarize the most frequently mentioned factors that experts used to support their picks.
-    4. Calculate the average unit rating based on the experts' recommendations, rounding to the nearest 0.5 unit. If the average is below 0.5, use 0 (No Bet).
-
-    Important: Do not recommend bets on both the Moneyline and Spread. Choose the one that offers better value according to the expert opinions. If you choose to bet on the Moneyline, list "No Bet" for the Spread and vice versa.
-
-    Present your analysis and official picks in the following JSON format:
-
-    {{"analysis": {{"Moneyline" : {{"Summary": [Comprehensive summary of expert opinions, original data, and your critical analysis],
-    "Key_Insights": [Most compelling arguments and data points from experts and original data],
-    "Risk_Factors": [Discussion of potential risks or uncertainties],
-}},
-    "Spread" : {{"Summary": [Comprehensive summary of expert opinions, original data, and your critical analysis],
-    "Key_Insights": [Most compelling arguments and data points from experts and original data],
-    "Risk_Factors": [Discussion of potential risks or uncertainties],
-}},
-    "Total" : {{"Summary": [Comprehensive summary of expert opinions, original data, and your critical analysis],
-    "Key_Insights": [Most compelling arguments and data points from experts and original data],
-    "Risk_Factors": [Discussion of potential risks or uncertainties],
-}},    
-    "official_picks": {{"Moneyline": {{"Pick": [Your official Moneyline pick],
-    "Reasoning": [Paragraph explanation of your reasoning],
-    "Units": [0-5]}},
-    "Spread": {{"Pick": [Your official Spread pick],
-    "Reasoning": [Paragraph explanation of your reasoning],
-    "Units": [0-5]}},
-    "Total": {{"Pick": [Your official Total pick],
-    "Reasoning": [Paragraph explanation of your reasoning],
-    "Units": [0-5]}},
-    "moneyline_vs_spread": {{"Preferred Bet": [Choose either Moneyline or Spread],
-    "Justification": "[Explain why you believe this bet offers better value]"}}}}
-
-Important considerations:
-- Do not add any of your own analysis or insight. Your role is solely to aggregate and summarize the experts' opinions.
-- If expert opinions are evenly split or too divergent, recommend "No Bet" for that market.
-- In the "Reasoning" section, list only the factors mentioned by multiple experts. Do not include unique insights mentioned by only one expert.
-- Ensure that the "Units" rating accurately reflects the average of the experts' recommendations.
-- Remember to choose either Moneyline or Spread based on which offers better value according to expert opinions. Do not recommend both.
-
-Your role is to represent the opinions of the expert panel, and to provide the most informed and well-reasoned betting recommendations possible, synthesizing the expertise of multiple college football experts.
-
-Return only the JSON-formatted consensus picks without any additional text or context. Ensure it can be loaded into a JSON object without errors.
-"""
-
-    # Replace {expert_data} in the prompt with the actual expert data
-    consensus_prompt = consensus_prompt.replace("{expert_data}", expert_data)
-
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=5000,
-        temperature=0,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": consensus_prompt
-                    }
-                ]
-            }
-        ]
-    )
-    content = str(message.content)
-    content = content.replace("[TextBlock(text='", "")
-    content = content.replace("', type='text')]", "")
-    content = content.strip()
-
-    # Remove escaped newlines and replace with actual newlines
-    content = content.replace('\\n', '\n')
-    # Remove escaped quotes
-    content = content.replace("\\'", "'")
-    content = content.replace("  ", "")
-    content = content.replace("\n", " ")
-    return content
+def claude_expert_picks(insight_dict, home, away):
+    return run_claude(claude_expert_picks_stage(insight_dict, home, away), client)
 
-def format_for_discord(consensus_pick, home, away):
+def format_for_discord_stage(consensus_pick, home, away):
     prompt = f"""
     You are tasked with converting sports prediction data into a concise, engaging, and authoritative message for a Discord channel. The data contains analysis and official picks for various betting options in an upcoming NFL game. This information comes from an ensemble of highly sophisticated, cutting-edge AI agents who were given data on advanced stats and qualitative factors influencing the game.
     Here is the prediction data to process:
@@ -1071,7 +883,7 @@ Key Considerations:
 
 """
 
-    message = client.messages.create(
+    message = yield dict(
         model="claude-3-5-sonnet-20240620",
         max_tokens=1000,
         temperature=0.2,
@@ -1087,14 +899,26 @@ Key Considerations:
         ]
     )
 
-    resp = str(message.content).replace("[TextBlock(text=", "").replace(", type='text')]", "")
+    if message.stop_reason != "end_turn":
+        # cut off, either by longer_than or by max_tokens: never post a half-finished message
+        return None
+    resp = message_text(message)
     resp = resp.replace('"', "")
     return resp
 
+def format_for_discord(consensus_pick, home, away):
+    # an over-long draft gets regenerated, so stop paying for it as soon as it passes the limit
+    return run_claude(format_for_discord_stage(consensus_pick, home, away), client, stop_when=longer_than(2000))
+
+# a draft over Discord's 2000-character limit is regenerated, up to this many times in all
+max_discord_attempts = 4
+
 def send_to_discord(message):
     message = message.replace("\\n", "\n")
+    limiters["discord"].acquire()
 
-    loop = asyncio.get_event_loop()
+    # games run on worker threads, which don't have an event loop of their own
+    loop = asyncio.new_event_loop()
     client = discord.Client(intents=discord.Intents.default())
     guild_name = 'Algorhythm Bets'
     channel_name = 'nfl-official-picks'
@@ -1106,65 +930,108 @@ def send_to_discord(message):
         await channel.send(f"""{message}""")
         await client.close()
     loop.run_until_complete(client.start(discord_token))
+    loop.close()
     print("Message sent")
 
-def primary_pick_engine(week, greenline, lineups1, lineups2):
+# shared by every game, so once Sumer Sports has failed several times in a row the rest of the
+# slate skips straight to running without advanced stats
+adv_stats_retry = RetryPolicy(max_attempts=4, base_delay=5, max_delay=30, deadline=120,
+                              breaker=CircuitBreaker("Sumer Sports", failure_threshold=6, reset_timeout=600))
+
+# how long the checkpoints of stages that go stale stay usable on a resumed game (in seconds): the
+# odds as long as the response cache keeps them, the Sumer stats as long as a prefetched page
+checkpoint_max_age = {"odds": 30 * 60, "perplexity_analysis": 2 * 60 * 60, "adv_stats": 12 * 60 * 60}
+
+def primary_pick_engine(week, greenline, lineups1, lineups2, checkpoint_dir=None):
     game_data, lineups = parse_pff_data(greenline, lineups1, lineups2)
     away = game_data['teams']['away']
     home = game_data['teams']['home']
 
-    print('scraping advanced stats')
-    adv_stats = None
-    while adv_stats is None:
+    def scrape_adv_stats():
+        print('scraping advanced stats')
         try:
-            adv_stats = scrape_adv_analytics(week, home, away)
-        except:
-            print('Error scraping advanced stats, retrying')
-            time.sleep(5)
-
-    claude_adv_stats = claude_adv_stats_analysis(adv_stats, home, away)
-
-    claude_quant_insight = claude_game_analysis(game_data, home, away)
-
-    lineup_analysis = claude_lineup_analysis(lineups)
-
-    perplexity_analysis = realtime_perplexity_analysis(home, away)
-
-    game_odds = get_perplexity_odds(home, away)
-
-    insight_dict = {"Game Analysis": claude_quant_insight,
-                    "Adv. Stats Analysis" : claude_adv_stats,
-                    "Starting Lineup Analysis" : lineup_analysis,
-                    "Perplexity Analysis": perplexity_analysis,
-                    "Game Odds": game_odds}
-
-    # poll Claude experts
-    num_experts = 5
-    expert_dict = {}
-    for i in range(num_experts):
-        print(f"Getting analysis from AI agent {i+1} of {num_experts}")
-        response = claude_expert_picks(insight_dict, home, away)
-        print(f"{response}")
-        print('\n')
-        expert_dict[f"Expert {i+1}"] = response
-
-    ### 8. Get final analysis from Claude
-    consensus_pick = claude_consensus_pick(str(expert_dict), home, away)
-    consensus_pick = json.loads(consensus_pick)
-
-    print("Formatting for discord")
-    disc = format_for_discord(consensus_pick, home, away)
-    print(disc)
-    while len(disc) > 2000:
-        print("Message too long, retrying")
-        disc = format_for_discord(consensus_pick, home, away)
-        print(disc)
-
-    print("Sending to discord")
-    send_to_discord(disc)
-    return adv_stats, game_data, lineups, claude_adv_stats, claude_quant_insight, lineup_analysis, perplexity_analysis, game_odds, expert_dict, consensus_pick, disc
-
-def main(week):
+            return adv_stats_retry.run(lambda: scrape_adv_analytics(week, home, away), "Advanced stats scrape")
+        except Exception as e:
+            # Sumer Sports hasn't always published the matchup page; carry on without it rather than
+            # holding up the game
+            print(f"No advanced stats for {away} at {home}, continuing without them: {e}")
+            return None
+
+    def analyze_adv_stats(adv_stats):
+        if adv_stats is None:
+            return "Advanced stats were not available for this game."
+        return claude_adv_stats_analysis(adv_stats, home, away)
+
+    def poll_experts(claude_adv_stats, claude_quant_insight, lineup_analysis, perplexity_analysis, game_odds):
+        insight_dict = {"Game Analysis": claude_quant_insight,
+                        "Adv. Stats Analysis" : claude_adv_stats,
+                        "Starting Lineup Analysis" : lineup_analysis,
+                        "Perplexity Analysis": perplexity_analysis,
+                        "Game Odds": game_odds}
+
+        # poll Claude experts
+        num_experts = 5
+        if isinstance(client, ClaudeLoop):
+            # the whole panel goes out as tasks on the loop, without a thread per expert
+            return client.run(gather_experts_async(lambda i: run_claude_async(claude_expert_picks_stage(insight_dict, home, away), client.client), num_experts,
+                                                   prime=lambda: prime_cache_async(claude_expert_picks_stage(insight_dict, home, away), client.client)))
+        return gather_experts(lambda i: claude_expert_picks(insight_dict, home, away), num_experts,
+                              # a batch already prices the whole panel at half, and a primer would cost a batch round of its own
+                              prime=None if isinstance(client, MessageBatcher) else lambda: prime_cache(claude_expert_picks_stage(insight_dict, home, away), client))
+
+    def get_consensus(expert_dict, game_odds):
+        ### 8. Tally the experts' picks
+        # PFF's market moneyline, or the odds lookup's when the Greenline page doesn't have one
+        moneyline = moneyline_prices(game_data['moneyline'].get('Market')) or moneyline_from_odds(game_odds, home, away)
+        return aggregate_picks(expert_dict, home, away, moneyline)
+
+    def get_discord_message(consensus_pick):
+        print("Formatting for discord")
+        for attempt in range(max_discord_attempts):
+            disc = format_for_discord(consensus_pick, home, away)
+            print(disc)
+            if disc is not None and len(disc) <= 2000:
+                return disc
+            print("Message too long, retrying")
+        raise ValueError(f"No Discord message under 2000 characters after {max_discord_attempts} attempts")
+
+    def post_to_discord(disc):
+        print("Sending to discord")
+        send_to_discord(disc)
+        # something to checkpoint, so a resumed game knows it has already been posted
+        return datetime.now().isoformat()
+
+    # the analysis stages don't read each other's output, so they all run at once; only the
+    # expert panel has to wait for every one of them
+    stages = {
+        "adv_stats": ((), scrape_adv_stats),
+        "adv_stats_analysis": (("adv_stats",), analyze_adv_stats),
+        "game_analysis": ((), lambda: claude_game_analysis(game_data, home, away)),
+        "lineup_analysis": ((), lambda: claude_lineup_analysis(lineups)),
+        "perplexity_analysis": ((), lambda: realtime_perplexity_analysis(home, away)),
+        "odds": ((), lambda: get_perplexity_odds(home, away)),
+        "experts": (("adv_stats_analysis", "game_analysis", "lineup_analysis", "perplexity_analysis", "odds"), poll_experts),
+        "consensus": (("experts", "odds"), get_consensus),
+        "discord": (("consensus",), get_discord_message),
+        "send": (("discord",), post_to_discord),
+    }
+    # every finished stage is saved next to the game's PFF pages, so a re-run picks up where it left off
+    checkpoint = CheckpointStore(checkpoint_dir, max_age=checkpoint_max_age) if checkpoint_dir else None
+    results, timings = run_stage_graph(stages, checkpoint=checkpoint, side_effects=("send",))
+
+    adv_stats = results["adv_stats"]
+    claude_adv_stats = results["adv_stats_analysis"]
+    claude_quant_insight = results["game_analysis"]
+    lineup_analysis = results["lineup_analysis"]
+    perplexity_analysis = results["perplexity_analysis"]
+    game_odds = results["odds"]
+    expert_dict = results["experts"]
+    consensus_pick = results["consensus"]
+    disc = results["discord"]
+    # seconds per stage that ran this time; stages resumed from a checkpoint aren't in it
+    return adv_stats, game_data, lineups, claude_adv_stats, claude_quant_insight, lineup_analysis, perplexity_analysis, game_odds, expert_dict, consensus_pick, disc, timings
+
+def main(week, max_concurrency=4, prefetch=True, batch=False, event_loop=False):
     week = str(week)
     df = pd.read_excel('nfl_schedule.xlsx', sheet_name = f"Week {week}")
     # get list of paths
@@ -1174,16 +1041,17 @@ def main(week):
         if not os.path.exists(f'nfl/week{week.lower().replace(" ", "")}/{path}'):
             os.makedirs(f'nfl/week{week.lower().replace(" ", "")}/{path}')
     df = df[df['Ignore'] != 1]
-    if os.path.exists(f'picks/nfl/week_{week}_picks.xlsx'):
-        existing_games = pd.read_excel(f'picks/nfl/week_{week}_picks.xlsx')
+    picks = PicksStore(f'picks/nfl/week_{week}_picks.jsonl', f'picks/nfl/week_{week}_picks.xlsx')
+    existing_games = picks.load()
+    # full, untruncated stage outputs for backtesting; the spreadsheet keeps its str() columns
+    artifacts = ArtifactStore()
+    if not existing_games.empty:
         df = df[~df['Home'].isin(existing_games['Home'])]
     else:
         print('exists = False')
-        existing_games = pd.DataFrame()
 
-    for index, row in df.iterrows():
+    def run_game(row):
         print(f"Processing {row['Away']} at {row['Home']}")
-        game_df = pd.DataFrame([row], index=[index])
 
         path = row['Path']
         path = f'nfl/week{week.lower().replace(" ", "")}/{path}'
@@ -1196,7 +1064,12 @@ def main(week):
             lineups2 = f.read()
         print(path)
 
-        adv_stats, game_data, lineups, adv_stats_analysis, claude_quant_insight, lineup_analysis, perplexity_analysis, game_odds, expert_dict, consensus_pick, disc =  primary_pick_engine(week, greenline, lineups1, lineups2)
+        with labelled(game=f"{row['Away']} at {row['Home']}"):
+            return primary_pick_engine(week, greenline, lineups1, lineups2, checkpoint_dir=path)
+
+    def save_game(index, result):
+        game_df = pd.DataFrame([df.loc[index]], index=[index])
+        adv_stats, game_data, lineups, adv_stats_analysis, claude_quant_insight, lineup_analysis, perplexity_analysis, game_odds, expert_dict, consensus_pick, disc, timings = result
 
         ## add to dataframe
         game_df.loc[index, 'adv_stats'] = str(adv_stats)
@@ -1210,14 +1083,59 @@ def main(week):
         game_df.loc[index, 'expert_dict'] = str(expert_dict)
         game_df.loc[index, 'consensus_pick'] = str(consensus_pick)
         game_df.loc[index, 'discord_message'] = str(disc)
+        game_df.loc[index, 'stage_timings'] = str({name: round(seconds, 2) for name, seconds in timings.items()})
         game_df.loc[index, 'ML_pick'] = str(consensus_pick['official_picks']['Moneyline']['Pick']) + " (" + str(consensus_pick['official_picks']['Moneyline']['Units']) + " units)"
         game_df.loc[index, 'Spread_pick'] = str(consensus_pick['official_picks']['Spread']['Pick']) + " (" + str(consensus_pick['official_picks']['Spread']['Units']) + " units)"
         game_df.loc[index, 'Total_pick'] = str(consensus_pick['official_picks']['Total']['Pick']) + " (" + str(consensus_pick['official_picks']['Total']['Units']) + " units)"
-        existing_games = pd.concat([existing_games, game_df])
-        existing_games.to_excel(f'picks/nfl/week_{week}_picks.xlsx', index = False)
+        picks.append(game_df.loc[index].to_dict())
+        artifacts.save_game('nfl', week, game_data['teams']['away'], game_data['teams']['home'], {
+            'adv_stats': adv_stats,
+            'game_data': game_data,
+            'lineups': lineups,
+            'perplexity_analysis': perplexity_analysis,
+            'consensus_pick': consensus_pick,
+            'adv_stats_analysis': adv_stats_analysis,
+            'game_analysis': claude_quant_insight,
+            'lineup_analysis': lineup_analysis,
+            'odds': game_odds,
+            'discord_message': disc,
+            'stage_timings': timings,
+        }, expert_dict, consensus_pick)
+
+    if prefetch:
+        # only the games still to run; the ones already in the picks file were dropped from df above
+        prefetch_week(week, [(row['Home'], row['Away']) for _, row in df.iterrows()])
+
+    games = [(index, row) for index, row in df.iterrows()]
+    global client
+    if batch:
+        # every game runs at once, so each layer's Claude calls from the whole slate share a batch
+        client = MessageBatcher(client)
+        max_concurrency = max(len(games), 1)
+    elif event_loop:
+        # every game runs at once too: their Claude calls all go out on one event loop and its
+        # connection pool, and a game's thread is only busy with its own scraping and posting
+        client = ClaudeLoop(anthropic_key)
+        max_concurrency = max(len(games), 1)
+    try:
+        run_slate(games, run_game, save_game, max_concurrency=max_concurrency)
+    finally:
+        # the spreadsheet is only rebuilt once per run; the jsonl file already has every finished game
+        picks.export()
+        if isinstance(client, ClaudeLoop):
+            client.close()
+    print(f"Perplexity connections: {perplexity_client.connection_stats()}")
+    print(f"Response cache: {response_cache.summary()}")
+    usage_log.report()
+    usage_log.save(f'picks/nfl/week_{week}_usage.jsonl')
 
 
 if __name__ == "__main__":
-    main(week=5)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--week", default=5)
+    parser.add_argument("--batch", action="store_true", help="send the Claude calls as Message Batches: half price, but picks can take hours")
+    parser.add_argument("--event-loop", action="store_true", help="run the Claude calls for the whole slate on one event loop with a shared async client")
+    args = parser.parse_args()
+    main(week=args.week, batch=args.batch, event_loop=args.event_loop)
 
 
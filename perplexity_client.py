@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+import httpx
+
+from rate_limit import limiters, retry_after_seconds
+from usage import usage_log
+
+try:
+    import h2  # noqa: F401 -- httpx only speaks HTTP/2 when h2 is installed
+    http2 = True
+except ImportError:
+    http2 = False
+
+# One pooled client for every Perplexity call in the process, so a slate reuses a handful of keep-alive
+# connections to api.perplexity.ai instead of doing a TCP+TLS handshake per request. Async callers get
+# one pooled AsyncClient per event loop, since an async client's connections belong to the loop that
+# opened them.
+
+limits = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120)
+# the online models regularly take a minute or more to answer
+timeout = httpx.Timeout(300, connect=10)
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def trace(self, event_name, info):
+        # httpcore reports connection setup through the "trace" request extension; a request that
+        # goes out on a kept-alive connection never sees a connect event
+        if event_name == "connection.connect_tcp.complete":
+            with self.lock:
+                self.connections += 1
+
+    async def trace_async(self, event_name, info):
+        self.trace(event_name, info)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections,
+                "connections_reused": self.requests - self.connections,
+            }
+
+
+stats = ConnectionStats()
+session = None
+async_sessions = {}
+session_lock = threading.Lock()
+
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            session = httpx.Client(http2=http2, limits=limits, timeout=timeout)
+    return session
+
+
+def get_async_session():
+    loop = asyncio.get_running_loop()
+    with session_lock:
+        if loop not in async_sessions:
+            async_sessions[loop] = httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+    return async_sessions[loop]
+
+
+max_rate_limit_retries = 5
+
+
+def record_usage(response, payload, seconds):
+    if response.status_code != 200:
+        return
+    try:
+        usage_log.record_perplexity(response.json(), payload.get("model"), seconds)
+    except ValueError:
+        pass
+
+
+def post(url, json, headers):
+    limiter = limiters["perplexity"]
+    for attempt in range(max_rate_limit_retries + 1):
+        limiter.acquire()
+        stats.record_request()
+        start = time.perf_counter()
+        response = get_session().post(url, json=json, headers=headers, extensions={"trace": stats.trace})
+        record_usage(response, json, time.perf_counter() - start)
+        if response.status_code != 429 or attempt == max_rate_limit_retries:
+            return response
+        wait = retry_after_seconds(response.headers)
+        print(f"Perplexity rate limited, waiting {wait:.0f}s")
+        limiter.backoff(wait)
+
+
+async def post_async(url, json, headers):
+    limiter = limiters["perplexity"]
+    for attempt in range(max_rate_limit_retries + 1):
+        await limiter.acquire_async()
+        stats.record_request()
+        start = time.perf_counter()
+        response = await get_async_session().post(url, json=json, headers=headers, extensions={"trace": stats.trace_async})
+        record_usage(response, json, time.perf_counter() - start)
+        if response.status_code != 429 or attempt == max_rate_limit_retries:
+            return response
+        wait = retry_after_seconds(response.headers)
+        print(f"Perplexity rate limited, waiting {wait:.0f}s")
+        limiter.backoff(wait)
+
+
+async def close_async_session():
+    # from the loop the session was opened on, before it closes
+    session = async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.aclose()
+
+
+def connection_stats():
+    return stats.summary()
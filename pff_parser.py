@@ -0,0 +1,208 @@
+import re
+
+import lxml.html
+from lxml import etree
+
+# Parsers for the three saved PFF pages of a game: the Greenline matchup page and the two depth charts.
+# parse_pff_data finds everything it needs in one lxml walk per document and only then reads the text
+# out of the matched nodes, instead of re-searching the whole BeautifulSoup tree for every table and
+# every player field. The original BeautifulSoup version is in bench_parsers.py, which checks the two
+# agree and times them on saved games.
+
+matchup_table_class = "m-matchup-table g-table g-table--compressed"
+offensive_positions = ['QB', 'RB', 'FB', 'WR', 'TE', 'OL', 'C', 'G', 'T', 'LT', 'LG', 'RT', 'RG', 'HB']
+defensive_positions = ['DE', 'DT', 'LB', 'CB', 'S', 'DL', 'DB']
+rank_pattern = re.compile(r'(\d+)(?:st|nd|rd|th)\s*/\s*(\d+)\s*(\w+)')
+
+
+def parse_html(content):
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    # parsers aren't safe to share between threads, and games are parsed concurrently
+    return lxml.html.document_fromstring(content, parser=lxml.html.HTMLParser(encoding='utf-8'))
+
+
+def classes(el):
+    return el.get('class', '').split()
+
+
+def tag_string(el):
+    # BeautifulSoup's .string: the text of a tag whose only child is a string, looking through tags
+    # that have a single child
+    nodes = [el.text] if el.text else []
+    for child in el:
+        nodes.append(child)
+        if child.tail:
+            nodes.append(child.tail)
+    if len(nodes) != 1:
+        return None
+    return nodes[0] if isinstance(nodes[0], str) else tag_string(nodes[0])
+
+
+def is_offensive_position(position):
+    if any(pos in position for pos in defensive_positions):
+        return False
+    elif any(pos in position for pos in offensive_positions):
+        return True
+    else:
+        # If position is not clearly offensive or defensive, assume it's defensive
+        return False
+
+
+def parse_table(table, table_name, home, away):
+    data = {}
+    for row in list(table.iter('tr'))[1:]:  # Skip header row
+        cells = list(row.iter('th', 'td'))
+        key = cells[0].text_content().strip().replace(' ', '_')
+        data[key] = {away: cells[1].text_content().strip(), home: cells[2].text_content().strip()}
+
+    if table_name == "Total":
+        for key in data:
+            data[key] = {"under": data[key][away], "over": data[key][home]}
+
+    return data
+
+
+def parse_injuries(injury_tables, home, away):
+    try:
+        injuries = {away: [], home: []}
+        for i, table in enumerate(injury_tables):
+            team = away if i == 0 else home
+            for row in list(table.iter('tr'))[1:]:  # Skip header row
+                cells = list(row.iter('td'))
+                grade = next(div for div in cells[4].iter('div') if 'kyber-grade-badge__info-text' in classes(div))
+                injuries[team].append({
+                    "name": cells[0].text_content().strip(),
+                    "position": cells[1].text_content().strip(),
+                    "injury": cells[2].text_content().strip(),
+                    "status": cells[3].text_content().strip(),
+                    "grade": float(grade.text_content().strip()),
+                    "pos_war_rank": cells[5].text_content().strip()
+                })
+    except Exception as e:
+        injuries = None
+    return injuries
+
+
+def parse_greenline(greenline_data):
+    team_names, matchup_tables, odds_tables = [], [], {}
+    for el in parse_html(greenline_data).iter(etree.Element):
+        if el.tag == 'span' and 'sr-only' in classes(el):
+            team_names.append(el)
+        elif el.tag == 'table' and ' '.join(classes(el)) == matchup_table_class:
+            matchup_tables.append(el)
+        elif el.tag == 'h3':
+            title = tag_string(el)
+            if title in ("Spread", "Moneyline", "Total") and title not in odds_tables:
+                odds_tables[title] = next(el.iterancestors('table'))
+
+    away = str(team_names[0].text_content())
+    home = str(team_names[1].text_content())
+    return {
+        "teams": {
+            "away": away,
+            "home": home
+        },
+        "spread": parse_table(odds_tables["Spread"], "Spread", home, away),
+        "moneyline": parse_table(odds_tables["Moneyline"], "Moneyline", home, away),
+        "total": parse_table(odds_tables["Total"], "Total", home, away),
+        "impact_player_injuries": parse_injuries(matchup_tables[2:4], home, away),  # the two injury tables
+        "game_metrics": parse_table(matchup_tables[0], "Team Metrics", home, away),
+        'qb_comparison': parse_table(matchup_tables[-1], "QB Comparison", home, away)
+    }
+
+
+player_fields = {
+    ('span', 'player-jersey__name'): 'name',
+    ('div', 'kyber-grade-badge__info-text'): 'grade',
+    ('p', 'm-micro-copy'): 'rank',
+}
+
+
+def parse_player(fields):
+    # fields holds the first matching node of each kind inside the player's div
+    name = fields['name'].text.strip()
+    grade = fields['grade'].text_content().strip() if 'grade' in fields else None
+
+    rank, total, position = None, None, None
+    if 'rank' in fields:
+        rank_match = rank_pattern.search(fields['rank'].text_content().strip())
+        if rank_match:
+            rank, total, position = rank_match.groups()
+
+    return {
+        'name': name,
+        'grade': grade,
+        'position_rank': rank,
+        'overall_rank': total,
+    }
+
+
+def parse_depth_chart(lineups_data):
+    # one start/end walk; open positions and players are kept on stacks so every field node is
+    # credited to the player div(s) it sits in
+    positions, open_positions, open_players = [], [], []
+    for event, el in etree.iterwalk(parse_html(lineups_data), events=('start', 'end')):
+        if not isinstance(el.tag, str):
+            continue
+        if event == 'end':
+            if open_positions and open_positions[-1][0] is el:
+                open_positions.pop()
+            if open_players and open_players[-1][0] is el:
+                open_players.pop()
+            continue
+
+        el_classes = classes(el)
+        if el.tag == 'div' and 'depth-chart__position' in el_classes:
+            position = (el, {'key': el.attrib['data-position-key'], 'title': el.attrib['title'], 'players': []})
+            positions.append(position[1])
+            open_positions.append(position)
+        if el.tag == 'div' and 'depth-chart__player' in el_classes:
+            player = (el, {})
+            for _, open_position in open_positions:
+                open_position['players'].append(player[1])
+            open_players.append(player)
+        for cls in el_classes:
+            field = player_fields.get((el.tag, cls))
+            if field:
+                for _, fields in open_players:
+                    fields.setdefault(field, el)
+
+    offense = {}
+    defense = {}
+    for position in positions:
+        player_data = {
+            'title': position['title'],
+            'players': [parse_player(fields) for fields in position['players']]
+        }
+        if is_offensive_position(position['key']):
+            offense[position['key']] = player_data
+        else:
+            defense[position['key']] = player_data
+
+    return {'offense': offense, 'defense': defense}
+
+
+def parse_lineups(lineups, home, away, home_offense = True):
+    depth_chart = parse_depth_chart(lineups)
+    # rename offense key
+    if home_offense:
+        depth_chart[home + '-offense'] = depth_chart.pop('offense')
+        # rename defense key
+        depth_chart[away + '-defense'] = depth_chart.pop('defense')
+    else:
+        depth_chart[away + '-offense'] = depth_chart.pop('offense')
+        depth_chart[home + '-defense'] = depth_chart.pop('defense')
+
+    return depth_chart
+
+
+def parse_pff_data(greenline_data, lineups1_data, lineups2_data):
+    game_data = parse_greenline(greenline_data)
+    home, away = game_data['teams']['home'], game_data['teams']['away']
+    # parse lineups
+    lineups1_json = parse_lineups(lineups1_data, home, away, home_offense = True)
+    lineups2_json = parse_lineups(lineups2_data, home, away, home_offense = False)
+    # combine the two lineups
+    lineups = {**lineups1_json, **lineups2_json}
+    return game_data, lineups
@@ -0,0 +1,57 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+# Append-only record of a week's picks: one JSON line per game, so saving a game costs the same
+# whether it's the first of the slate or the fifteenth. The week_N_picks.xlsx spreadsheet is rebuilt
+# from it on demand with export().
+
+
+class PicksStore:
+    def __init__(self, path, excel_path):
+        self.path = path
+        self.excel_path = excel_path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if not os.path.exists(path) and os.path.exists(excel_path):
+            # first run with the store for this week: carry over the picks already in the spreadsheet
+            for record in pd.read_excel(excel_path).to_dict(orient="records"):
+                self.append(record)
+
+    def append(self, record):
+        # pandas handles the numpy, NaN and Timestamp values that come out of the schedule rows
+        line = pd.Series(record, dtype=object).to_json(date_format="iso", default_handler=str)
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def records(self):
+        if not os.path.exists(self.path):
+            return []
+        records = []
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # a crash mid-write can leave a partial last line; that game simply gets re-run
+                    print(f"Skipping unreadable line in {self.path}")
+        return records
+
+    def load(self):
+        return pd.DataFrame(self.records())
+
+    def export(self):
+        picks = self.load()
+        if picks.empty:
+            return picks
+        picks.to_excel(self.excel_path, index = False)
+        print(f"Exported {len(picks)} picks to {self.excel_path}")
+        return picks
@@ -0,0 +1,371 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+from usage import carry_labels, labelled
+
+
+def run_slate(games, run_game, on_result, max_concurrency=4):
+    # games is a list of (key, game) pairs. run_game(game) runs the full pick pipeline for one game
+    # on a worker thread; on_result(key, result) is always called from the calling thread, so it can
+    # safely append to the picks file without any locking.
+    games = list(games)
+    print(f"Running {len(games)} games with up to {max_concurrency} at a time")
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = {pool.submit(carry_labels(run_game), game): key for key, game in games}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # one bad game shouldn't take down the rest of the slate; it isn't written to the
+                # picks file, so it gets picked up again on the next run
+                print(f"Error processing {key}: {e}")
+                failed.append(key)
+                continue
+            try:
+                on_result(key, result)
+            except Exception as e:
+                # a game that ran but couldn't be saved counts as failed too; the games still running
+                # must not lose their results over it
+                print(f"Error saving {key}: {e}")
+                failed.append(key)
+    if failed:
+        print(f"{len(failed)} games failed: {failed}")
+    return failed
+
+
+class RetryError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # shared by every game that calls the same service: after failure_threshold failures in a row
+    # the circuit opens and calls fail straight away for reset_timeout seconds, so a site that's down
+    # costs the rest of the slate nothing
+    def __init__(self, name, failure_threshold=5, reset_timeout=300):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} is failing, not calling it for now")
+            # let one call through to see if it has recovered
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.opened_at is None:
+                print(f"{self.name} failed {self.failures} times in a row, pausing calls for {self.reset_timeout}s")
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    # bounded retries with exponential backoff and jitter. Gives up after max_attempts or once the
+    # next wait would run past deadline seconds, and re-raises the last error so the caller can
+    # decide whether to degrade or fail the game.
+    def __init__(self, max_attempts=4, base_delay=2, max_delay=60, deadline=None, breaker=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def run(self, fn, name, retry_if=None):
+        # retry_if(result) marks a returned value as a failure too, e.g. an empty response
+        start = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = fn()
+            except Exception as e:
+                error = e
+            else:
+                if retry_if is None or not retry_if(result):
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    return result
+                error = RetryError(f"{name} returned an unusable result")
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            delay = self.delay(attempt)
+            if attempt == self.max_attempts:
+                break
+            if self.deadline is not None and time.monotonic() - start + delay > self.deadline:
+                break
+            print(f"{name} failed (attempt {attempt} of {self.max_attempts}): {error}. Retrying in {delay:.1f}s")
+            time.sleep(delay)
+        print(f"{name} failed after {attempt} attempts: {error}")
+        raise error
+
+    async def run_async(self, fn, name, retry_if=None):
+        # run() for a coroutine function, waiting on the event loop instead of blocking a thread
+        start = time.monotonic()
+        for attempt in range(1, self.max_attempts + 1):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = await fn()
+            except Exception as e:
+                error = e
+            else:
+                if retry_if is None or not retry_if(result):
+                    if self.breaker is not None:
+                        self.breaker.record_success()
+                    return result
+                error = RetryError(f"{name} returned an unusable result")
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            delay = self.delay(attempt)
+            if attempt == self.max_attempts:
+                break
+            if self.deadline is not None and time.monotonic() - start + delay > self.deadline:
+                break
+            print(f"{name} failed (attempt {attempt} of {self.max_attempts}): {error}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        print(f"{name} failed after {attempt} attempts: {error}")
+        raise error
+
+
+def gather_experts(ask_expert, num_experts, max_workers=None, policy=None, prime=None):
+    # ask_expert(i) returns expert i's response. The experts all see the same insight_dict and don't
+    # depend on each other, so poll the whole panel at once. Each expert gets its own retries; one
+    # that still fails is left off the panel rather than holding up the consensus pick. prime(), if
+    # given, runs first to write the shared prompt to the prompt cache.
+    policy = policy or RetryPolicy(max_attempts=3)
+    if prime is not None:
+        try:
+            with labelled(expert="cache primer"):
+                prime()
+        except Exception as e:
+            # without the primer every expert just pays full price for its prompt
+            print(f"Couldn't prime the prompt cache: {e}")
+
+    def poll_expert(i):
+        print(f"Getting analysis from AI agent {i+1} of {num_experts}")
+        try:
+            return policy.run(lambda: ask_expert(i), f"AI agent {i+1}", retry_if=lambda response: response == "")
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers or num_experts) as pool:
+        futures = [pool.submit(carry_labels(poll_expert, expert=f"Expert {i+1}"), i) for i in range(num_experts)]
+        responses = [future.result() for future in futures]
+    return collect_panel(responses)
+
+
+async def gather_experts_async(ask_expert, num_experts, policy=None, prime=None):
+    # gather_experts on an event loop (a ClaudeLoop's): ask_expert(i) and prime() return coroutines, and
+    # the panel runs as one task per expert instead of one thread per expert
+    policy = policy or RetryPolicy(max_attempts=3)
+    if prime is not None:
+        try:
+            with labelled(expert="cache primer"):
+                await prime()
+        except Exception as e:
+            print(f"Couldn't prime the prompt cache: {e}")
+
+    async def poll_expert(i):
+        # each task runs in its own copy of the context, so the label stays with this expert
+        with labelled(expert=f"Expert {i+1}"):
+            print(f"Getting analysis from AI agent {i+1} of {num_experts}")
+            try:
+                return await policy.run_async(lambda: ask_expert(i), f"AI agent {i+1}", retry_if=lambda response: response == "")
+            except Exception:
+                return None
+
+    responses = await asyncio.gather(*(poll_expert(i) for i in range(num_experts)))
+    return collect_panel(responses)
+
+
+def collect_panel(responses):
+    expert_dict = {}
+    for i, response in enumerate(responses):
+        if response is None:
+            continue
+        print(f"{response}")
+        print('\n')
+        expert_dict[f"Expert {i+1}"] = response
+    if not expert_dict:
+        raise RuntimeError("No AI agents returned an analysis")
+    return expert_dict
+
+
+class CheckpointStore:
+    # one JSON file per finished stage under <directory>/checkpoints, written as soon as the stage
+    # completes so a crash later in the pipeline doesn't throw that work away. max_age maps a stage
+    # name to how many seconds its checkpoint stays usable, for outputs that go stale (odds, news);
+    # the rest never expire.
+    def __init__(self, directory, max_age=None):
+        self.directory = os.path.join(directory, "checkpoints")
+        self.max_age = max_age or {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def has(self, name):
+        return os.path.exists(self.path(name))
+
+    def read(self, name):
+        with open(self.path(name), "r") as f:
+            return json.load(f)
+
+    def load(self, name):
+        return self.read(name)["value"]
+
+    def degraded(self, name):
+        # saved from an empty result or a fallback, so it's kept for the record but not resumed
+        return self.read(name).get("degraded", False)
+
+    def expired(self, name):
+        max_age = self.max_age.get(name)
+        return max_age is not None and time.time() - self.read(name)["saved"] > max_age
+
+    def usable(self, name):
+        return self.has(name) and not self.degraded(name) and not self.expired(name)
+
+    def save(self, name, value, degraded=False):
+        tmp_path = self.path(name) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"saved": time.time(), "degraded": degraded or value is None, "value": value}, f)
+        os.replace(tmp_path, self.path(name))
+
+    def discard(self, name):
+        if self.has(name):
+            os.remove(self.path(name))
+
+    def load_or_run(self, name, fn):
+        if self.usable(name):
+            print(f"Resuming {name} from checkpoint")
+            return self.load(name)
+        value = fn()
+        self.save(name, value)
+        return value
+
+
+def plan_resume(stages, checkpoint, side_effects=()):
+    # which stages to load from checkpoint/re-run. Once a side-effect stage (posting to Discord) has
+    # run, the game's outcome is fixed: it and everything it depended on are loaded as saved, so a
+    # re-run never repeats it. Otherwise a stage re-runs when its checkpoint is missing or degraded,
+    # along with everything downstream of it, and an expired checkpoint is only re-run when something
+    # that reads it has to run again. Re-run stages lose their old checkpoints, so a later run can't
+    # pair a fresh input with an output built from the old one.
+    dependents = {name: [other for other, (deps, fn) in stages.items() if name in deps] for name in stages}
+    pinned = set()
+    pending = [name for name in side_effects if name in stages and checkpoint.has(name)]
+    while pending:
+        name = pending.pop()
+        if name not in pinned and checkpoint.has(name):
+            pinned.add(name)
+            pending.extend(stages[name][0])
+
+    saved = {name for name in stages if name not in pinned and checkpoint.has(name) and not checkpoint.degraded(name)}
+    expired = {name for name in saved if checkpoint.expired(name)}
+    rerun = {name for name in stages if name not in pinned and name not in saved}
+    while True:
+        grown = rerun | {name for name in stages if name not in pinned and any(dep in rerun for dep in stages[name][0])}
+        grown |= {name for name in expired if any(other in grown for other in dependents[name])}
+        if grown == rerun:
+            break
+        rerun = grown
+    for name in rerun:
+        checkpoint.discard(name)
+    return [name for name in stages if name not in rerun]
+
+
+def run_stage_graph(stages, max_workers=None, checkpoint=None, side_effects=()):
+    # stages maps a stage name to (deps, fn). fn is called with the outputs of its deps, in the order
+    # they're listed, as soon as all of them are done, so stages that don't depend on each other run
+    # at the same time. Returns the output of every stage and how long each one took in seconds.
+    # With a CheckpointStore, every stage that finishes is saved right away and plan_resume decides
+    # which ones a later run loads. A stage that returned None, or ran on an input that was None or
+    # itself degraded, is saved as degraded, so it and everything below it run again next time.
+    # side_effects names stages that must never run twice for a game.
+    for name, (deps, fn) in stages.items():
+        for dep in deps:
+            if dep not in stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+
+    def timed(fn, args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - start
+
+    results = {}
+    timings = {}
+    degraded = set()
+    pending = dict(stages)
+    if checkpoint is not None:
+        resumed = plan_resume(stages, checkpoint, side_effects)
+        for name in resumed:
+            results[name] = checkpoint.load(name)
+            if checkpoint.degraded(name):
+                degraded.add(name)
+            del pending[name]
+        if resumed:
+            print(f"Resuming from checkpoints: {', '.join(resumed)}")
+
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as pool:
+        while pending or running:
+            if error is None:
+                ready = [name for name, (deps, fn) in pending.items() if all(dep in results for dep in deps)]
+                for name in ready:
+                    deps, fn = pending.pop(name)
+                    running[pool.submit(carry_labels(timed, stage=name), fn, [results[dep] for dep in deps])] = name
+            if not running:
+                if error is not None:
+                    break
+                raise ValueError(f"Stages {list(pending)} have circular dependencies")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], timings[name] = future.result()
+                except Exception as e:
+                    # stop starting new stages, but let the ones in flight finish and get saved
+                    print(f"Stage {name} failed: {e}")
+                    if error is None:
+                        error = e
+                    continue
+                # a stage that ran on a missing (None) or fallback input is a fallback too, however far
+                # down the graph it is
+                if results[name] is None or any(results[dep] is None or dep in degraded for dep in stages[name][0]):
+                    degraded.add(name)
+                if checkpoint is not None:
+                    checkpoint.save(name, results[name], degraded=name in degraded)
+
+    print("Stage timings: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+    if error is not None:
+        raise error
+    return results, timings
@@ -0,0 +1,188 @@
+import glob
+import json
+import sys
+
+# Renders the nested game_data / adv_stats / lineups structures as compact pipe-separated tables for
+# the Claude prompts. The str() of those dicts repeats every key on every row and spends most of its
+# tokens on quotes and braces; here each table names its columns once, teams become columns, and a
+# {'value': ..., 'rank': ...} pair is written as "value (rank)". Nothing is dropped, so the model sees
+# the same numbers. Run this file on checkpointed stage outputs to compare token counts.
+
+
+def is_pair(value):
+    return isinstance(value, dict) and set(value) == {'value', 'rank'}
+
+
+def is_scalar(value):
+    return not isinstance(value, (dict, list)) or is_pair(value)
+
+
+def cell(value):
+    if is_pair(value):
+        return f"{cell(value['value'])} ({cell(value['rank'])})"
+    if value is None:
+        return ''
+    return str(value).replace('|', '/').replace('\n', ' ').strip()
+
+
+def flat_record(value):
+    # a dict of scalars, optionally with one level of scalar dicts folded into "outer inner" columns
+    if not isinstance(value, dict):
+        return None
+    record = {}
+    for key, item in value.items():
+        if is_scalar(item):
+            record[str(key)] = item
+        elif isinstance(item, dict) and all(is_scalar(v) for v in item.values()):
+            for inner_key, inner in item.items():
+                record[f"{key} {inner_key}"] = inner
+        else:
+            return None
+    return record
+
+
+def table(rows):
+    columns = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    lines = [' | '.join(columns)]
+    for row in rows:
+        lines.append(' | '.join(cell(row.get(column)) for column in columns))
+    return lines
+
+
+def record_list(value):
+    # a list of records that share their columns, e.g. injuries, players or stat comparisons
+    if not isinstance(value, list) or not value:
+        return None
+    records = [flat_record(item) for item in value]
+    if any(record is None for record in records):
+        return None
+    if any(list(record) != list(records[0]) for record in records):
+        return None
+    return records
+
+
+def record_dict(value):
+    # {row: {column: scalar}}, e.g. {'Line': {'Bills': '-2.5', 'Texans': '+2.5'}}
+    if not isinstance(value, dict) or not value or not all(isinstance(v, dict) and not is_pair(v) for v in value.values()):
+        return None
+    if not all(is_scalar(v) for item in value.values() for v in item.values()):
+        return None
+    return [{'': row, **item} for row, item in value.items()]
+
+
+def grouped_records(value):
+    # {group: [records]} or {group: {scalars..., one list of records}}, e.g. injuries by team or
+    # players by position, as one table with the group as its first column
+    if not isinstance(value, dict) or not value:
+        return None
+    rows = []
+    for group, item in value.items():
+        scalars = {}
+        records = record_list(item)
+        if records is None and isinstance(item, dict):
+            lists = [k for k, v in item.items() if not is_scalar(v)]
+            if len(lists) != 1:
+                return None
+            records = record_list(item[lists[0]])
+            scalars = {k: v for k, v in item.items() if k != lists[0]}
+        if records is None:
+            return None
+        rows.extend({'': group, **scalars, **record} for record in records)
+    if any(list(row) != list(rows[0]) for row in rows):
+        return None
+    return rows
+
+
+def parallel_tables(value):
+    # {'Bills': [tables...], 'Texans': [tables...]} where both lists hold the same stat tables in the
+    # same order: one table per position with a column per team
+    lists = {k: v for k, v in value.items() if not is_scalar(v)}
+    if len(lists) < 2:
+        return None
+    lengths = {len(v) if isinstance(v, list) else -1 for v in lists.values()}
+    if len(lengths) != 1 or -1 in lengths or 0 in lengths:
+        return None
+    tables = []
+    for i in range(lengths.pop()):
+        items = [v[i] for v in lists.values()]
+        if not all(isinstance(item, dict) and all(is_scalar(x) for x in item.values()) for item in items):
+            return None
+        rows = {}
+        for team, item in zip(lists, items):
+            for label, stat in item.items():
+                rows.setdefault(label, {})[team] = stat
+        tables.append([{'': label, **stats} for label, stats in rows.items()])
+    return tables
+
+
+def render(value, title=''):
+    header = [f"# {title}"] if title else []
+
+    if is_scalar(value):
+        return [f"{title}: {cell(value)}" if title else cell(value)]
+    if isinstance(value, list) and all(is_scalar(item) for item in value):
+        return [f"{title}: {', '.join(cell(item) for item in value)}"]
+
+    for rows in [record_dict(value), record_list(value), grouped_records(value)]:
+        if rows is not None:
+            return header + table(rows)
+
+    lines = []
+    if isinstance(value, dict):
+        scalars = {k: v for k, v in value.items() if is_scalar(v)}
+        if scalars:
+            lines.extend(header)
+            lines.append('; '.join(f"{k}: {cell(v)}" for k, v in scalars.items()))
+        tables = parallel_tables(value)
+        if tables is not None:
+            for i, rows in enumerate(tables):
+                lines.append(f"# {title} {i + 1}".strip())
+                lines.extend(table(rows))
+            return lines
+        for key, item in value.items():
+            if not is_scalar(item):
+                lines.extend(render(item, f"{title} / {key}" if title else str(key)))
+        return lines
+
+    for i, item in enumerate(value):
+        lines.extend(render(item, f"{title} {i + 1}".strip()))
+    return lines
+
+
+def to_tables(value):
+    return '\n'.join(render(value))
+
+
+def token_counts(client, value, model="claude-3-5-sonnet-20240620"):
+    # exact input-token counts for the raw str() rendering and the tables, from the token counting
+    # endpoint (it doesn't generate anything)
+    counts = []
+    for text in [str(value), to_tables(value)]:
+        counts.append(client.messages.count_tokens(model=model, messages=[{"role": "user", "content": text}]).input_tokens)
+    return tuple(counts)
+
+
+if __name__ == "__main__":
+    # e.g. python prompt_tables.py nfl/week5/*/checkpoints/adv_stats.json
+    paths = sys.argv[1:] or sorted(glob.glob('*/week*/*/checkpoints/*.json'))
+    client = None
+    try:
+        import anthropic
+        with open("misc/anthropic_token.txt", "r") as f:
+            client = anthropic.Anthropic(api_key = f.read().strip())
+    except (ImportError, OSError):
+        print("No Anthropic key, reporting characters only")
+    for path in paths:
+        with open(path, 'r') as f:
+            value = json.load(f)['value']
+        if not isinstance(value, (dict, list)):
+            continue
+        report = f"{path}: {len(str(value))} -> {len(to_tables(value))} chars"
+        if client is not None:
+            before, after = token_counts(client, value)
+            report += f", {before} -> {after} tokens ({1 - after / before:.0%} fewer)"
+        print(report)
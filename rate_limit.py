@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Process-wide request pacing, one token bucket per provider. Every call to a provider takes a token
+# first; when a provider answers 429 the whole bucket is paused for its Retry-After, so every thread
+# (and event loop) backs off together instead of each one hammering the API on its own schedule.
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, burst):
+        self.lock = threading.Lock()
+        self.configure(requests_per_minute, burst)
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def configure(self, requests_per_minute, burst):
+        with self.lock:
+            self.rate = requests_per_minute / 60
+            self.burst = burst
+
+    def reserve(self):
+        # takes a token and returns how long the caller has to wait before using it. Tokens can go
+        # negative, which queues callers up in the order they arrived.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def backoff(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+limiters = {
+    "perplexity": TokenBucket(requests_per_minute=50, burst=5),
+    "anthropic": TokenBucket(requests_per_minute=50, burst=10),
+    # each message is a fresh gateway login, and Discord only allows one IDENTIFY every 5 seconds
+    "discord": TokenBucket(requests_per_minute=12, burst=1),
+}
+
+
+def configure(provider, requests_per_minute, burst):
+    limiters[provider].configure(requests_per_minute, burst)
+
+
+def retry_after_seconds(headers, default=10):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return default
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# On-disk cache of LLM responses, keyed by a hash of everything that determines the answer (model,
+# temperature, system prompt and messages). Re-running a game after a crash only pays for the stages
+# whose inputs changed. Entries expire after a TTL, and once the directory grows past max_bytes the
+# least recently read entries are deleted first.
+
+
+class ResponseCache:
+    def __init__(self, directory, ttl=6 * 60 * 60, max_bytes=200 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(os.path.getsize(path) for path in self.entries())
+
+    @staticmethod
+    def key(model, temperature, system, messages, tools=None, tool_choice=None):
+        request = {"model": model, "temperature": temperature, "system": system, "messages": messages}
+        if tools is not None:
+            # only added when there are tools, so keys for plain text requests don't change
+            request.update(tools=tools, tool_choice=tool_choice)
+        payload = json.dumps(
+            request,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def entries(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def get(self, key, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        path = self.path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        if time.time() - entry["created"] > ttl:
+            with self.lock:
+                self.misses += 1
+            return None
+        # the file's mtime doubles as its last-used time for eviction
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+        return entry["value"]
+
+    def set(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename, so a crash mid-write never leaves a truncated entry behind
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"created": time.time(), "value": value}, f)
+        size = os.path.getsize(tmp_path)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += size - old_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # called with the lock held; drop least recently used entries until back under 90% of the cap
+        entries = []
+        for path in self.entries():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        for _, path in sorted(entries):
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+    def summary(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self.total_bytes}
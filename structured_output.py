@@ -0,0 +1,125 @@
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+# Structured output for the expert panel, whose answers are read by code. Instead of asking for JSON in
+# the prompt and cleaning up the str() of the response, the stage offers a single tool whose input schema
+# comes from a pydantic model and makes Claude call it, so the answer arrives as an already-parsed dict.
+# The model then checks it. If that fails, the errors go back to Claude as the tool result, and Claude
+# fixes just those fields. That costs one short extra turn instead of a re-run of the game.
+
+max_repairs = 2
+
+
+class Schema(BaseModel):
+    # field names are the keys the prompts (and the picks files) have always used, e.g. "Market Efficiency"
+    model_config = ConfigDict(populate_by_name=True)
+
+
+class MarketAnalysis(Schema):
+    summary: str = Field(alias="Summary", min_length=1, description="Your reasoning for this market: a detailed explanation of your thought process, citing specific data points from both the quantitative and qualitative analysis.")
+    market_efficiency: str = Field(alias="Market Efficiency", min_length=1, description="Why you believe your identified edge isn't already priced into the odds, and why this inefficiency exists in an otherwise highly efficient market.")
+
+
+class MarketPick(Schema):
+    analysis: MarketAnalysis = Field(alias="Analysis")
+    pick: str = Field(alias="Pick", min_length=1, description='Your pick with its line, e.g. "Bills -2.5 (-110)", "Bills +114" or "Over 43.5", or "No Bet".')
+    units: float = Field(alias="Units", ge=0, le=5, description="Suggested bet size from 0 (no bet) to 5 units.")
+    units_reasoning: str = Field(alias="Units Reasoning", description="How you arrived at the unit rating.")
+
+    @model_validator(mode="after")
+    def units_match_pick(self):
+        no_bet = self.pick.strip().lower().startswith("no bet")
+        if no_bet and self.units > 0:
+            raise ValueError('a "No Bet" pick must have 0 units')
+        if not no_bet and self.units == 0:
+            raise ValueError('a pick with 0 units must be "No Bet"')
+        return self
+
+
+class ExpertPicks(Schema):
+    summary: str = Field(alias="Summary", min_length=1, description="A very brief summary of the key points across all sections and your overall assessment of the game.")
+    moneyline: MarketPick = Field(alias="Moneyline")
+    spread: MarketPick = Field(alias="Spread")
+    total: MarketPick = Field(alias="Total")
+
+    @model_validator(mode="after")
+    def one_of_moneyline_and_spread(self):
+        if self.moneyline.units > 0 and self.spread.units > 0:
+            raise ValueError('bet either the Moneyline or the Spread, not both; make the other "No Bet" with 0 units')
+        return self
+
+
+def inline_refs(schema, defs=None):
+    # pydantic puts nested models under $defs; write them out in place so the tool schema is one
+    # self-contained object
+    defs = schema.get("$defs", {}) if defs is None else defs
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return inline_refs(defs[schema["$ref"].split("/")[-1]], defs)
+        return {key: inline_refs(value, defs) for key, value in schema.items() if key != "$defs"}
+    if isinstance(schema, list):
+        return [inline_refs(item, defs) for item in schema]
+    return schema
+
+
+def tool_for(model, name, description):
+    return {"name": name, "description": description, "input_schema": inline_refs(model.model_json_schema(by_alias=True))}
+
+
+def with_tool(request, tool):
+    return {**request, "tools": [tool], "tool_choice": {"type": "tool", "name": tool["name"]}}
+
+
+def tool_call(message, name):
+    for block in message.content:
+        if block.type == "tool_use" and block.name == name:
+            return block
+    return None
+
+
+def validation_errors(error):
+    # "Moneyline.Units: Input should be less than or equal to 5", using the keys Claude wrote
+    lines = []
+    for problem in error.errors():
+        location = ".".join(str(part) for part in problem["loc"]) or "(top level)"
+        lines.append(f"- {location}: {problem['msg'].removeprefix('Value error, ')}")
+    return "\n".join(lines)
+
+
+def repair_request(request, message, block, problems):
+    content = message.model_dump(mode="json", exclude_none=True)["content"]
+    if block is None:
+        reply = [{"type": "text", "text": f"Please submit your answer by calling the {request['tool_choice']['name']} tool."}]
+    else:
+        reply = [{
+            "type": "tool_result",
+            "tool_use_id": block.id,
+            "is_error": True,
+            "content": f"{problems}\n\nCall {block.name} again with the same answer, changing only what's needed to fix the problems above.",
+        }]
+    return {**request, "messages": request["messages"] + [{"role": "assistant", "content": content}, {"role": "user", "content": reply}]}
+
+
+def structured_call(request, model, tool):
+    # for use in a stage with `result = yield from structured_call(...)`: returns the validated tool
+    # input as a plain dict (with the schema's keys), asking Claude to repair it up to max_repairs times
+    request = with_tool(request, tool)
+    message = yield request
+    for attempt in range(max_repairs + 1):
+        block = tool_call(message, tool["name"])
+        if block is None:
+            problems = f"no {tool['name']} call in the response"
+        else:
+            try:
+                return model.model_validate(block.input).model_dump(by_alias=True, exclude_none=True)
+            except ValidationError as e:
+                problems = validation_errors(e)
+        if message.stop_reason == "max_tokens":
+            problems += "\n- the answer was cut off at the token limit; keep the text fields shorter"
+        if attempt == max_repairs:
+            break
+        print(f"Repairing {tool['name']} output:\n{problems}")
+        message = yield repair_request(request, message, block, problems)
+    raise ValueError(f"{tool['name']} output still invalid after {max_repairs} repairs:\n{problems}")
+
+
+expert_picks_tool = tool_for(ExpertPicks, "submit_expert_picks", "Submit your game summary and your analysis, pick and unit rating for the Moneyline, Spread and Total.")
@@ -0,0 +1,30 @@
+import httpx
+
+# Fetching Sumer Sports game pages. They're server-rendered, so one plain GET usually returns the same
+# markup Chrome would have built; a page that can't be read from that response (rendered client-side,
+# a block page, a network error) falls back to a browser load.
+
+# plain HTTP client for the Selenium-free path
+http = httpx.Client(timeout=httpx.Timeout(20, connect=5), follow_redirects=True)
+
+
+def fetch_page_http(url, user_agent, client=None):
+    response = (client or http).get(url, headers={"User-Agent": user_agent, "Accept": "text/html"})
+    response.raise_for_status()
+    content = response.text
+    if 'stat-table' not in content or 'game-comparison-off-vs-def' not in content:
+        if '__NEXT_DATA__' in content:
+            raise ValueError("stats are rendered client-side")
+        raise ValueError("stat tables missing from the response")
+    return content
+
+
+def fetch_page(url, fetch_selenium, user_agent, parse, client=None):
+    # returns (html, parsed stats or None, source). A single plain request is tried first, and browser
+    # time is only spent when that page can't be parsed; the browser's page is returned unparsed
+    try:
+        content = fetch_page_http(url, user_agent, client)
+        return content, parse(content), 'http'
+    except Exception as e:
+        print(f"Plain HTTP fetch of {url} didn't work ({e}), loading it in Chrome")
+    return fetch_selenium(url), None, 'selenium'
@@ -0,0 +1,75 @@
+from bs4 import BeautifulSoup
+
+# Parser for Sumer Sports game pages. parse_adv_analytics reads the stat tables and game comparisons
+# straight off the page's tree, instead of serializing each table with str() and parsing it again as the
+# earlier version did (that one is in bench_parsers.py, to compare the two on saved pages).
+
+
+def parse_adv_analytics(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    stat_tables = soup.find_all('div', class_='stat-table')
+    off_v_def = soup.find('div', class_='game-comparison-off-vs-def')
+    def_v_off = soup.find('div', class_='game-comparison-def-vs-off')
+
+    away_team = (soup.find_all('h2')[2].text).replace(' Statistics', '')
+    home_team = (soup.find_all('h2')[-1].text).replace(' Statistics', '')
+
+    away_stats = stat_tables[0:7]
+    home_stats = stat_tables[7:]
+
+    def parse_stat_tables(stats, team):
+        result = {"Team Stats": "Team Stats", team: []}
+        for table_html in stats:
+            table_dict = {}
+            for div in table_html.find_all('div', class_=['stat-total', 'stat-offense', 'stat-defense']):
+                label = div.find('div', class_='label').text
+                value = div.find('div', class_='value').text
+                rank = div.find('div', class_='rank').text
+                rank = int(rank.strip('th').strip('st').strip('nd').strip('rd'))
+                table_dict[label] = {'value': value, 'rank': rank}
+            result[team].append(table_dict)
+        return result
+
+    def parse_game_comparison(html_content, home_team, away_team, table_type):
+        title = html_content.find('h2').text
+        if table_type == 'off_v_def':
+            title = title.replace('Offense', away_team + ' Offense').replace('Defense', home_team + ' Defense')
+        elif table_type == 'def_v_off':
+            title = title.replace('Offense', home_team + ' Offense').replace('Defense', away_team + ' Defense')
+
+        result = {"title": title, "comparisons": []}
+        rows = html_content.find_all('div', class_='game-table-row')
+
+        for row in rows:
+            cells = row.find_all('div', class_='game-table-cell')
+            comparison = {
+                'stat': cells[2].text,
+                away_team + (" Offense" if table_type == 'off_v_def' else ' Defense'): {
+                    'rank': cells[0].text.strip('th').strip('st').strip('nd').strip('rd'),
+                    'value': cells[1].text
+                },
+                home_team + (" Defense" if table_type == 'off_v_def' else ' Offense'): {
+                    'rank': cells[4].text.strip('th').strip('st').strip('nd').strip('rd'),
+                    'value': cells[3].text
+                }
+            }
+            result['comparisons'].append(comparison)
+
+        return result
+
+    home_stats_json = parse_stat_tables(home_stats, home_team)
+    away_stats_json = parse_stat_tables(away_stats, away_team)
+    team_stats = {'title': "Advanced Analytics", home_team: home_stats_json[home_team], away_team: away_stats_json[away_team]}
+
+    off_v_def_comparison = parse_game_comparison(off_v_def, home_team, away_team, 'off_v_def')
+    def_v_off_comparison = parse_game_comparison(def_v_off, home_team, away_team, 'def_v_off')
+
+    combined_stats = {
+        "team_stats": team_stats,
+        "comparisons": {
+            "offense_vs_defense": off_v_def_comparison,
+            "defense_vs_offense": def_v_off_comparison
+        }
+    }
+
+    return combined_stats
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from claude_client import ClaudeLoop, longer_than, message_text, prime_cache_async, run_claude, run_claude_async
+from fake_batch_server import serve
+from pipeline import gather_experts_async
+from rate_limit import limiters
+from structured_output import ExpertPicks, expert_picks_tool, structured_call
+from usage import labelled, usage_log
+
+
+@pytest.fixture(autouse=True)
+def unthrottled():
+    # the fake server has no rate limit to respect
+    bucket = limiters["anthropic"]
+    rate, burst = bucket.rate * 60, bucket.burst
+    bucket.configure(60000, 1000)
+    bucket.tokens = 1000
+    yield
+    bucket.configure(rate, burst)
+
+
+@pytest.fixture
+def server():
+    server = serve(reply=lambda params: "Bills by a field goal in a game that stays close all the way " * 3)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def loop(server):
+    loop = ClaudeLoop("fake", base_url=server.base_url)
+    yield loop
+    loop.close()
+
+
+def request(text):
+    return dict(model="claude-3-5-sonnet-20240620", max_tokens=100, messages=[{"role": "user", "content": text}])
+
+
+def two_turn_stage(game):
+    first = yield request(f"Preview {game}")
+    second = yield request(f"Go deeper on {game}")
+    return message_text(first) + " | " + message_text(second)
+
+
+def expert_stage(game):
+    return (yield from structured_call(request(f"Pick {game}"), ExpertPicks, expert_picks_tool))
+
+
+def test_games_share_the_loop_and_its_connections(server, loop):
+    games = [f"Game {i}" for i in range(8)]
+
+    def run_game(game):
+        with labelled(game=game, stage="analysis"):
+            return run_claude(two_turn_stage(game), loop)
+
+    with ThreadPoolExecutor(max_workers=len(games)) as pool:
+        outputs = list(pool.map(run_game, games))
+    assert all(" | " in output for output in outputs)
+    assert server.messages == 16
+    assert server.connections <= len(games)
+    # the calling thread's labels travel with the request onto the loop
+    calls = [call for call in usage_log.calls if call["stage"] == "analysis" and call["game"] in games]
+    assert sorted(call["game"] for call in calls) == sorted(games * 2)
+
+
+def test_stop_when_cuts_off_the_stream(loop):
+    message = loop.create(request("Draft"), stop_when=longer_than(20))
+    assert message.stop_reason is None
+    assert 20 < len(message_text(message)) < 100
+
+
+def test_expert_panel_runs_as_tasks_on_the_loop(server, loop):
+    with labelled(game="Lions at Cowboys"):
+        expert_dict = loop.run(gather_experts_async(
+            lambda i: run_claude_async(expert_stage("Lions at Cowboys"), loop.client), 5,
+            prime=lambda: prime_cache_async(expert_stage("Lions at Cowboys"), loop.client)))
+    assert list(expert_dict) == [f"Expert {i}" for i in range(1, 6)]
+    assert all(picks["Moneyline"]["Pick"] == "No Bet" for picks in expert_dict.values())
+    assert server.messages == 6
+    experts = {call["expert"] for call in usage_log.calls if call["game"] == "Lions at Cowboys"}
+    assert experts == {"cache primer"} | set(expert_dict)
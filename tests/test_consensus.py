@@ -0,0 +1,110 @@
+from consensus import aggregate_picks, moneyline_from_odds, moneyline_prices, round_units
+
+home, away = "Houston Texans", "Buffalo Bills"
+odds = """[Current Odds]
+Moneyline:
+Buffalo Bills: +114
+Houston Texans: -135
+
+Spread:
+Buffalo Bills: +2.5 (-110)
+Houston Texans: -2.5 (-110)
+
+Total (Over/Under):
+Over 47.5: -110
+Under 47.5: -110"""
+
+
+def expert(moneyline=("No Bet", 0), spread=("No Bet", 0), total=("No Bet", 0)):
+    picks = {"Summary": "Summary"}
+    for market, (pick, units) in [("Moneyline", moneyline), ("Spread", spread), ("Total", total)]:
+        picks[market] = {"Analysis": {"Summary": f"{pick} because of the matchup."}, "Pick": pick, "Units": units}
+    return picks
+
+
+def official(experts, moneyline=None):
+    expert_dict = {f"Expert {i + 1}": picks for i, picks in enumerate(experts)}
+    return aggregate_picks(expert_dict, home, away, moneyline)["official_picks"]
+
+
+def test_majority_of_the_panel_wins_the_market():
+    picks = official([expert(total=("Over 47.5", 2))] * 3 + [expert(total=("Under 47.5", 1))] * 2)
+    assert picks["Total"]["Pick"] == "Over 47.5"
+    assert picks["Total"]["Units"] == 2
+    assert picks["Total"]["Reasoning"].startswith("3 of 5 experts backed Over 47.5")
+
+
+def test_plurality_without_a_majority_is_no_bet():
+    picks = official([expert(total=("Over 47.5", 2))] * 3 + [expert(total=("Under 47.5", 1))] * 2 + [expert()])
+    assert picks["Total"]["Pick"] == "No Bet"
+    assert "only 3 of 6 experts backed Over" in picks["Total"]["Reasoning"]
+
+
+def test_tie_is_no_bet():
+    picks = official([expert(total=("Over 47.5", 2))] * 2 + [expert(total=("Under 47.5", 2))] * 2)
+    assert picks["Total"]["Pick"] == "No Bet"
+    assert "no clear consensus" in picks["Total"]["Reasoning"]
+
+
+def test_most_experts_passing_is_no_bet():
+    picks = official([expert(total=("Over 47.5", 2))] + [expert()] * 4)
+    assert picks["Total"]["Pick"] == "No Bet"
+    assert "most experts passed" in picks["Total"]["Reasoning"]
+
+
+def test_units_are_the_backers_mean_to_the_nearest_half():
+    picks = official([expert(total=("Over 47.5", units)) for units in (1, 2, 2)])
+    # 1.67 rounds to 1.5
+    assert picks["Total"]["Units"] == 1.5
+    assert round_units(1.25) == 1.5
+    assert round_units(1.2) == 1.0
+    assert round_units(7) == 5
+
+
+def test_mean_below_half_a_unit_is_no_bet():
+    picks = official([expert(total=("Over 47.5", 0.2))] * 3)
+    assert picks["Total"]["Pick"] == "No Bet"
+    assert "below half a unit" in picks["Total"]["Reasoning"]
+
+
+def test_only_one_of_moneyline_and_spread():
+    experts = [expert(moneyline=("Bills +114", 2))] * 3 + [expert(spread=("Bills +2.5 (-110)", 1))] * 2
+    picks = official(experts, moneyline_from_odds(odds, home, away))
+    # passing on the Spread because the Moneyline was bet isn't a vote against the Spread, but the
+    # Spread still needs a majority of the panel
+    assert picks["Moneyline"]["Pick"] == "Bills +114"
+    assert picks["Spread"]["Pick"] == "No Bet"
+    assert picks["moneyline_vs_spread"]["Preferred Bet"] == "Moneyline"
+
+
+def test_both_reaching_consensus_keeps_the_better_backed_one():
+    experts = [expert(moneyline=("Bills +114", 1), spread=("Bills +2.5 (-110)", 2))] * 3
+    picks = official(experts, moneyline_from_odds(odds, home, away))
+    assert picks["moneyline_vs_spread"]["Preferred Bet"] == "Spread"
+    assert picks["Moneyline"]["Pick"] == "No Bet"
+    assert picks["Spread"]["Pick"] == "Bills +2.5 (-110)"
+
+
+def test_moneyline_band_uses_the_games_price():
+    experts = [expert(moneyline=("Bills ML", 2))] * 3
+    assert official(experts, {home: -400, away: 310})["Moneyline"]["Pick"] == "No Bet"
+    assert "At +310 the line is outside -200/+200" in official(experts, {home: -400, away: 310})["Moneyline"]["Reasoning"]
+    assert official(experts, {home: -135, away: 114})["Moneyline"]["Pick"] == "Bills ML"
+
+
+def test_moneyline_band_uses_the_picks_price_without_odds():
+    assert official([expert(moneyline=("Bills +250", 2))] * 3)["Moneyline"]["Pick"] == "No Bet"
+    assert official([expert(moneyline=("Bills +114", 2))] * 3)["Moneyline"]["Pick"] == "Bills +114"
+
+
+def test_moneyline_without_any_price_is_no_bet():
+    picks = official([expert(moneyline=("Bills ML", 2))] * 3)
+    assert picks["Moneyline"]["Pick"] == "No Bet"
+    assert "no price to check" in picks["Moneyline"]["Reasoning"]
+
+
+def test_moneyline_prices():
+    assert moneyline_from_odds(odds, home, away) == {away: 114, home: -135}
+    assert moneyline_from_odds("Moneyline:\nBills: N/A\nTexans: N/A\n\nSpread:", home, away) == {}
+    assert moneyline_from_odds(None, home, away) == {}
+    assert moneyline_prices({"Buccaneers": "114", "Falcons": "-135", "Bills": "N/A"}) == {"Buccaneers": 114, "Falcons": -135}
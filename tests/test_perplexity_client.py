@@ -0,0 +1,90 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import perplexity_client
+from rate_limit import limiters
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # answers every chat completion with a canned reply, over keep-alive connections
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        body = json.dumps({
+            "model": payload["model"],
+            "choices": [{"message": {"role": "assistant", "content": "Bills -2.5 (-110)"}}],
+            "usage": {"prompt_tokens": 20, "completion_tokens": 5},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/chat/completions", server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fresh_client(monkeypatch):
+    monkeypatch.setattr(perplexity_client, "stats", perplexity_client.ConnectionStats())
+    monkeypatch.setattr(perplexity_client, "session", None)
+    monkeypatch.setattr(perplexity_client, "async_sessions", {})
+    # the stub has no rate limit to respect
+    bucket = limiters["perplexity"]
+    rate, burst = bucket.rate * 60, bucket.burst
+    bucket.configure(60000, 1000)
+    bucket.tokens = 1000
+    yield
+    bucket.configure(rate, burst)
+
+
+payload = {"model": "llama-3.1-sonar-large-128k-online", "messages": [{"role": "user", "content": "Bills odds?"}]}
+
+
+def test_posts_reuse_one_connection(stub):
+    url, server = stub
+    for _ in range(7):
+        response = perplexity_client.post(url, json=payload, headers={})
+        assert response.json()["choices"][0]["message"]["content"] == "Bills -2.5 (-110)"
+    assert perplexity_client.connection_stats() == {"requests": 7, "connections_opened": 1, "connections_reused": 6}
+    assert server.connections == 1
+
+
+def test_async_posts_reuse_the_loops_connections(stub):
+    url, server = stub
+
+    async def slate():
+        for _ in range(3):
+            await perplexity_client.post_async(url, json=payload, headers={})
+        responses = await asyncio.gather(*(perplexity_client.post_async(url, json=payload, headers={}) for _ in range(4)))
+        await perplexity_client.close_async_session()
+        return responses
+
+    responses = asyncio.run(slate())
+    assert all(response.status_code == 200 for response in responses)
+    stats = perplexity_client.connection_stats()
+    assert stats["requests"] == 7
+    # the sequential posts share one connection; the concurrent ones need at most one each
+    assert stats["connections_opened"] == server.connections <= 4
+    assert perplexity_client.async_sessions == {}
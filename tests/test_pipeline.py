@@ -0,0 +1,103 @@
+import json
+import os
+
+from pipeline import CheckpointStore, run_stage_graph
+
+
+def game_stages(calls, odds="BUF -3"):
+    # a cut-down pick pipeline that counts how often each stage runs
+    def stage(name, fn):
+        def run(*args):
+            calls[name] = calls.get(name, 0) + 1
+            return fn(*args)
+        return run
+
+    return {
+        "analysis": ((), stage("analysis", lambda: "analysis")),
+        "odds": ((), stage("odds", lambda: odds)),
+        "experts": (("analysis", "odds"), stage("experts", lambda analysis, odds: {"Expert 1": f"{analysis} {odds}"})),
+        "consensus": (("experts",), stage("consensus", lambda experts: {"pick": experts["Expert 1"]})),
+        "send": (("consensus",), stage("send", lambda consensus: "2024-10-06T12:00:00")),
+    }
+
+
+def age_checkpoint(checkpoint, name, seconds):
+    with open(checkpoint.path(name), "r") as f:
+        saved = json.load(f)
+    saved["saved"] -= seconds
+    with open(checkpoint.path(name), "w") as f:
+        json.dump(saved, f)
+
+
+def test_resumed_game_is_not_posted_again(tmp_path):
+    calls = {}
+    checkpoint = CheckpointStore(tmp_path)
+    run_stage_graph(game_stages(calls), checkpoint=checkpoint, side_effects=("send",))
+    results, timings = run_stage_graph(game_stages(calls), checkpoint=checkpoint, side_effects=("send",))
+    assert calls["send"] == 1
+    assert timings == {}
+    assert results["send"] == "2024-10-06T12:00:00"
+
+
+def test_posted_fallback_game_is_not_posted_again(tmp_path):
+    calls = {}
+    checkpoint = CheckpointStore(tmp_path)
+    run_stage_graph(game_stages(calls, odds=None), checkpoint=checkpoint, side_effects=("send",))
+    results, _ = run_stage_graph(game_stages(calls, odds=None), checkpoint=checkpoint, side_effects=("send",))
+    assert calls == {"analysis": 1, "odds": 1, "experts": 1, "consensus": 1, "send": 1}
+    assert results["odds"] is None
+
+
+def test_fallback_taints_everything_downstream(tmp_path):
+    calls = {}
+    checkpoint = CheckpointStore(tmp_path)
+    stages = game_stages(calls, odds=None)
+    del stages["send"]
+    run_stage_graph(stages, checkpoint=checkpoint)
+    assert not checkpoint.degraded("analysis")
+    assert all(checkpoint.degraded(name) for name in ["odds", "experts", "consensus"])
+
+    stages = game_stages(calls)
+    del stages["send"]
+    results, _ = run_stage_graph(stages, checkpoint=checkpoint)
+    assert calls == {"analysis": 1, "odds": 2, "experts": 2, "consensus": 2}
+    assert results["consensus"] == {"pick": "analysis BUF -3"}
+
+
+def test_rerun_stage_drops_checkpoints_below_it(tmp_path):
+    calls = {}
+    checkpoint = CheckpointStore(tmp_path)
+    stages = game_stages(calls)
+    del stages["send"]
+    run_stage_graph(stages, checkpoint=checkpoint)
+    os.remove(checkpoint.path("experts"))
+    run_stage_graph(stages, checkpoint=checkpoint)
+    assert calls == {"analysis": 1, "odds": 1, "experts": 2, "consensus": 2}
+
+
+def test_expired_checkpoint_is_only_rerun_when_read(tmp_path):
+    calls = {}
+    checkpoint = CheckpointStore(tmp_path, max_age={"odds": 30 * 60})
+    stages = game_stages(calls)
+    del stages["send"]
+    run_stage_graph(stages, checkpoint=checkpoint)
+    age_checkpoint(checkpoint, "odds", 60 * 60)
+
+    # the panel already ran on these odds, so there's nothing to refresh them for
+    run_stage_graph(stages, checkpoint=checkpoint)
+    assert calls["odds"] == 1
+
+    # but a panel that has to run again gets current odds
+    os.remove(checkpoint.path("experts"))
+    run_stage_graph(stages, checkpoint=checkpoint)
+    assert calls == {"analysis": 1, "odds": 2, "experts": 2, "consensus": 2}
+
+
+def test_load_or_run_skips_expired_and_degraded(tmp_path):
+    checkpoint = CheckpointStore(tmp_path, max_age={"odds": 60})
+    assert checkpoint.load_or_run("page", lambda: None) is None
+    assert checkpoint.load_or_run("page", lambda: "page") == "page"
+    assert checkpoint.load_or_run("page", lambda: "again") == "page"
+    checkpoint.save("odds", "BUF -3")
+    age_checkpoint(checkpoint, "odds", 120)
+    assert checkpoint.load_or_run("odds", lambda: "BUF -2.5") == "BUF -2.5"
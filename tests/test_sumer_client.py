@@ -0,0 +1,59 @@
+import os
+
+import httpx
+import pytest
+
+import sumer_client
+from sumer_parser import parse_adv_analytics
+
+fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+url = "https://sumersports.com/games/2024-05-BUF-HOU/"
+
+
+def fixture(name):
+    with open(os.path.join(fixtures, name), "r") as f:
+        return f.read()
+
+
+def client_for(status, body):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(status, text=body)
+    return httpx.Client(transport=httpx.MockTransport(handler)), requests
+
+
+def test_server_rendered_page_is_read_without_a_browser():
+    client, requests = client_for(200, fixture("sumer_game.html"))
+
+    def fetch_selenium(url):
+        raise AssertionError("Chrome shouldn't be needed")
+
+    content, adv_stats, source = sumer_client.fetch_page(url, fetch_selenium, "test-agent", parse_adv_analytics, client)
+    assert source == "http"
+    assert requests[0].headers["User-Agent"] == "test-agent"
+    assert adv_stats == parse_adv_analytics(content)
+    assert list(adv_stats["team_stats"]) == ["title", "Houston Texans", "Buffalo Bills"]
+    assert len(adv_stats["team_stats"]["Buffalo Bills"]) == 7
+    assert adv_stats["comparisons"]["offense_vs_defense"]["title"] == "Buffalo Bills Offense vs Houston Texans Defense"
+
+
+@pytest.mark.parametrize("status, page", [(200, "sumer_game_client_rendered.html"), (403, "sumer_game.html")])
+def test_unreadable_page_falls_back_to_the_browser(status, page):
+    client, _ = client_for(status, fixture(page))
+    loaded = []
+
+    def fetch_selenium(url):
+        loaded.append(url)
+        return fixture("sumer_game.html")
+
+    content, adv_stats, source = sumer_client.fetch_page(url, fetch_selenium, "test-agent", parse_adv_analytics, client)
+    assert (source, adv_stats, loaded) == ("selenium", None, [url])
+    assert parse_adv_analytics(content)["team_stats"]["Houston Texans"][0] == {"Stat 7.0": {"value": "0.70", "rank": 8}, "Stat 7.1": {"value": "0.80", "rank": 9}}
+
+
+def test_client_rendered_page_is_reported():
+    client, _ = client_for(200, fixture("sumer_game_client_rendered.html"))
+    with pytest.raises(ValueError, match="rendered client-side"):
+        sumer_client.fetch_page_http(url, "test-agent", client)
@@ -0,0 +1,158 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Token, latency and cost accounting for every Claude and Perplexity call. Calls are tagged with the
+# game, stage and expert they were made for through a context variable: main() labels each game, and
+# pipeline.py labels stages and experts and carries the labels onto its worker threads, so the API
+# clients don't need to be told who they're working for.
+
+labels = contextvars.ContextVar("usage_labels", default={})
+
+
+@contextmanager
+def labelled(**tags):
+    token = labels.set({**labels.get(), **tags})
+    try:
+        yield
+    finally:
+        labels.reset(token)
+
+
+def carry_labels(fn, **tags):
+    # worker threads start with an empty context; wrap fn so it runs with the submitting thread's
+    # labels (plus tags). Each call gets its own copy, since one Context can't be entered twice at once
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        def labelled_call():
+            with labelled(**tags):
+                return fn(*args, **kwargs)
+        return context.copy().run(labelled_call)
+    return run
+
+
+# USD per million tokens (and per request for Perplexity's online models), from the providers'
+# published prices; cache writes and reads only apply to Claude
+prices = {
+    "claude-3-5-sonnet-20240620": {"input": 3.00, "output": 15.00, "cache_write": 3.75, "cache_read": 0.30},
+    "llama-3.1-sonar-small-128k-online": {"input": 0.20, "output": 0.20, "request": 0.005},
+    "llama-3.1-sonar-large-128k-online": {"input": 1.00, "output": 1.00, "request": 0.005},
+    "llama-3.1-sonar-huge-128k-online": {"input": 5.00, "output": 5.00, "request": 0.005},
+    "llama-3.1-8b-instruct": {"input": 0.20, "output": 0.20},
+}
+
+
+def cost(model, input_tokens, output_tokens, cache_write_tokens=0, cache_read_tokens=0):
+    price = prices.get(model)
+    if price is None:
+        return None
+    return (
+        input_tokens * price["input"]
+        + output_tokens * price["output"]
+        + cache_write_tokens * price.get("cache_write", price["input"])
+        + cache_read_tokens * price.get("cache_read", price["input"])
+    ) / 1_000_000 + price.get("request", 0)
+
+
+class UsageLog:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def record(self, provider, model, input_tokens, output_tokens, seconds, cache_write_tokens=0, cache_read_tokens=0, batch=False, first_token_seconds=None, truncated=False):
+        call = {
+            "game": "",
+            "stage": "",
+            "expert": "",
+            **labels.get(),
+            "provider": provider,
+            "model": model,
+            "input_tokens": input_tokens or 0,
+            "output_tokens": output_tokens or 0,
+            "cache_write_tokens": cache_write_tokens or 0,
+            "cache_read_tokens": cache_read_tokens or 0,
+            "seconds": seconds,
+            "first_token_seconds": first_token_seconds,
+            "batch": batch,
+            # stopped early on our side; output_tokens is then an estimate
+            "truncated": truncated,
+            "time": time.time(),
+        }
+        call["cost"] = cost(model, call["input_tokens"], call["output_tokens"], call["cache_write_tokens"], call["cache_read_tokens"])
+        if batch and call["cost"] is not None:
+            # Message Batches are billed at half the usual rates
+            call["cost"] /= 2
+        with self.lock:
+            self.calls.append(call)
+        return call
+
+    def record_claude(self, message, seconds, batch=False, first_token_seconds=None, output_tokens=None, truncated=False):
+        usage = message.usage
+        return self.record(
+            "anthropic",
+            message.model,
+            usage.input_tokens,
+            usage.output_tokens if output_tokens is None else output_tokens,
+            seconds,
+            cache_write_tokens = getattr(usage, "cache_creation_input_tokens", None),
+            cache_read_tokens = getattr(usage, "cache_read_input_tokens", None),
+            batch = batch,
+            first_token_seconds = first_token_seconds,
+            truncated = truncated,
+        )
+
+    def record_perplexity(self, response_json, model, seconds):
+        usage = response_json.get("usage") or {}
+        return self.record("perplexity", model, usage.get("prompt_tokens"), usage.get("completion_tokens"), seconds)
+
+    def frame(self):
+        with self.lock:
+            return pd.DataFrame(self.calls)
+
+    def summary(self, by="stage"):
+        calls = self.frame()
+        if calls.empty:
+            return calls
+        columns = ["input_tokens", "output_tokens", "cache_write_tokens", "cache_read_tokens", "seconds", "cost"]
+        summary = calls.groupby(by)[columns].sum()
+        summary.insert(0, "calls", calls.groupby(by).size())
+        summary.insert(1, "truncated", calls.groupby(by)["truncated"].sum())
+        # only streamed calls know when their first token arrived
+        summary["first_token_seconds"] = calls.groupby(by)["first_token_seconds"].mean()
+        return summary.sort_values("cost", ascending=False)
+
+    def report(self):
+        calls = self.frame()
+        if calls.empty:
+            print("No API calls made")
+            return
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print("API usage by stage:")
+            print(self.summary("stage"))
+            print("API usage by game:")
+            print(self.summary("game"))
+        print(
+            f"Total: {len(calls)} calls, {calls['input_tokens'].sum()} input / {calls['output_tokens'].sum()} output tokens, "
+            f"{calls['cache_read_tokens'].sum()} cache-read / {calls['cache_write_tokens'].sum()} cache-write tokens, ${calls['cost'].sum():.2f}"
+        )
+        prompt_tokens = calls[["input_tokens", "cache_read_tokens", "cache_write_tokens"]].to_numpy().sum()
+        if prompt_tokens:
+            print(f"Prompt cache hit rate: {calls['cache_read_tokens'].sum() / prompt_tokens:.0%} of prompt tokens")
+
+    def save(self, path):
+        # one line per call, appended, so a week's runs build up a history
+        with self.lock:
+            calls = list(self.calls)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            for call in calls:
+                f.write(json.dumps(call) + "\n")
+
+
+usage_log = UsageLog()